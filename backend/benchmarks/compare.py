@@ -0,0 +1,90 @@
+# Compares two benchmarks.endpoints result files case by case and flags
+# regressions beyond a relative threshold. Exits 1 when anything regressed so it
+# can gate a CI job.
+#
+#   cd backend && python -m benchmarks.compare results/1m/abc1234.json results/1m/def5678.json
+import argparse
+import json
+import sys
+
+# Metrics where a higher value is a regression
+METRICS = ("p50_ms", "p95_ms", "logical_reads_per_request", "peak_memory_bytes")
+
+
+def load(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def change(base, head):
+    if base is None or head is None:
+        return None
+    if base == 0:
+        return 0.0 if head == 0 else float("inf")
+    return (head - base) / base
+
+
+def compare(base, head, threshold, metrics=METRICS):
+    rows = []
+    regressions = []
+    for name in sorted(set(base["cases"]) | set(head["cases"])):
+        before = base["cases"].get(name)
+        after = head["cases"].get(name)
+        if before is None or after is None:
+            rows.append((name, "added" if before is None else "removed", []))
+            continue
+        if "error" in before or "error" in after:
+            rows.append((name, f"HTTP {before['status']} -> {after['status']}", []))
+            if "error" in after and "error" not in before:
+                regressions.append((name, "status", before["status"], after["status"]))
+            continue
+        deltas = []
+        for metric in metrics:
+            delta = change(before.get(metric), after.get(metric))
+            deltas.append((metric, before.get(metric), after.get(metric), delta))
+            if delta is not None and delta > threshold:
+                regressions.append((name, metric, before.get(metric), after.get(metric)))
+        rows.append((name, "", deltas))
+    return rows, regressions
+
+
+def format_delta(delta):
+    if delta is None:
+        return "n/a"
+    return f"{delta * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two endpoint benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative increase that counts as a regression")
+    parser.add_argument("--metric", nargs="*", default=list(METRICS), help="Metrics to compare")
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    if base.get("scale") != head.get("scale"):
+        print(f"Warning: comparing scale {base.get('scale')} against {head.get('scale')}")
+    print(f"base {base['commit']} ({base['recorded_at']})  vs  head {head['commit']} ({head['recorded_at']})")
+
+    rows, regressions = compare(base, head, args.threshold, args.metric)
+    print(f"{'case':<40}" + "".join(f"{metric:>28}" for metric in args.metric))
+    for name, note, deltas in rows:
+        if note:
+            print(f"{name:<40}{note:>28}")
+            continue
+        print(f"{name:<40}" + "".join(
+            f"{'-' if before is None else before:>11} -> {'-' if after is None else after:<8}{format_delta(delta):>5}"
+            for _, before, after, delta in deltas
+        ))
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold * 100:.0f}%:")
+        for name, metric, before, after in regressions:
+            print(f"  {name} {metric}: {before} -> {after}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
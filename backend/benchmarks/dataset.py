@@ -0,0 +1,312 @@
+# Builds a synthetic RMS-shaped database for the endpoint benchmarks at a fixed
+# scale factor. Everything is generated on the server with set-based
+# INSERT ... SELECT over a numbers CTE, one statement per chunk of lines, so a
+# 50M-line dataset is a few dozen round trips rather than millions.
+#
+#   cd backend && python -m benchmarks.dataset --scale 1m
+#
+# The target is a throwaway SQL Server (e.g. the mssql2022 container), taken from
+# BENCH_DB_SERVER / BENCH_DB_PORT / BENCH_DB_USER / BENCH_DB_PASSWORD. Each scale
+# gets its own database, VAT_BENCH_1M / 10M / 50M, which is dropped and rebuilt.
+import argparse
+import os
+import time
+from datetime import date
+
+import rollup
+from database import Database
+
+SCALES = {"1m": 1_000_000, "10m": 10_000_000, "50m": 50_000_000}
+LINES_PER_TRANSACTION = 4
+# Lines per INSERT ... SELECT; keeps each statement's log and tempdb use bounded
+CHUNK_ROWS = int(os.getenv("BENCH_CHUNK_ROWS", "1000000"))
+
+# Sales cover calendar 2024 so the benchmark cases can use fixed dates
+START_DATE = date(2024, 1, 1)
+DAYS = 366
+STORES = 10
+DEPARTMENTS = 20
+ITEMS = 5000
+
+# Column subset of the RMS tables in script.sql: every column the reports read,
+# with the same names, types and indexes
+SCHEMA = [
+    """
+    CREATE TABLE [dbo].[Tax](
+        [ID] [int] IDENTITY(1,1) NOT NULL,
+        [HQID] [int] NOT NULL DEFAULT ((0)),
+        [Description] [nvarchar](25) NOT NULL DEFAULT (''),
+        [Percentage] [real] NOT NULL DEFAULT ((0)),
+        CONSTRAINT [PK_Tax] PRIMARY KEY NONCLUSTERED ([ID] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[Store](
+        [ID] [int] NOT NULL,
+        [Name] [varchar](50) NOT NULL DEFAULT (''),
+        [StoreCode] [varchar](30) NOT NULL DEFAULT (''),
+        CONSTRAINT [PK_Store] PRIMARY KEY NONCLUSTERED ([ID] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[Department](
+        [HQID] [int] NOT NULL DEFAULT ((0)),
+        [ID] [int] IDENTITY(1,1) NOT NULL,
+        [Name] [nvarchar](30) NOT NULL DEFAULT (''),
+        [code] [nvarchar](17) NOT NULL DEFAULT (''),
+        [DBTimeStamp] [timestamp] NULL,
+        CONSTRAINT [PK_Department] PRIMARY KEY NONCLUSTERED ([ID] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[Item](
+        [ID] [int] IDENTITY(1,1) NOT NULL,
+        [ItemLookupCode] [nvarchar](25) NOT NULL DEFAULT (''),
+        [Description] [nvarchar](30) NOT NULL DEFAULT (''),
+        [DepartmentID] [int] NOT NULL DEFAULT ((0)),
+        [TaxID] [int] NOT NULL DEFAULT ((0)),
+        [Price] [money] NOT NULL DEFAULT ((0)),
+        [Cost] [money] NOT NULL DEFAULT ((0)),
+        [Quantity] [float] NOT NULL DEFAULT ((0)),
+        [Taxable] [bit] NOT NULL DEFAULT ((0)),
+        [DBTimeStamp] [timestamp] NULL,
+        CONSTRAINT [PK_Item] PRIMARY KEY NONCLUSTERED ([ID] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[Transaction](
+        [ShipToID] [int] NOT NULL DEFAULT ((0)),
+        [StoreID] [int] NOT NULL DEFAULT ((0)),
+        [TransactionNumber] [int] IDENTITY(1,1) NOT NULL,
+        [BatchNumber] [int] NOT NULL DEFAULT ((0)),
+        [Time] [datetime] NOT NULL DEFAULT (getdate()),
+        [CustomerID] [int] NOT NULL DEFAULT ((0)),
+        [CashierID] [int] NOT NULL DEFAULT ((0)),
+        [Total] [money] NOT NULL DEFAULT ((0)),
+        [SalesTax] [money] NOT NULL DEFAULT ((0)),
+        [Comment] [nvarchar](255) NOT NULL DEFAULT (''),
+        [ReferenceNumber] [nvarchar](50) NOT NULL DEFAULT (''),
+        [DBTimeStamp] [timestamp] NULL,
+        [Status] [int] NOT NULL DEFAULT ((0)),
+        CONSTRAINT [PK_Transaction] PRIMARY KEY NONCLUSTERED ([TransactionNumber] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[TransactionEntry](
+        [Commission] [money] NOT NULL DEFAULT ((0)),
+        [Cost] [money] NOT NULL DEFAULT ((0)),
+        [FullPrice] [money] NOT NULL DEFAULT ((0)),
+        [StoreID] [int] NOT NULL DEFAULT ((0)),
+        [ID] [int] IDENTITY(1,1) NOT NULL,
+        [TransactionNumber] [int] NOT NULL DEFAULT ((0)),
+        [ItemID] [int] NOT NULL DEFAULT ((0)),
+        [Price] [money] NOT NULL DEFAULT ((0)),
+        [PriceSource] [smallint] NOT NULL DEFAULT ((0)),
+        [Quantity] [float] NOT NULL DEFAULT ((0)),
+        [SalesRepID] [int] NOT NULL DEFAULT ((0)),
+        [Taxable] [bit] NOT NULL DEFAULT ((0)),
+        [DetailID] [int] NOT NULL DEFAULT ((0)),
+        [Comment] [nvarchar](255) NOT NULL DEFAULT (''),
+        [DBTimeStamp] [timestamp] NULL,
+        [SalesTax] [money] NOT NULL DEFAULT ((0)),
+        CONSTRAINT [PK_TransactionEntry] PRIMARY KEY NONCLUSTERED ([ID] ASC)
+    )""",
+    """
+    CREATE TABLE [dbo].[IX_ITEMOPENINGSTOCK](
+        [Lookupcode] [nvarchar](30) NULL,
+        [Description] [nvarchar](50) NULL,
+        [Department] [nvarchar](40) NULL,
+        [Quantity] [int] NULL,
+        [Cost] [numeric](25, 2) NULL,
+        [Price] [numeric](25, 2) NULL,
+        [Valuedate] [datetime] NOT NULL,
+        [ID] [int] IDENTITY(1,1) NOT NULL,
+        [DepartmentID] [int] NULL
+    )""",
+]
+
+# Created after the load, as in script.sql
+INDEXES = [
+    "CREATE NONCLUSTERED INDEX [IX_ItemID] ON [dbo].[TransactionEntry] ([ItemID] ASC)",
+    "CREATE NONCLUSTERED INDEX [IX_TransactionNumber] ON [dbo].[TransactionEntry] ([TransactionNumber] ASC)",
+    "CREATE NONCLUSTERED INDEX [IX_BatchNumber] ON [dbo].[Transaction] ([BatchNumber] ASC)",
+    "CREATE NONCLUSTERED INDEX [IX_CustomerID] ON [dbo].[Transaction] ([CustomerID] ASC)",
+]
+
+# Up to 10^8 sequential numbers starting at the second parameter
+NUMBERS = """
+    WITH E1(n) AS (SELECT 1 FROM (VALUES (1),(1),(1),(1),(1),(1),(1),(1),(1),(1)) v(n)),
+    E4(n) AS (SELECT 1 FROM E1 a CROSS JOIN E1 b CROSS JOIN E1 c CROSS JOIN E1 d),
+    E8(n) AS (SELECT 1 FROM E4 a CROSS JOIN E4 b),
+    Numbers(n) AS (
+        SELECT TOP (?) CAST(? AS BIGINT) + ROW_NUMBER() OVER (ORDER BY (SELECT NULL)) - 1 FROM E8
+    )"""
+
+
+def connection_settings():
+    return {
+        "server": os.getenv("BENCH_DB_SERVER", "localhost"),
+        "port": int(os.getenv("BENCH_DB_PORT", "1433")),
+        "username": os.getenv("BENCH_DB_USER", "SA"),
+        "password": os.getenv("BENCH_DB_PASSWORD", ""),
+    }
+
+
+def database_name(scale):
+    return f"VAT_BENCH_{scale.upper()}"
+
+
+def open_database(scale, database=None, **options):
+    return Database(database=database or database_name(scale), **connection_settings(), **options)
+
+
+def pick(key, salt, modulo, seed):
+    # Deterministic pseudo-random 0..modulo-1 per key, so a seed always builds the same data
+    # (masking rather than ABS, which overflows on INT_MIN)
+    return f"((CHECKSUM({key}, {int(seed)}, {int(salt)}) & 2147483647) % {int(modulo)})"
+
+
+def reference_statements(seed):
+    return [
+        ("INSERT INTO Tax (Description, Percentage) VALUES ('Exempt', 0), ('Standard', 16)", ()),
+        (f"""{NUMBERS}
+        INSERT INTO Store (ID, Name, StoreCode)
+        SELECT n.n, CONCAT('Store ', n.n), CONCAT('ST', RIGHT('000' + CAST(n.n AS VARCHAR(10)), 3))
+        FROM Numbers n""", (STORES, 1)),
+        (f"""{NUMBERS}
+        INSERT INTO Department (Name, code, HQID)
+        SELECT CONCAT('DEPARTMENT ', n.n), CONCAT('D', RIGHT('000' + CAST(n.n AS VARCHAR(10)), 3)), 1
+        FROM Numbers n ORDER BY n.n""", (DEPARTMENTS, 1)),
+        # One item in five is VAT exempt; cost sits at 55-85% of price
+        (f"""{NUMBERS}
+        INSERT INTO Item (ItemLookupCode, Description, DepartmentID, TaxID, Price, Cost, Quantity, Taxable)
+        SELECT
+            CONCAT('ITEM', n.n),
+            CONCAT('Item ', n.n),
+            1 + {pick("n.n", 2, DEPARTMENTS, seed)},
+            CASE WHEN {pick("n.n", 3, 5, seed)} = 0 THEN 1 ELSE 2 END,
+            p.Price,
+            ROUND(p.Price * (55 + {pick("n.n", 4, 30, seed)}) / 100, 2),
+            {pick("n.n", 5, 500, seed)},
+            CASE WHEN {pick("n.n", 3, 5, seed)} = 0 THEN 0 ELSE 1 END
+        FROM Numbers n
+        CROSS APPLY (SELECT CAST(1 + {pick("n.n", 6, 20000, seed)} / 100.0 AS MONEY) AS Price) p
+        ORDER BY n.n""", (ITEMS, 1)),
+        ("""
+        INSERT INTO IX_ITEMOPENINGSTOCK (Lookupcode, Description, Department, Quantity, Cost, Price, Valuedate, DepartmentID)
+        SELECT i.ItemLookupCode, i.Description, d.Name, CAST(i.Quantity AS INT), i.Cost, i.Price, ?, i.DepartmentID
+        FROM Item i JOIN Department d ON d.ID = i.DepartmentID""", (START_DATE,)),
+    ]
+
+
+def entry_statement(seed):
+    transaction = f"((e.n - 1) / {LINES_PER_TRANSACTION} + 1)"
+    return f"""{NUMBERS}
+        INSERT INTO TransactionEntry WITH (TABLOCK)
+            (ID, TransactionNumber, StoreID, ItemID, Price, FullPrice, Cost, Quantity, Taxable, SalesTax)
+        SELECT
+            x.ID, x.TransactionNumber, x.StoreID, i.ID, i.Price, i.Price, i.Cost, x.Quantity,
+            CASE WHEN tx.Percentage > 0 THEN 1 ELSE 0 END,
+            ROUND(x.Quantity * i.Price * tx.Percentage / 100, 2)
+        FROM (
+            SELECT
+                e.n AS ID,
+                {transaction} AS TransactionNumber,
+                1 + {pick(transaction, 7, STORES, seed)} AS StoreID,
+                1 + {pick("e.n", 8, ITEMS, seed)} AS ItemID,
+                1 + {pick("e.n", 9, 5, seed)} AS Quantity
+            FROM Numbers e
+        ) x
+        JOIN Item i ON i.ID = x.ItemID
+        JOIN Tax tx ON tx.ID = i.TaxID"""
+
+
+def header_statement(transactions):
+    # Times rise with TransactionNumber across the whole period, as the POS assigns them
+    seconds = DAYS * 86400
+    return f"""
+        INSERT INTO [Transaction] WITH (TABLOCK)
+            (TransactionNumber, StoreID, Time, Total, SalesTax)
+        SELECT
+            te.TransactionNumber,
+            MIN(te.StoreID),
+            DATEADD(SECOND, CAST((CAST(te.TransactionNumber AS BIGINT) - 1) * {seconds} / {int(transactions)} AS INT), CAST(? AS DATETIME)),
+            SUM(te.Quantity * te.Price + te.SalesTax),
+            SUM(te.SalesTax)
+        FROM TransactionEntry te
+        WHERE te.TransactionNumber BETWEEN ? AND ?
+        GROUP BY te.TransactionNumber"""
+
+
+def create_database(settings, name):
+    master = Database(settings["server"], "master", settings["username"], settings["password"], port=settings["port"], pool_size=1)
+    conn = master._create_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        IF DB_ID('{name}') IS NOT NULL
+        BEGIN
+            ALTER DATABASE [{name}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE;
+            DROP DATABASE [{name}];
+        END""")
+    cursor.execute(f"CREATE DATABASE [{name}]")
+    # Keeps the log from growing with every chunk
+    cursor.execute(f"ALTER DATABASE [{name}] SET RECOVERY SIMPLE")
+    cursor.close()
+    conn.close()
+    master.close()
+
+
+def build(scale, seed=7, database=None, fold_rollup=True):
+    settings = connection_settings()
+    name = database or database_name(scale)
+    lines = SCALES[scale]
+    transactions = lines // LINES_PER_TRANSACTION
+    chunk = max(CHUNK_ROWS // LINES_PER_TRANSACTION, 1)
+
+    started = time.perf_counter()
+    create_database(settings, name)
+    db = open_database(scale, database=name, pool_size=1)
+    conn = db._create_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    for statement, params in reference_statements(seed):
+        cursor.execute(statement, params)
+    print(f"Reference data loaded: {STORES} stores, {DEPARTMENTS} departments, {ITEMS} items")
+
+    for low in range(1, transactions + 1, chunk):
+        high = min(low + chunk - 1, transactions)
+        first_line = (low - 1) * LINES_PER_TRANSACTION + 1
+        line_count = (high - low + 1) * LINES_PER_TRANSACTION
+        cursor.execute("SET IDENTITY_INSERT TransactionEntry ON")
+        cursor.execute(entry_statement(seed), (line_count, first_line))
+        cursor.execute("SET IDENTITY_INSERT TransactionEntry OFF")
+        cursor.execute("SET IDENTITY_INSERT [Transaction] ON")
+        cursor.execute(header_statement(transactions), (START_DATE, low, high))
+        cursor.execute("SET IDENTITY_INSERT [Transaction] OFF")
+        print(f"  {high * LINES_PER_TRANSACTION:>12,} / {lines:,} lines ({time.perf_counter() - started:.0f}s)")
+
+    for statement in INDEXES:
+        cursor.execute(statement)
+    cursor.execute("EXEC sp_updatestats")
+    cursor.close()
+    conn.close()
+
+    if fold_rollup:
+        with db.connection() as pooled:
+            result = rollup.refresh(pooled)
+        print(f"Rollup folded {result['transactions_folded']:,} transactions")
+    db.close()
+    print(f"Built {name}: {lines:,} lines, {transactions:,} transactions in {time.perf_counter() - started:.0f}s")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a synthetic benchmark database at a fixed scale")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1m")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--database", help="Override the VAT_BENCH_<SCALE> database name")
+    parser.add_argument("--no-rollup", action="store_true", help="Leave the daily rollup empty so reports hit raw lines")
+    args = parser.parse_args()
+    build(args.scale, seed=args.seed, database=args.database, fold_rollup=not args.no_rollup)
+
+
+if __name__ == "__main__":
+    main()
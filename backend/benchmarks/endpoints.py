@@ -0,0 +1,263 @@
+# Latency, server-side reads and peak memory for every report endpoint against a
+# database built by benchmarks.dataset. Requests go through the real app in-process
+# (routing, shaping and serialization included) with the report cache cleared before
+# each one, so every request is a cold miss unless --cached is given.
+#
+#   cd backend && python -m benchmarks.endpoints --scale 1m --repeat 20
+#
+# Results land in benchmarks/results/<scale>/<commit>.json; compare two of them with
+# benchmarks.compare.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import httpx
+
+import logic
+import rollup
+from benchmarks import dataset
+from main import app
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Fixed windows inside the dataset's calendar year
+WINDOWS = {
+    "day": ("2024-06-14", "2024-06-14"),
+    "month": ("2024-06-01", "2024-06-30"),
+    "year": ("2024-01-01", "2024-12-31"),
+}
+STORE_ID = 1
+DEPARTMENT_ID = 1
+
+# Logical reads, rows and CPU of every cached plan in the benchmark database, keyed
+# per statement; the benchmark's own lookups are left out
+QUERY_STATS = """
+    SELECT
+        CONVERT(VARCHAR(130), qs.plan_handle, 1) + ':' + CAST(qs.statement_start_offset AS VARCHAR(12)),
+        qs.execution_count,
+        qs.total_logical_reads,
+        qs.total_rows,
+        qs.total_worker_time
+    FROM sys.dm_exec_query_stats qs
+    CROSS APPLY sys.dm_exec_plan_attributes(qs.plan_handle) pa
+    CROSS APPLY sys.dm_exec_sql_text(qs.sql_handle) st
+    WHERE pa.attribute = 'dbid' AND CAST(pa.value AS INT) = DB_ID()
+      AND st.text NOT LIKE '%dm_exec_query_stats%'
+"""
+
+
+def build_cases():
+    cases = []
+    filters = {
+        "all": {},
+        "store": {"StoreID": STORE_ID},
+        "department": {"DepartmentID": DEPARTMENT_ID},
+        "store+department": {"StoreID": STORE_ID, "DepartmentID": DEPARTMENT_ID},
+    }
+    for window, (start, end) in WINDOWS.items():
+        dates = {"start_date": start, "end_date": end}
+        for name, extra in filters.items():
+            cases.append((f"vat-return/{window}/{name}", "/vat-return", dict(dates, **extra)))
+        for name in ("all", "store"):
+            cases.append((f"vat-summary/{window}/{name}", "/vat-summary", dict(dates, **filters[name])))
+        for name in ("all", "department"):
+            cases.append((f"sales-dashboard/{window}/{name}", "/sales-dashboard", dict(dates, **filters[name])))
+        cases.append((f"vat-rates/{window}/all", "/vat-rates", dates))
+    year_start, year_end = WINDOWS["year"]
+    for granularity in ("month", "quarter"):
+        for name in ("all", "store"):
+            cases.append((
+                f"vat-return-periods/{granularity}/{name}", "/vat-return/periods",
+                dict({"start_date": year_start, "end_date": year_end, "granularity": granularity}, **filters[name]),
+            ))
+    cases.append(("vat-rates/all-time/all", "/vat-rates", {}))
+    cases.append(("departments/all-time/all", "/departments", {}))
+    # Line-level export grows with the scale factor, so only the smaller windows
+    for window in ("day", "month"):
+        start, end = WINDOWS[window]
+        cases.append((f"export-csv/{window}/all", "/vat-return/export", {"start_date": start, "end_date": end, "format": "csv"}))
+    # Reads every line in the window too, but holds one chunk at a time
+    for window in ("month", "year"):
+        start, end = WINDOWS[window]
+        cases.append((f"reconciliation/{window}/all", "/reconciliation", {"start_date": start, "end_date": end}))
+    # The year again as monthly partitions running in parallel, against the single query above
+    year = {"start_date": WINDOWS["year"][0], "end_date": WINDOWS["year"][1], "partition_days": 31}
+    cases.append(("vat-return/year/all/partitioned", "/vat-return", year))
+    cases.append(("vat-summary/year/all/partitioned", "/vat-summary", year))
+    return cases
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def read_query_stats(conn):
+    cursor = conn.cursor()
+    rows = cursor.execute(QUERY_STATS).fetchall()
+    cursor.close()
+    return {row[0]: (row[1], row[2], row[3], row[4]) for row in rows}
+
+
+def stats_delta(before, after):
+    executions = reads = rows = worker = 0
+    for key, (count, total_reads, total_rows, total_worker) in after.items():
+        previous = before.get(key, (0, 0, 0, 0))
+        # A plan recompiled mid-run restarts its counters
+        if count < previous[0]:
+            previous = (0, 0, 0, 0)
+        executions += count - previous[0]
+        reads += total_reads - previous[1]
+        rows += total_rows - previous[2]
+        worker += total_worker - previous[3]
+    return executions, reads, rows, worker
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+async def request(client, path, params, cached):
+    if not cached:
+        logic.report_cache.clear()
+    started = time.perf_counter()
+    response = await client.get(path, params=params)
+    elapsed = (time.perf_counter() - started) * 1000
+    return response, elapsed
+
+
+async def run_case(client, db, path, params, repeat, warmup, cached, query_stats):
+    for _ in range(warmup):
+        await request(client, path, params, cached)
+
+    before = await db.run(read_query_stats) if query_stats else None
+    timings = []
+    for _ in range(repeat):
+        response, elapsed = await request(client, path, params, cached)
+        if response.status_code != 200:
+            return {"path": path, "params": params, "status": response.status_code, "error": response.text[:500]}
+        timings.append(elapsed)
+    after = await db.run(read_query_stats) if query_stats else None
+
+    # One extra traced request: tracemalloc slows allocation too much to time under it
+    tracemalloc.start()
+    await request(client, path, params, cached)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "path": path,
+        "params": params,
+        "status": response.status_code,
+        "response_bytes": len(response.content),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "peak_memory_bytes": peak,
+    }
+    if query_stats:
+        executions, reads, rows, worker = stats_delta(before, after)
+        result.update({
+            "statements_per_request": round(executions / repeat, 2),
+            "logical_reads_per_request": round(reads / repeat),
+            "rows_per_request": round(rows / repeat),
+            "cpu_ms_per_request": round(worker / repeat / 1000, 3),
+        })
+    return result
+
+
+async def run(args):
+    db = dataset.open_database(args.scale, database=args.database).connect()
+    logic.db_instance = db
+    # An empty profile store, so a saved default connection does not replace the benchmark one
+    logic.profile_store.path = os.path.join(tempfile.mkdtemp(), "connections.db")
+    try:
+        query_stats = True
+        try:
+            await db.run(read_query_stats)
+        except Exception as e:
+            # Needs VIEW SERVER STATE; latency and memory are still worth recording
+            print("Query stats unavailable:", str(e))
+            query_stats = False
+
+        rollup_state = await db.run(rollup.status)
+        commit, dirty = git_revision()
+        report = {
+            "commit": commit,
+            "dirty": dirty,
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "scale": args.scale,
+            "database": db.database,
+            "rollup": rollup_state,
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "cached": args.cached,
+            "cases": {},
+        }
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            for name, path, params in build_cases():
+                if args.only and not any(pattern in name for pattern in args.only):
+                    continue
+                result = await run_case(client, db, path, params, args.repeat, args.warmup, args.cached, query_stats)
+                report["cases"][name] = result
+                if "error" in result:
+                    print(f"{name:<40} HTTP {result['status']}: {result['error']}")
+                    continue
+                print(
+                    f"{name:<40}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                    f"{result.get('logical_reads_per_request', 0):>14,}{result['peak_memory_bytes'] / 1024 / 1024:>10.1f}"
+                )
+    finally:
+        logic.db_instance = None
+        db.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every report endpoint against a synthetic dataset")
+    parser.add_argument("--scale", choices=sorted(dataset.SCALES), default="1m")
+    parser.add_argument("--database", help="Override the VAT_BENCH_<SCALE> database name")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--cached", action="store_true", help="Keep the report cache between requests")
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name contains one of these")
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/<scale>/<commit>.json")
+    args = parser.parse_args()
+
+    print(f"{'case':<40}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'reads/req':>14}{'peak MB':>10}")
+    report = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        suffix = "-dirty" if report["dirty"] else ""
+        output = os.path.join(RESULTS_DIR, args.scale, f"{report['commit']}{suffix}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2, default=str)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# Before/after latency of result shaping per endpoint, no database needed.
+# "before" is the old DataFrame path (read_sql frame, replace, iterrows/to_dict,
+# jsonable_encoder); "after" is shaping.shape plus FastJSONResponse.
+#
+#   cd backend && python -m benchmarks.shaping --repeat 200
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import logic
+import shaping
+
+
+def money(low, high):
+    return Decimal(str(round(random.uniform(low, high), 4)))
+
+
+def vat_return_rows(departments=20):
+    columns = ['DepartmentName', 'SalesInclusive', 'SalesExclusive', 'SalesTax', 'Vatable', 'NonVatable', 'SortOrder']
+    rows = [('TOTAL', money(1e6, 2e6), money(1e6, 2e6), money(1e5, 2e5), random.random() * 1e6, random.random() * 1e6, 0)]
+    for index in range(departments):
+        rows.append((f'DEPT {index}', money(1e4, 2e4), money(1e4, 2e4), money(1e3, 2e3), random.random() * 1e4, random.random() * 1e4, 1))
+    return columns, rows
+
+
+def vat_summary_rows(days=365):
+    columns = ['TransactionDate', 'TotalExcl', 'TotalVAT', 'TotalIncl', 'TransactionCount']
+    start = date(2024, 1, 1)
+    return columns, [
+        (start + timedelta(days=index), money(1e4, 2e4), money(1e3, 2e3), money(1e4, 2e4), random.randint(100, 900))
+        for index in range(days)
+    ]
+
+
+def vat_rate_rows(rates=40):
+    columns = ['vat_rate', 'department', 'item_count', 'total_sales', 'total_vat']
+    return columns, [
+        (random.choice([0.0, 16.0]), f'DEPT {index}', random.randint(1, 500), random.random() * 1e5, None if index % 7 == 0 else random.random() * 1e4)
+        for index in range(rates)
+    ]
+
+
+def before_vat_return(columns, rows):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df = df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
+    totals_row = df[df['DepartmentName'] == 'TOTAL'].iloc[0]
+    summary = {name: round(float(totals_row[name]), 2) for name in ['SalesInclusive', 'SalesExclusive', 'SalesTax', 'Vatable', 'NonVatable']}
+    departments_list = []
+    for _, row in df[df['DepartmentName'] != 'TOTAL'].iterrows():
+        departments_list.append({
+            "DepartmentName": row['DepartmentName'],
+            "SalesInclusive": round(float(row['SalesInclusive']), 2),
+            "SalesExclusive": round(float(row['SalesExclusive']), 2),
+            "SalesTax": round(float(row['SalesTax']), 2),
+            "Vatable": round(float(row['Vatable']), 2),
+            "NonVatable": round(float(row['NonVatable']), 2)
+        })
+    return JSONResponse(jsonable_encoder({"departments": departments_list, "summary": summary}))
+
+
+def after_vat_return(columns, rows):
+    records = shaping.shape(columns, rows, logic.VAT_RETURN_COLUMNS)
+    for record in records[1:]:
+        del record['SortOrder']
+    return shaping.FastJSONResponse({"departments": records[1:], "summary": records[0]})
+
+
+def before_vat_summary(columns, rows):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df = df.replace({np.nan: 0})
+    return JSONResponse(jsonable_encoder({
+        "summary": {
+            "total_sales_excl_vat": round(df['TotalExcl'].sum(), 2),
+            "total_vat_amount": round(df['TotalVAT'].sum(), 2),
+            "total_sales_incl_vat": round(df['TotalIncl'].sum(), 2),
+            "total_transactions": int(df['TransactionCount'].sum())
+        },
+        "daily_breakdown": df.to_dict(orient="records")
+    }))
+
+
+def after_vat_summary(columns, rows):
+    daily_breakdown = shaping.shape(columns, rows, logic.VAT_SUMMARY_COLUMNS)
+    return shaping.FastJSONResponse({
+        "summary": {
+            "total_sales_excl_vat": shaping.column_total(daily_breakdown, 'TotalExcl'),
+            "total_vat_amount": shaping.column_total(daily_breakdown, 'TotalVAT'),
+            "total_sales_incl_vat": shaping.column_total(daily_breakdown, 'TotalIncl'),
+            "total_transactions": sum(day['TransactionCount'] for day in daily_breakdown)
+        },
+        "daily_breakdown": daily_breakdown
+    })
+
+
+def before_vat_rates(columns, rows):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    result = df.astype(object).where(pd.notnull(df), None).to_dict(orient="records")
+    return JSONResponse(jsonable_encoder({"vat_rates": result}))
+
+
+def after_vat_rates(columns, rows):
+    return shaping.FastJSONResponse({"vat_rates": shaping.shape(columns, rows, logic.VAT_RATE_COLUMNS)})
+
+
+ENDPOINTS = {
+    "/vat-return": (vat_return_rows, before_vat_return, after_vat_return),
+    "/vat-summary": (vat_summary_rows, before_vat_summary, after_vat_summary),
+    "/vat-rates": (vat_rate_rows, before_vat_rates, after_vat_rates),
+}
+
+
+def measure(fn, columns, rows, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(columns, rows)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare DataFrame and direct result shaping per endpoint")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print(f"{'endpoint':<16}{'rows':>6}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for endpoint, (make_rows, before, after) in ENDPOINTS.items():
+        columns, rows = make_rows()
+        before_ms = measure(before, columns, rows, args.repeat)
+        after_ms = measure(after, columns, rows, args.repeat)
+        print(f"{endpoint:<16}{len(rows):>6}{before_ms:>12.3f}{after_ms:>12.3f}{before_ms / after_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
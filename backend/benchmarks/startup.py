@@ -0,0 +1,112 @@
+# Cold start of the desktop backend: launches it the way Electron does, polls GET / until
+# it answers and then reads the backend's own phase timings from GET /startup.
+#
+#   cd backend && python -m benchmarks.startup --repeat 5
+#   cd backend && python -m benchmarks.startup --command dist/main/main.exe
+#
+# Results land in benchmarks/results/startup/<commit>.json.
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results", "startup")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_SECONDS = 0.01
+
+
+def git_revision():
+    # Same as benchmarks.endpoints, which would import the whole app into this process
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def launch(command, port, timeout):
+    env = dict(os.environ, DESKTOP_PORT=str(port))
+    launched_at = time.time()
+    env["APP_LAUNCHED_AT"] = str(int(launched_at * 1000))
+    process = subprocess.Popen(
+        command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(base_url=base_url, timeout=timeout) as client:
+            deadline = time.time() + timeout
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Backend exited with code {process.returncode} before answering")
+                if time.time() > deadline:
+                    raise RuntimeError(f"Backend did not answer within {timeout} s")
+                try:
+                    if client.get("/").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(POLL_SECONDS)
+            health_ms = (time.time() - launched_at) * 1000
+            # Waits for the app itself, which is what the first report needs
+            phases = client.get("/startup").json()
+            ready_ms = (time.time() - launched_at) * 1000
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    return {"health_ms": round(health_ms, 1), "app_ready_ms": round(ready_ms, 1), "backend": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the desktop backend from launch to its first responses")
+    parser.add_argument("--command", help="Backend to launch, defaults to python desktop.py")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Result file, defaults to benchmarks/results/startup/<commit>.json")
+    args = parser.parse_args()
+
+    command = shlex.split(args.command) if args.command else [sys.executable, "desktop.py"]
+    runs = []
+    print(f"{'run':<6}{'health ms':>12}{'app ready ms':>15}")
+    for index in range(args.repeat):
+        run = launch(command, args.port, args.timeout)
+        runs.append(run)
+        print(f"{index + 1:<6}{run['health_ms']:>12.1f}{run['app_ready_ms']:>15.1f}")
+
+    commit, dirty = git_revision()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "command": command,
+        "repeat": args.repeat,
+        "health_p50_ms": round(statistics.median(run["health_ms"] for run in runs), 1),
+        "app_ready_p50_ms": round(statistics.median(run["app_ready_ms"] for run in runs), 1),
+        "runs": runs,
+    }
+    print(f"p50     {report['health_p50_ms']:>12.1f}{report['app_ready_p50_ms']:>15.1f}")
+
+    output = args.output
+    if output is None:
+        suffix = "-dirty" if dirty else ""
+        output = os.path.join(RESULTS_DIR, f"{commit}{suffix}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2, default=str)
+    print("Results written to", output)
+
+
+if __name__ == "__main__":
+    main()
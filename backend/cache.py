@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from database import read_only
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.getenv("REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_SECONDS = float(os.getenv("REPORT_CACHE_TTL_SECONDS", "300"))
+# Polling dashboards share one watermark lookup per interval instead of one per request
+WATERMARK_CHECK_SECONDS = float(os.getenv("REPORT_CACHE_WATERMARK_SECONDS", "2"))
+
+WATERMARK_QUERY = "SELECT MAX(TransactionNumber), MAX(Time) FROM [Transaction]"
+
+
+def normalize_param(value):
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value.strip(), "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            return value.strip()
+    return value
+
+
+def make_key(endpoint, params):
+    return (endpoint,) + tuple(sorted((name, normalize_param(value)) for name, value in params.items()))
+
+
+@read_only
+def read_watermark(conn):
+    cursor = conn.cursor()
+    row = cursor.execute(WATERMARK_QUERY).fetchone()
+    cursor.close()
+    return (row[0], row[1].isoformat() if row[1] else None)
+
+
+class CacheEntry:
+    # Results are kept pickled, so every caller gets a copy it is free to modify
+    def __init__(self, encoded, watermark, expires_at):
+        self.encoded = encoded
+        self.watermark = watermark
+        self.expires_at = expires_at
+        self.size = len(encoded)
+
+
+class ReportCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS,
+                 watermark_interval=WATERMARK_CHECK_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.watermark_interval = watermark_interval
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._watermarks = {}
+        self._watermark_tasks = {}
+        # Bumped by clear(), so a query started before it never stores its result after it
+        self._generation = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    async def current_watermark(self, db):
+        scope = (db.server, db.database)
+        checked = self._watermarks.get(scope)
+        if checked and time.monotonic() - checked[1] < self.watermark_interval:
+            return checked[0]
+        # Concurrent misses wait on the same lookup
+        generation = self._generation
+        task = self._watermark_tasks.get(scope)
+        if task is None:
+            task = asyncio.ensure_future(db.run(read_watermark))
+            self._watermark_tasks[scope] = task
+            task.add_done_callback(lambda _: self._watermark_tasks.pop(scope, None))
+        watermark = await asyncio.shield(task)
+        if generation == self._generation:
+            self._watermarks[scope] = (watermark, time.monotonic())
+        return watermark
+
+    async def get_or_compute(self, db, endpoint, params, compute):
+        scope = (db.server, db.database)
+        key = (scope,) + make_key(endpoint, params)
+        try:
+            watermark = await self.current_watermark(db)
+        except Exception as e:
+            # Without a watermark nothing can be validated, so go straight to the database
+            logger.warning("Cache watermark lookup failed: %s", e)
+            return await compute()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.watermark == watermark and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return pickle.loads(entry.encoded)
+            self._remove(key)
+            self.invalidations += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return pickle.loads(await asyncio.shield(task))
+
+        self.misses += 1
+        # The query runs as its own task so a disconnecting client doesn't cancel it for the others
+        task = asyncio.ensure_future(self._fill(key, watermark, compute, self._generation))
+        self._inflight[key] = task
+        return pickle.loads(await asyncio.shield(task))
+
+    async def _fill(self, key, watermark, compute, generation):
+        try:
+            encoded = pickle.dumps(await compute(), pickle.HIGHEST_PROTOCOL)
+            if generation == self._generation:
+                self._store(key, encoded, watermark)
+            return encoded
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def _store(self, key, encoded, watermark):
+        if len(encoded) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        entry = CacheEntry(encoded, watermark, time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self):
+        # Queries already running still answer their callers, but later requests start
+        # their own instead of joining them
+        self._generation += 1
+        self._entries.clear()
+        self._inflight.clear()
+        self._watermarks.clear()
+        self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+        }
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import shaping
+
+logger = logging.getLogger(__name__)
+
+CLOSED_PERIODS_PATH = os.getenv("CLOSED_PERIODS_PATH", os.path.join(os.path.expanduser("~"), ".vat-closed-periods.db"))
+# store_id of the results computed without a StoreID filter
+ALL_STORES = -1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS closed_period (
+    id INTEGER PRIMARY KEY,
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    closed_at TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    UNIQUE (server, database, start_date, end_date)
+);
+CREATE TABLE IF NOT EXISTS closed_result (
+    period_id INTEGER NOT NULL REFERENCES closed_period (id),
+    report TEXT NOT NULL,
+    store_id INTEGER NOT NULL,
+    content BLOB NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (period_id, report, store_id)
+);
+CREATE TRIGGER IF NOT EXISTS closed_period_no_update BEFORE UPDATE ON closed_period
+BEGIN SELECT RAISE(ABORT, 'closed periods cannot change'); END;
+CREATE TRIGGER IF NOT EXISTS closed_period_no_delete BEFORE DELETE ON closed_period
+BEGIN SELECT RAISE(ABORT, 'closed periods cannot change'); END;
+CREATE TRIGGER IF NOT EXISTS closed_result_no_update BEFORE UPDATE ON closed_result
+BEGIN SELECT RAISE(ABORT, 'closed periods cannot change'); END;
+CREATE TRIGGER IF NOT EXISTS closed_result_no_delete BEFORE DELETE ON closed_result
+BEGIN SELECT RAISE(ABORT, 'closed periods cannot change'); END;
+"""
+
+
+class PeriodOverlap(Exception):
+    pass
+
+
+class ClosedPeriodCorrupt(Exception):
+    pass
+
+
+def digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def period_digest(result_hashes):
+    # Over every stored result, so one hash vouches for the whole period
+    lines = sorted(f"{report}:{store_id}:{content_hash}" for report, store_id, content_hash in result_hashes)
+    return digest("\n".join(lines).encode("utf-8"))
+
+
+class ClosedPeriodStore:
+    # Results of filed periods, computed once at close and then served from a local
+    # SQLite file. Rows are never updated or deleted, and each carries a SHA-256 of its
+    # exact bytes that every read checks.
+    def __init__(self, path=CLOSED_PERIODS_PATH):
+        self.path = path
+        self.periods = {}
+        # (mtime, size) of the file when the periods were read; another worker's close changes it
+        self._seen = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._read_periods()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_periods(self):
+        seen = self._stat()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, server, database, start_date, end_date, closed_at, content_hash FROM closed_period"
+            ).fetchall()
+        periods = {}
+        for row in rows:
+            periods.setdefault((row[1], row[2]), []).append(self._period(row))
+        for scope_periods in periods.values():
+            scope_periods.sort(key=lambda period: period["start_date"])
+        self.periods = periods
+        self._seen = seen
+
+    def _scope_periods(self, scope):
+        # One stat per lookup; the periods are reread only after a write
+        if self._seen is not None and self._stat() != self._seen:
+            self._read_periods()
+        return self.periods.get(scope, [])
+
+    @staticmethod
+    def _period(row):
+        return {"id": row[0], "start_date": row[3], "end_date": row[4], "closed_at": row[5], "content_hash": row[6]}
+
+    def list(self, scope):
+        return list(self._scope_periods(scope))
+
+    def covering(self, scope, start_date, end_date):
+        # Closed periods lying wholly inside [start_date, end_date], oldest first
+        return [
+            period for period in self._scope_periods(scope)
+            if period["start_date"] >= start_date and period["end_date"] <= end_date
+        ]
+
+    def exact(self, scope, start_date, end_date):
+        for period in self._scope_periods(scope):
+            if period["start_date"] == start_date and period["end_date"] == end_date:
+                return period
+        return None
+
+    def overlapping(self, scope, start_date, end_date):
+        # Periods include both boundary days, so adjoining ones start the day after the
+        # previous one ends and never share a date
+        return [
+            period for period in self._scope_periods(scope)
+            if period["start_date"] <= end_date and start_date <= period["end_date"]
+        ]
+
+    def load(self, period_id, report, store_id=None):
+        # None when the period was closed without this result (a store added later)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT content, content_hash FROM closed_result WHERE period_id = ? AND report = ? AND store_id = ?",
+                (period_id, report, ALL_STORES if store_id is None else store_id),
+            ).fetchone()
+        if row is None:
+            return None
+        content, content_hash = bytes(row[0]), row[1]
+        if digest(content) != content_hash:
+            raise ClosedPeriodCorrupt(f"Closed period {period_id} {report} failed its hash check")
+        return json.loads(content)
+
+    def close(self, scope, start_date, end_date, results):
+        # results: {(report, store_id or None): result}
+        encoded = [
+            (report, ALL_STORES if store_id is None else store_id, shaping.dumps(result))
+            for (report, store_id), result in results.items()
+        ]
+        hashes = [(report, store_id, digest(content)) for report, store_id, content in encoded]
+        content_hash = period_digest(hashes)
+        closed_at = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._connect() as conn:
+            # Takes the write lock before the overlap check, so two workers closing at
+            # once cannot both pass it
+            conn.execute("BEGIN IMMEDIATE")
+            clash = conn.execute(
+                "SELECT start_date, end_date FROM closed_period "
+                "WHERE server = ? AND database = ? AND start_date <= ? AND ? <= end_date",
+                scope + (end_date, start_date),
+            ).fetchone()
+            if clash:
+                raise PeriodOverlap(f"Overlaps closed period {clash[0]} to {clash[1]}")
+            cursor = conn.execute(
+                "INSERT INTO closed_period (server, database, start_date, end_date, closed_at, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                scope + (start_date, end_date, closed_at, content_hash),
+            )
+            period_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO closed_result (period_id, report, store_id, content, content_hash) VALUES (?, ?, ?, ?, ?)",
+                [(period_id, report, store_id, content, hashes[index][2])
+                 for index, (report, store_id, content) in enumerate(encoded)],
+            )
+        self._read_periods()
+        period = self._period((period_id, scope[0], scope[1], start_date, end_date, closed_at, content_hash))
+        logger.info("Closed %s to %s for %s/%s (%s)", start_date, end_date, scope[0], scope[1], content_hash)
+        return dict(period, results=len(encoded))
+
+    def verify(self, period_id):
+        with self._connect() as conn:
+            period = conn.execute("SELECT content_hash FROM closed_period WHERE id = ?", (period_id,)).fetchone()
+            if period is None:
+                return None
+            rows = conn.execute(
+                "SELECT report, store_id, content, content_hash FROM closed_result WHERE period_id = ?", (period_id,)
+            ).fetchall()
+        mismatched = [
+            {"report": report, "store_id": None if store_id == ALL_STORES else store_id}
+            for report, store_id, content, content_hash in rows
+            if digest(bytes(content)) != content_hash
+        ]
+        recomputed = period_digest([(report, store_id, digest(bytes(content))) for report, store_id, content, _ in rows])
+        return {
+            "id": period_id,
+            "content_hash": period[0],
+            "recomputed_hash": recomputed,
+            "results": len(rows),
+            "mismatched": mismatched,
+            "ok": not mismatched and recomputed == period[0],
+        }
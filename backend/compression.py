@@ -0,0 +1,119 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this go out as they are; streamed bodies are always compressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# Cheap levels: most of the size win for a fraction of the CPU of the maximum settings
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Already compressed formats gain nothing from another pass; event streams go out
+# uncompressed so no proxy or client holds an event back waiting for more bytes
+SKIP_TYPES = ("application/vnd.apache.parquet", "application/gzip", "application/zip", "image/", "text/event-stream")
+
+
+class GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data, final):
+        # A sync flush per chunk keeps streamed exports arriving as they are produced
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data, final):
+        return self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+
+
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS["br"] = BrotliEncoder
+
+
+def choose_encoding(header):
+    # Brotli when offered and available, then gzip; q=0 rules a coding out
+    offered = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip().lower()] = quality
+    for coding in ("br", "gzip"):
+        quality = offered.get(coding, offered.get("*", 0.0))
+        if coding in ENCODERS and quality > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    # gzip or brotli per Accept-Encoding. Unlike Starlette's GZipMiddleware it also
+    # speaks brotli; like it, it streams chunked responses such as the exports.
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        encoder = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compressing pays
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if encoder is None:
+                headers = MutableHeaders(raw=start["headers"])
+                content_type = headers.get("content-type", "")
+                if ("content-encoding" in headers or content_type.startswith(SKIP_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                encoder = ENCODERS[coding]()
+                headers["Content-Encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                body = encoder.compress(body, not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            await send({"type": "http.response.body", "body": encoder.compress(body, not more_body), "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
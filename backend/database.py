@@ -1,15 +1,165 @@
-import pyodbc
+import asyncio
+import contextvars
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+import startup
+
+# Pool settings can be tuned per deployment through the environment
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))
+
+# SQLSTATE classes that mean the connection itself is gone
+CONNECTION_ERROR_STATES = ("08", "HYT00", "HYT01")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def driver():
+    # pyodbc brings up the ODBC driver manager, so it loads with the first connection
+    return startup.load("pyodbc")
+
+
+def is_connection_error(error):
+    # pandas wraps driver errors, so look at the original cause as well
+    if error.__cause__ is not None and is_connection_error(error.__cause__):
+        return True
+    pyodbc = sys.modules.get("pyodbc")
+    if pyodbc is None:
+        # No connection was ever opened, so this is not a driver error
+        return False
+    if isinstance(error, pyodbc.OperationalError):
+        return True
+    state = str(error.args[0]) if getattr(error, "args", None) else ""
+    return isinstance(error, pyodbc.Error) and state.startswith(CONNECTION_ERROR_STATES)
+
+
+def read_only(fn):
+    # Marks fn(conn, ...) as safe to run again on a fresh connection when the pooled one dies
+    fn.read_only = True
+    return fn
+
+
+@read_only
+def fetch_rows(conn, query, params=None):
+    cursor = conn.cursor()
+    try:
+        started = time.perf_counter()
+        cursor.execute(query, params or ())
+        executed = time.perf_counter()
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+        metrics.record_query(query, params, executed - started, time.perf_counter() - executed, len(rows))
+        return columns, rows
+    except Exception:
+        metrics.record_query_error(query)
+        raise
+    finally:
+        cursor.close()
+
+
+@read_only
+def read_frame(conn, query, params=None):
+    # pandas executes and fetches in one call, so the whole time counts as fetch
+    try:
+        started = time.perf_counter()
+        df = startup.load("pandas").read_sql(query, conn, params=params)
+    except Exception:
+        metrics.record_query_error(query)
+        raise
+    metrics.record_query(query, params, 0.0, time.perf_counter() - started, len(df))
+    return df
+
+
+class ConnectionPool:
+    def __init__(self, creator, size=POOL_SIZE, timeout=POOL_TIMEOUT, check_after=POOL_CHECK_AFTER):
+        self.creator = creator
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def acquire(self):
+        if self._closed:
+            raise Exception("Connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"Timed out after {self.timeout}s waiting for a database connection")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.creator()
+                # Only ping connections that sat idle long enough to have been dropped
+                if time.monotonic() - last_used < self.check_after or self._is_alive(conn):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+                return
+            try:
+                conn.rollback()
+            except driver().Error:
+                self._discard(conn)
+                return
+            self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def _is_alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1").fetchone()
+            cursor.close()
+            return True
+        except driver().Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except driver().Error:
+            pass
+
 
 class Database:
-    def __init__(self, server, database, username, password, port=1433):
+    def __init__(self, server, database, username, password, port=1433, pool_size=POOL_SIZE, pool_timeout=POOL_TIMEOUT):
         self.server = server
         self.database = database
         self.username = username
         self.password = password
         self.port = port
-        self.conn = None
+        self.pool = ConnectionPool(self._create_connection, size=pool_size, timeout=pool_timeout)
+        # One worker per pooled connection so N report requests run on N connections
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
 
-    def connect(self):
+    def _create_connection(self):
         conn_str = (
                 f"DRIVER={{ODBC Driver 17 for SQL Server}};"
                 f"SERVER={self.server},{self.port};"
@@ -20,12 +170,56 @@ class Database:
             )
 
         try:
-            self.conn = pyodbc.connect(conn_str)
-            return self.conn
+            return driver().connect(conn_str)
         except Exception as e:
             raise Exception(f"Database connection failed: {e}")
-            
-    def get_connection(self):
-        if not self.conn:
-            self.connect()
-        return self.conn
\ No newline at end of file
+
+    def connect(self):
+        # Check out one connection so bad credentials fail at /connect-db time
+        with self.connection():
+            pass
+        return self
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        conn = self.pool.acquire()
+        acquired = time.perf_counter()
+        metrics.POOL_WAIT_SECONDS.observe(acquired - started, endpoint=metrics.endpoint.get())
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = is_connection_error(e)
+            raise
+        finally:
+            self.pool.release(conn, broken=broken)
+            metrics.DB_CALL_SECONDS.observe(time.perf_counter() - acquired, endpoint=metrics.endpoint.get())
+
+    def _call(self, fn, args):
+        try:
+            with self.connection() as conn:
+                return fn(conn, *args)
+        except Exception as e:
+            if not (is_connection_error(e) and getattr(fn, "read_only", False)):
+                raise
+        # The pooled connection died under a read, retry once on a fresh one; a writer
+        # may have gotten through, so its error is the caller's to handle
+        with self.connection() as conn:
+            return fn(conn, *args)
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        # Executor threads don't inherit contextvars; carry the request's labels over
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, self._call, fn, args)
+
+    async def read_sql(self, query, params=None):
+        return await self.run(read_frame, query, params)
+
+    async def fetch_rows(self, query, params=None):
+        return await self.run(fetch_rows, query, params)
+
+    def close(self):
+        self.pool.close()
+        self.executor.shutdown(wait=False)
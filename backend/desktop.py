@@ -0,0 +1,14 @@
+import startup
+import os
+
+import uvicorn
+
+startup.timer.mark("server_imported")
+
+# Entry point of the packaged desktop build. The server starts listening before the app
+# module is imported, so Electron's health check passes while reports are still loading.
+DESKTOP_HOST = os.getenv("DESKTOP_HOST", "127.0.0.1")
+DESKTOP_PORT = int(os.getenv("DESKTOP_PORT", "8000"))
+
+if __name__ == "__main__":
+    uvicorn.run(startup.LazyApp("main"), host=DESKTOP_HOST, port=DESKTOP_PORT)
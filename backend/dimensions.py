@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from database import fetch_rows, read_only
+
+logger = logging.getLogger(__name__)
+
+# How often a request may look for changes to the dimension tables; in between the
+# cached lookups are used without touching the database
+DIMENSION_CHECK_SECONDS = float(os.getenv("DIMENSION_CHECK_SECONDS", "60"))
+# IDs the cache does not know force an early check, but at most this often, since some
+# (an item's DepartmentID 0, say) never turn up
+FORCED_CHECK_SECONDS = 5
+
+# Only the columns the reports resolve; the wide Item table is read as three numbers a row
+DIMENSION_QUERIES = {
+    "department": "SELECT ID, Name FROM Department",
+    "store": "SELECT ID, Name FROM Store",
+    "tax": "SELECT ID, Description, CAST(Percentage AS FLOAT) FROM Tax",
+    "item": "SELECT ID, DepartmentID, TaxID FROM Item",
+}
+DIMENSION_TABLES = {"department": "Department", "store": "Store", "tax": "Tax", "item": "Item"}
+# Columns hashed when the rowversion check is not available
+CHECKSUM_COLUMNS = {
+    "department": "ID, Name",
+    "store": "ID, Name",
+    "tax": "ID, Percentage",
+    "item": "ID, DepartmentID, TaxID",
+}
+
+# Every insert or update raises MAX(DBTimeStamp) (a rowversion) and a delete lowers the
+# count, so the pair changes whenever the table does. One round trip for all four tables.
+ROWVERSION_SIGNATURE_QUERY = "SELECT " + ", ".join(
+    f"(SELECT COUNT_BIG(*) FROM {table}), (SELECT MAX(DBTimeStamp) FROM {table})"
+    for table in DIMENSION_TABLES.values()
+)
+CHECKSUM_SIGNATURE_QUERY = "SELECT " + ", ".join(
+    f"(SELECT COUNT_BIG(*) FROM {table}), (SELECT CHECKSUM_AGG(BINARY_CHECKSUM({CHECKSUM_COLUMNS[kind]})) FROM {table})"
+    for kind, table in DIMENSION_TABLES.items()
+)
+
+
+@read_only
+def read_signatures(conn):
+    # {kind: signature}, or None when neither check works (e.g. a local snapshot)
+    for query in (ROWVERSION_SIGNATURE_QUERY, CHECKSUM_SIGNATURE_QUERY):
+        cursor = conn.cursor()
+        try:
+            row = tuple(cursor.execute(query).fetchone())
+            return {kind: row[2 * index:2 * index + 2] for index, kind in enumerate(DIMENSION_TABLES)}
+        except Exception as e:
+            logger.debug("Dimension signature query failed: %s", e)
+            conn.rollback()
+        finally:
+            cursor.close()
+    return None
+
+
+@read_only
+def read_tables(conn, kinds):
+    return {kind: parse_table(kind, fetch_rows(conn, DIMENSION_QUERIES[kind])[1]) for kind in kinds}
+
+
+def parse_table(kind, rows):
+    if kind == "item":
+        return ItemLookup(rows)
+    if kind == "tax":
+        return {row[0]: (row[1], None if row[2] is None else float(row[2])) for row in rows}
+    return {row[0]: row[1] for row in rows}
+
+
+class ItemLookup:
+    # Item ID -> (DepartmentID, TaxID) as sorted arrays; NaN stands for NULL or an unknown item
+    def __init__(self, rows):
+        table = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, 3)
+        table = table[np.argsort(table[:, 0], kind="stable")]
+        self.ids = table[:, 0]
+        self.departments = table[:, 1]
+        self.taxes = table[:, 2]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, item_ids):
+        position = np.minimum(np.searchsorted(self.ids, item_ids), max(len(self.ids) - 1, 0))
+        found = (self.ids[position] == item_ids) if len(self.ids) else np.zeros(len(item_ids), dtype=bool)
+        return position, found
+
+    def lookup(self, item_ids):
+        position, found = self.positions(item_ids)
+        if not len(self.ids):
+            missing = np.full(len(item_ids), np.nan)
+            return missing, missing.copy()
+        return (np.where(found, self.departments[position], np.nan),
+                np.where(found, self.taxes[position], np.nan))
+
+    def has(self, item_ids):
+        item_ids = np.asarray(item_ids, dtype=np.float64)
+        return bool(self.positions(item_ids[~np.isnan(item_ids)])[1].all())
+
+
+class Dimensions:
+    # tables: {kind: parsed table}; departments and stores map ID -> name, taxes ID -> (description, rate)
+    def __init__(self, tables):
+        self.tables = tables
+        self.departments = tables["department"]
+        self.stores = tables["store"]
+        self.taxes = tables["tax"]
+        self.items = tables["item"]
+
+    def has(self, kind, ids):
+        if kind == "item":
+            return self.items.has(ids)
+        return all(value is None or value in self.tables[kind] for value in ids)
+
+    def department_name(self, department_id):
+        return self.departments.get(department_id)
+
+    def tax_rate(self, tax_id):
+        return self.taxes.get(tax_id, (None, None))[1]
+
+    def tax_rate_array(self, tax_ids):
+        # NaN for lines whose item has no tax or an unknown one
+        rates = np.full(len(tax_ids), np.nan)
+        for tax_id, (_, rate) in self.taxes.items():
+            if rate is not None:
+                rates[tax_ids == tax_id] = rate
+        return rates
+
+
+class DimensionEntry:
+    def __init__(self, signatures, tables):
+        self.signatures = signatures
+        self.dimensions = Dimensions(tables)
+        self.checked_at = time.monotonic()
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+
+
+class DimensionCache:
+    # Department, Store, Tax and the item -> department/tax mapping per database. Report
+    # queries group by IDs and the names and rates are resolved from here; a table is
+    # reloaded only when its signature changes.
+    def __init__(self, check_interval=DIMENSION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._locks = {}
+        self.checks = 0
+        self.reloads = {kind: 0 for kind in DIMENSION_TABLES}
+
+    def _fresh(self, entry, force):
+        interval = FORCED_CHECK_SECONDS if force else self.check_interval
+        return entry is not None and time.monotonic() - entry.checked_at < interval
+
+    async def get(self, db, force=False):
+        scope = (db.server, db.database)
+        entry = self._entries.get(scope)
+        if self._fresh(entry, force):
+            return entry.dimensions
+
+        # Concurrent requests share one check and at most one reload
+        lock = self._locks.setdefault(scope, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(scope)
+            if self._fresh(entry, force):
+                return entry.dimensions
+            signatures = await db.run(read_signatures)
+            self.checks += 1
+            if entry is None or signatures is None:
+                changed = list(DIMENSION_TABLES)
+            else:
+                changed = [kind for kind in DIMENSION_TABLES if signatures[kind] != entry.signatures.get(kind)]
+            if not changed:
+                entry.checked_at = time.monotonic()
+                return entry.dimensions
+            tables = dict(entry.dimensions.tables) if entry is not None else {}
+            tables.update(await db.run(read_tables, changed))
+            for kind in changed:
+                self.reloads[kind] += 1
+            logger.debug("Reloaded dimensions %s for %s/%s", ", ".join(changed), *scope)
+            entry = DimensionEntry(signatures or {}, tables)
+            self._entries[scope] = entry
+            return entry.dimensions
+
+    async def resolve(self, db, kind, ids):
+        # An ID the cache does not know yet (a department created since the last check)
+        # forces one early check instead of waiting out the interval
+        dimensions = await self.get(db)
+        if not dimensions.has(kind, ids):
+            dimensions = await self.get(db, force=True)
+        return dimensions
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "check_interval_seconds": self.check_interval,
+            "databases": [
+                {"server": server, "database": database, "loaded_at": entry.loaded_at,
+                 "departments": len(entry.dimensions.departments), "stores": len(entry.dimensions.stores),
+                 "taxes": len(entry.dimensions.taxes), "items": len(entry.dimensions.items)}
+                for (server, database), entry in self._entries.items()
+            ],
+        }
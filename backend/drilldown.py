@@ -0,0 +1,183 @@
+from decimal import Decimal, InvalidOperation
+
+import periods
+import shaping
+from database import fetch_rows, read_only
+
+# Rows per page of /drilldown/items and /drilldown/lines
+DRILLDOWN_PAGE_SIZE = 100
+DRILLDOWN_MAX_PAGE_SIZE = 1000
+
+# Sort name -> (key expression, placeholder for the cursor value, default order). Money
+# and quantity keys are cast to fixed decimals, so the cursor carries the exact key and a
+# seek never skips or repeats a row. The row's own ID breaks ties.
+ITEM_SORTS = {
+    "sales": ("CAST(ISNULL(s.SalesExclusive, 0) + s.SalesTax AS DECIMAL(19, 2))", "CAST(? AS DECIMAL(19, 2))", "desc"),
+    "tax": ("CAST(s.SalesTax AS DECIMAL(19, 2))", "CAST(? AS DECIMAL(19, 2))", "desc"),
+    "quantity": ("CAST(ISNULL(s.Quantity, 0) AS DECIMAL(19, 4))", "CAST(? AS DECIMAL(19, 4))", "desc"),
+    "code": ("ISNULL(i.ItemLookupCode, '')", "?", "asc"),
+}
+LINE_SORTS = {
+    # Transaction numbers follow the till's clock and, unlike DATETIME, round-trip exactly
+    "transaction": ("te.TransactionNumber", "?", "desc"),
+    "amount": ("CAST(ISNULL(te.Quantity * te.Price, 0) AS DECIMAL(19, 2))", "CAST(? AS DECIMAL(19, 2))", "desc"),
+}
+
+# Item totals for the period come from the raw lines, since the rollup stops at department
+ITEMS_QUERY = """
+    WITH ItemSales AS (
+        SELECT
+            te.ItemID,
+            SUM(te.Quantity) AS Quantity,
+            SUM(te.Quantity * te.Price) AS SalesExclusive,
+            SUM(ISNULL(te.SalesTax, 0)) AS SalesTax,
+            COUNT(*) AS LineCount,
+            COUNT(DISTINCT te.TransactionNumber) AS TransactionCount
+        FROM TransactionEntry te
+        JOIN Item i ON i.ID = te.ItemID
+        JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+        WHERE t.Time >= ? AND t.Time < ?{filters}
+        GROUP BY te.ItemID
+    ),
+    Keyed AS (
+        SELECT s.*, i.ItemLookupCode, i.Description, i.DepartmentID, i.TaxID, {key} AS SortKey
+        FROM ItemSales s
+        JOIN Item i ON i.ID = s.ItemID
+    )
+    SELECT k.ItemID, k.ItemLookupCode, k.Description, k.DepartmentID, k.TaxID, k.Quantity,
+           k.SalesExclusive, k.SalesTax, k.LineCount, k.TransactionCount, k.SortKey
+    FROM Keyed k
+    WHERE 1 = 1{seek}
+    ORDER BY k.SortKey {order}, k.ItemID {order}
+    OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY"""
+
+LINES_QUERY = """
+    SELECT
+        te.ID AS LineID,
+        te.TransactionNumber,
+        t.Time,
+        te.StoreID,
+        te.ItemID,
+        i.ItemLookupCode,
+        i.Description,
+        te.Quantity,
+        te.Price,
+        te.Quantity * te.Price AS SalesExclusive,
+        ISNULL(te.SalesTax, 0) AS SalesTax,
+        {key} AS SortKey
+    FROM TransactionEntry te
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    JOIN Item i ON i.ID = te.ItemID
+    WHERE t.Time >= ? AND t.Time < ?{filters}{seek}
+    ORDER BY {key} {order}, te.ID {order}
+    OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY"""
+
+ITEM_COLUMNS = {
+    "ItemID": shaping.integer,
+    "Quantity": shaping.number,
+    "SalesExclusive": shaping.money,
+    "SalesTax": shaping.money,
+    "LineCount": shaping.integer,
+    "TransactionCount": shaping.integer,
+}
+LINE_COLUMNS = {
+    "LineID": shaping.integer,
+    "TransactionNumber": shaping.integer,
+    "ItemID": shaping.integer,
+    "Quantity": shaping.number,
+    "Price": shaping.money,
+    "SalesExclusive": shaping.money,
+    "SalesTax": shaping.money,
+}
+
+
+def parse_order(sorts, sort, order):
+    # (key expression, cursor placeholder, ASC or DESC); ValueError for an unknown sort
+    if sort not in sorts:
+        raise ValueError(f"sort must be one of {', '.join(sorts)}")
+    key, placeholder, default = sorts[sort]
+    order = (order or default).lower()
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be asc or desc")
+    return key, placeholder, order.upper()
+
+
+def parse_after(after, sort):
+    # A cursor is "<sort key>,<row ID>"; the key may itself contain commas (item codes)
+    if after is None:
+        return None
+    value, separator, row_id = after.rpartition(",")
+    try:
+        if not separator:
+            raise ValueError(after)
+        row_id = int(row_id)
+        if sort == "transaction":
+            value = int(value)
+        elif sort != "code":
+            value = Decimal(value)
+            if not value.is_finite():
+                raise ValueError(after)
+            value = str(value)
+    except (ValueError, InvalidOperation):
+        raise ValueError("after must be the next_after of the previous page")
+    return value, row_id
+
+
+def next_after(rows, limit, id_column):
+    # rows holds one extra row when another page follows; SortKey is dropped from the page
+    page = rows[:limit]
+    cursor = None
+    if len(rows) > limit:
+        cursor = f"{page[-1]['SortKey']},{page[-1][id_column]}"
+    for row in page:
+        del row["SortKey"]
+    return page, cursor
+
+
+def build_filters(StoreID=None, department_ids=None, tax_ids=None, ItemID=None):
+    filters = ""
+    params = ()
+    if StoreID is not None:
+        filters += " AND te.StoreID = ?"
+        params += (StoreID,)
+    if department_ids is not None:
+        filters += f" AND i.DepartmentID IN ({', '.join('?' * len(department_ids))})"
+        params += tuple(department_ids)
+    if tax_ids is not None:
+        filters += f" AND i.TaxID IN ({', '.join('?' * len(tax_ids))})"
+        params += tuple(tax_ids)
+    if ItemID is not None:
+        filters += " AND te.ItemID = ?"
+        params += (ItemID,)
+    return filters, params
+
+
+def seek_clause(key, id_column, placeholder, order, after):
+    # Rows strictly past the cursor in (key, ID) order, so the database seeks instead of
+    # counting off an OFFSET however deep the page
+    if after is None:
+        return "", ()
+    operator = "<" if order == "DESC" else ">"
+    value, row_id = after
+    clause = f" AND ({key} {operator} {placeholder} OR ({key} = {placeholder} AND {id_column} {operator} ?))"
+    return clause, (value, value, row_id)
+
+
+@read_only
+def read_items(conn, start_date, end_date, sort, order, after, limit, filters):
+    key, placeholder, order = parse_order(ITEM_SORTS, sort, order)
+    filter_clause, filter_params = build_filters(**filters)
+    seek, seek_params = seek_clause("k.SortKey", "k.ItemID", placeholder, order, after)
+    query = ITEMS_QUERY.format(filters=filter_clause, key=key, seek=seek, order=order)
+    columns, rows = fetch_rows(conn, query, (start_date, periods.day_after(end_date)) + filter_params + seek_params + (limit,))
+    return shaping.shape(columns, rows, ITEM_COLUMNS)
+
+
+@read_only
+def read_lines(conn, start_date, end_date, sort, order, after, limit, filters):
+    key, placeholder, order = parse_order(LINE_SORTS, sort, order)
+    filter_clause, filter_params = build_filters(**filters)
+    seek, seek_params = seek_clause(key, "te.ID", placeholder, order, after)
+    query = LINES_QUERY.format(filters=filter_clause, key=key, seek=seek, order=order)
+    columns, rows = fetch_rows(conn, query, (start_date, periods.day_after(end_date)) + filter_params + seek_params + (limit,))
+    return shaping.shape(columns, rows, LINE_COLUMNS)
@@ -0,0 +1,203 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import periods
+import startup
+from database import is_connection_error
+
+# pyarrow is imported with the first Parquet export or sync; this only checks it is there
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+# Rows pulled from the cursor per round trip; memory stays at one batch per export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+# No ORDER BY: sorting millions of lines on the server would hold back the first byte
+AUDIT_QUERY = """
+    SELECT
+        te.ID AS EntryID,
+        te.TransactionNumber,
+        t.Time AS TransactionTime,
+        te.StoreID,
+        s.Name AS StoreName,
+        te.ItemID,
+        i.ItemLookupCode,
+        i.Description AS ItemDescription,
+        i.DepartmentID,
+        d.Name AS DepartmentName,
+        i.TaxID,
+        tx.Percentage AS TaxRate,
+        te.Quantity,
+        te.Price,
+        te.Quantity * te.Price AS SalesExclusive,
+        te.SalesTax,
+        te.Quantity * te.Price + ISNULL(te.SalesTax, 0) AS SalesInclusive
+    FROM TransactionEntry te
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    JOIN Item i ON i.ID = te.ItemID
+    LEFT JOIN Department d ON d.ID = i.DepartmentID
+    LEFT JOIN Tax tx ON tx.ID = i.TaxID
+    LEFT JOIN Store s ON s.ID = te.StoreID
+    WHERE t.Time >= ? AND t.Time < ?"""
+
+
+def audit_query(start_date, end_date, StoreID=None, DepartmentID=None):
+    query = AUDIT_QUERY
+    params = (start_date, periods.day_after(end_date))
+    if StoreID is not None:
+        query += " AND te.StoreID = ?"
+        params += (StoreID,)
+    if DepartmentID is not None:
+        query += " AND i.DepartmentID = ?"
+        params += (DepartmentID,)
+    return query, params
+
+
+class RowStream:
+    # Holds one pooled connection from open() until the last batch has been read
+    def __init__(self, db, query, params, batch_size=EXPORT_BATCH_SIZE):
+        self.db = db
+        self.query = query
+        self.params = params
+        self.batch_size = batch_size
+        self.conn = None
+        self.cursor = None
+        self.columns = []
+
+    def open(self):
+        self.conn = self.db.pool.acquire()
+        try:
+            self.cursor = self.conn.cursor()
+            self.cursor.execute(self.query, self.params)
+            self.columns = [column[0] for column in self.cursor.description]
+        except Exception as e:
+            self.close(broken=is_connection_error(e))
+            raise
+        return self
+
+    def batches(self):
+        broken = False
+        try:
+            while True:
+                rows = self.cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield rows
+        except Exception as e:
+            broken = is_connection_error(e)
+            raise
+        finally:
+            self.close(broken=broken)
+
+    def close(self, broken=False):
+        if self.conn is None:
+            return
+        try:
+            if self.cursor is not None:
+                self.cursor.close()
+        except Exception:
+            broken = True
+        self.db.pool.release(self.conn, broken=broken)
+        self.conn = None
+
+
+def json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def csv_chunks(stream):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(stream.columns)
+    for rows in stream.batches():
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only when the period has no lines
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(stream):
+    columns = stream.columns
+    for rows in stream.batches():
+        lines = [json.dumps(dict(zip(columns, row)), default=json_value) for row in rows]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def arrow_type(type_code):
+    pa = startup.load("pyarrow")
+    if type_code is int:
+        return pa.int64()
+    if type_code is float:
+        return pa.float64()
+    if type_code is Decimal:
+        return pa.decimal128(19, 4)
+    if type_code is datetime:
+        return pa.timestamp("ms")
+    if type_code is bool:
+        return pa.bool_()
+    return pa.string()
+
+
+class ChunkSink:
+    # File-like target for ParquetWriter that hands back whatever was written since the last drain
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(stream):
+    # One row group per fetched batch, schema taken from the cursor description
+    pa = startup.load("pyarrow")
+    pq = startup.load("pyarrow.parquet")
+    schema = pa.schema([
+        (column[0], arrow_type(column[1])) for column in stream.cursor.description
+    ])
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in stream.batches():
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+FORMATS = {
+    "csv": ("text/csv", csv_chunks),
+    "ndjson": ("application/x-ndjson", ndjson_chunks),
+    "parquet": ("application/vnd.apache.parquet", parquet_chunks),
+}
@@ -0,0 +1,163 @@
+import asyncio
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+import shaping
+import startup
+
+# A target that has not answered by then is reported as timed out; the others are not held up
+FEDERATION_TIMEOUT_SECONDS = float(os.getenv("FEDERATION_TIMEOUT_SECONDS", "120"))
+
+VAT_RETURN_MEASURES = ("SalesInclusive", "SalesExclusive", "SalesTax", "Vatable", "NonVatable")
+VAT_RETURN_SUMMARY = (
+    "total_sales_inclusive", "total_sales_exclusive", "total_sales_tax", "total_vatable", "total_non_vatable",
+)
+VAT_SUMMARY_MONEY = ("TotalExcl", "TotalVAT", "TotalIncl")
+VAT_SUMMARY_MEASURES = VAT_SUMMARY_MONEY + ("TransactionCount",)
+VAT_RATE_MEASURES = ("item_count", "total_sales", "total_vat")
+DEPARTMENT_MEASURES = ("StockOnHandCost", "CostOfSales", "SalesExclusive", "SalesInclusive", "GrossProfitValue")
+FACT_MEASURES = ("SalesExclusive", "SalesTax", "Quantity", "LineCount", "TransactionCount")
+FACT_COLUMNS = ("SaleDate", "DepartmentID", "DepartmentName", "IsDayTotal") + FACT_MEASURES
+
+
+async def fan_out(targets, run, timeout=FEDERATION_TIMEOUT_SECONDS):
+    # targets: {name: db}; run(db) is awaited for every target at once
+    async def one(name, db):
+        started = time.perf_counter()
+        try:
+            if db is None:
+                raise Exception("The connection could not be opened; retrying shortly")
+            result = await asyncio.wait_for(run(db), timeout)
+            outcome = {"status": "ok", "result": result}
+        except asyncio.TimeoutError:
+            outcome = {"status": "timeout", "error": f"No answer within {timeout:g}s"}
+        except HTTPException as e:
+            outcome = {"status": "error", "error": e.detail}
+        except Exception as e:
+            outcome = {"status": "error", "error": str(e)}
+        outcome["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return name, outcome
+
+    return dict(await asyncio.gather(*(one(name, db) for name, db in targets.items())))
+
+
+def department_order(record):
+    # Case-insensitive like the database's default collation
+    return (record["DepartmentName"] or "").casefold()
+
+
+def vat_rate_order(record):
+    # NULL rates and names first, as ORDER BY puts them
+    return (record["vat_rate"] is not None, record["vat_rate"] or 0,
+            record["department"] is not None, (record["department"] or "").casefold())
+
+
+def add(left, right):
+    # Nullable measures stay None only when every side is None
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left + right
+
+
+def sum_records(record_lists, key, measures):
+    merged = {}
+    for records in record_lists:
+        for record in records:
+            group = tuple(record[name] for name in key)
+            target = merged.get(group)
+            if target is None:
+                merged[group] = dict(record)
+                continue
+            for name in measures:
+                target[name] = add(target[name], record[name])
+    return list(merged.values())
+
+
+def round_money(records, measures):
+    for record in records:
+        for name in measures:
+            if isinstance(record.get(name), float):
+                record[name] = round(record[name], 2) + 0.0
+    return records
+
+
+# Partial results from separate databases or disjoint date ranges merge by summing;
+# departments are matched by name since IDs differ between databases
+def sum_vat_return(results):
+    # Unrounded, so date-range partials can be summed again before merge_vat_return
+    # rounds once at the end
+    departments = sum_records([result["departments"] for result in results], ("DepartmentName",), VAT_RETURN_MEASURES)
+    summary = {name: math.fsum(result["summary"][name] for result in results) for name in VAT_RETURN_SUMMARY}
+    return {"departments": departments, "summary": summary}
+
+
+def merge_vat_return(results):
+    merged = sum_vat_return(results)
+    merged["departments"].sort(key=department_order)
+    round_money(merged["departments"], VAT_RETURN_MEASURES)
+    round_money([merged["summary"]], VAT_RETURN_SUMMARY)
+    return merged
+
+
+def merge_vat_return_periods(results):
+    # Every source answered the same period list, so periods line up by position
+    merged = []
+    for periods in zip(*results):
+        merged.append(dict(merge_vat_return(periods), period=periods[0]["period"]))
+    return merged
+
+
+def merge_vat_summary(results):
+    daily = sum_records([result["daily_breakdown"] for result in results], ("TransactionDate",), VAT_SUMMARY_MEASURES)
+    # Rows stay unrounded like a single query's, and partials' exact values become floats
+    # only once summed; the totals round once over all of them
+    for record in daily:
+        for name in VAT_SUMMARY_MONEY:
+            record[name] = shaping.number(record[name])
+    daily.sort(key=lambda record: str(record["TransactionDate"]))
+    return {
+        "period": results[0]["period"],
+        "summary": {
+            "total_sales_excl_vat": shaping.column_total(daily, "TotalExcl"),
+            "total_vat_amount": shaping.column_total(daily, "TotalVAT"),
+            "total_sales_incl_vat": shaping.column_total(daily, "TotalIncl"),
+            "total_transactions": sum(day["TransactionCount"] for day in daily),
+        },
+        "daily_breakdown": daily,
+    }
+
+
+def merge_vat_rates(results):
+    # item_count adds up across databases, whose items are distinct
+    rates = sum_records([result["vat_rates"] for result in results], ("vat_rate", "department"), VAT_RATE_MEASURES)
+    rates.sort(key=vat_rate_order)
+    return {"vat_rates": rates}
+
+
+def merge_departments(results):
+    departments = sum_records([result["departments"] for result in results], ("DepartmentName",), DEPARTMENT_MEASURES)
+    total = math.fsum(record["SalesExclusive"] or 0 for record in departments)
+    for record in departments:
+        sales = record["SalesExclusive"] or 0
+        record["GrossProfitPercent"] = round((record["GrossProfitValue"] or 0) / sales * 100, 2) if sales > 0 else 0.0
+        record["SalesContributionPercent"] = round(sales / total * 100, 2) if total > 0 else 0.0
+    departments.sort(key=department_order)
+    return {"departments": round_money(departments, DEPARTMENT_MEASURES)}
+
+
+def merge_facts(frames):
+    # Day x department facts of the sales dashboard; transaction counts add up because
+    # a transaction belongs to one database and one day
+    pd = startup.load("pandas")
+    facts = pd.concat([frame[list(FACT_COLUMNS)] for frame in frames], ignore_index=True)
+    if facts.empty:
+        return facts
+    merged = facts.groupby(["SaleDate", "IsDayTotal", "DepartmentName"], dropna=False, as_index=False).agg(
+        dict({name: "sum" for name in FACT_MEASURES}, DepartmentID="min")
+    )
+    return merged[list(FACT_COLUMNS)]
@@ -0,0 +1,331 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+import rollup
+from database import fetch_rows, read_frame, read_only
+
+# Covering indexes for the report workload. Every report filters [Transaction].Time
+# (some also StoreID) and joins TransactionEntry -> Item -> Department/Tax, so these
+# turn the heap scans and key lookups into range seeks on narrow indexes.
+logger = logging.getLogger(__name__)
+
+REPORT_INDEXES = [
+    {
+        "name": "RPT_IX_Transaction_Time",
+        "table": "Transaction",
+        "keys": ["Time"],
+        "include": ["TransactionNumber", "StoreID", "Total", "SalesTax"],
+        "purpose": "Date range filter and header totals (/vat-summary, every report's Time filter)",
+    },
+    {
+        "name": "RPT_IX_Transaction_Store_Time",
+        "table": "Transaction",
+        "keys": ["StoreID", "Time"],
+        "include": ["TransactionNumber", "Total", "SalesTax"],
+        "purpose": "StoreID filter on a date range",
+    },
+    {
+        "name": "RPT_IX_Transaction_Number",
+        "table": "Transaction",
+        "keys": ["TransactionNumber"],
+        "include": ["Time", "StoreID"],
+        "purpose": "Joins from TransactionEntry and the rollup's TransactionNumber tail",
+    },
+    {
+        "name": "RPT_IX_TransactionEntry_Transaction",
+        "table": "TransactionEntry",
+        "keys": ["TransactionNumber"],
+        "include": ["ItemID", "StoreID", "Quantity", "Price", "SalesTax"],
+        "purpose": "Lines of the transactions in range, without key lookups",
+    },
+    {
+        "name": "RPT_IX_TransactionEntry_Item",
+        "table": "TransactionEntry",
+        "keys": ["ItemID", "TransactionNumber"],
+        "include": ["StoreID", "Quantity", "Price", "SalesTax"],
+        "purpose": "Keyset pages of one item's lines (/drilldown/lines)",
+    },
+    {
+        "name": "RPT_IX_Item_ID",
+        "table": "Item",
+        "keys": ["ID"],
+        "include": ["DepartmentID", "TaxID", "Cost"],
+        "purpose": "Item -> Department/Tax join and cost of sales",
+    },
+    {
+        "name": "RPT_IX_Department_ID",
+        "table": "Department",
+        "keys": ["ID"],
+        "include": ["Name"],
+        "purpose": "Department names",
+    },
+    {
+        "name": "RPT_IX_Item_DBTimeStamp",
+        "table": "Item",
+        "keys": ["DBTimeStamp"],
+        "include": [],
+        "purpose": "Dimension cache change check (MAX(DBTimeStamp)) without scanning the wide Item table",
+    },
+]
+
+INDEX_COLUMNS_QUERY = """
+    SELECT i.name, i.type, c.name, ic.key_ordinal, ic.is_included_column
+    FROM sys.indexes i
+    JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+    JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+    WHERE i.object_id = OBJECT_ID(?) AND i.type IN (1, 2) AND i.is_disabled = 0 AND i.is_hypothetical = 0
+    ORDER BY i.name, ic.key_ordinal, ic.index_column_id
+"""
+
+# Enterprise/Developer (3), Azure SQL Database (5) and Managed Instance (8) build indexes online
+ONLINE_EDITIONS = (3, 5, 8)
+
+SHOWPLAN = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+SCAN_OPERATORS = ("Table Scan", "Clustered Index Scan", "Index Scan")
+
+
+def existing_indexes(conn, table):
+    _, rows = fetch_rows(conn, INDEX_COLUMNS_QUERY, (f"dbo.{table}",))
+    indexes = {}
+    for name, index_type, column, key_ordinal, is_included in rows:
+        index = indexes.setdefault(name, {"name": name, "clustered": index_type == 1, "keys": [], "include": []})
+        if is_included:
+            index["include"].append(column)
+        elif key_ordinal:
+            index["keys"].append(column)
+    return list(indexes.values())
+
+
+def covers(index, declared):
+    # Same leading keys in order, and every included column reachable without a lookup
+    keys = [column.lower() for column in index["keys"]]
+    wanted = [column.lower() for column in declared["keys"]]
+    if keys[:len(wanted)] != wanted:
+        return False
+    if index["clustered"]:
+        return True
+    available = set(keys) | {column.lower() for column in index["include"]}
+    return all(column.lower() in available for column in declared["include"])
+
+
+@read_only
+def inspect(conn):
+    report = []
+    existing = {}
+    for declared in REPORT_INDEXES:
+        if declared["table"] not in existing:
+            existing[declared["table"]] = existing_indexes(conn, declared["table"])
+        covering = [index["name"] for index in existing[declared["table"]] if covers(index, declared)]
+        report.append({
+            "name": declared["name"],
+            "table": declared["table"],
+            "keys": declared["keys"],
+            "include": declared["include"],
+            "purpose": declared["purpose"],
+            "status": "present" if declared["name"] in covering else ("covered" if covering else "missing"),
+            "covered_by": covering,
+        })
+    return report
+
+
+def create_statement(declared, online):
+    statement = (
+        f"CREATE NONCLUSTERED INDEX [{declared['name']}] ON [dbo].[{declared['table']}] "
+        f"({', '.join(f'[{column}]' for column in declared['keys'])})"
+    )
+    if declared["include"]:
+        statement += f" INCLUDE ({', '.join(f'[{column}]' for column in declared['include'])})"
+    return statement + f" WITH (ONLINE = {'ON' if online else 'OFF'}, SORT_IN_TEMPDB = ON)"
+
+
+def create_missing(conn, allow_offline=False):
+    cursor = conn.cursor()
+    edition = cursor.execute("SELECT CAST(SERVERPROPERTY('EngineEdition') AS INT)").fetchone()[0]
+    cursor.close()
+    online = edition in ONLINE_EDITIONS
+
+    results = []
+    for status in inspect(conn):
+        if status["status"] != "missing":
+            continue
+        declared = next(index for index in REPORT_INDEXES if index["name"] == status["name"])
+        if not online and not allow_offline:
+            # An offline build locks the table against the tills for its whole duration
+            results.append({"name": declared["name"], "created": False,
+                            "reason": "This edition cannot build indexes online; pass allow_offline to build it anyway"})
+            continue
+        statement = create_statement(declared, online)
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(statement)
+            conn.commit()
+            results.append({"name": declared["name"], "created": True, "online": online,
+                            "seconds": round(time.perf_counter() - started, 3)})
+        except Exception as e:
+            conn.rollback()
+            results.append({"name": declared["name"], "created": False, "reason": str(e)})
+        finally:
+            cursor.close()
+    return {"online": online, "results": results}
+
+
+def misestimate_ratio(estimated, actual):
+    estimated, actual = max(estimated, 1), max(actual, 1)
+    return max(estimated / actual, actual / estimated)
+
+
+def summarize_plan(plan_xml):
+    if not plan_xml:
+        return None
+    root = ET.fromstring(plan_xml)
+    statement = root.find(f".//{SHOWPLAN}StmtSimple")
+    summary = {
+        "estimated_rows": float(statement.get("StatementEstRows", 0)) if statement is not None else None,
+        "estimated_cost": float(statement.get("StatementSubTreeCost", 0)) if statement is not None else None,
+        "scans": [],
+        "missing_indexes": [],
+        "misestimates": [],
+    }
+    logical_reads = 0
+    operators = []
+    for relop in root.iter(f"{SHOWPLAN}RelOp"):
+        counters = relop.findall(f"{SHOWPLAN}RunTimeInformation/{SHOWPLAN}RunTimeCountersPerThread")
+        actual_rows = sum(int(counter.get("ActualRows", 0)) for counter in counters) if counters else None
+        logical_reads += sum(int(counter.get("ActualLogicalReads", 0)) for counter in counters)
+        # EstimateRows is per execution; inner sides of loops run once per rebind/rewind
+        executions = 1 + float(relop.get("EstimateRebinds", 0)) + float(relop.get("EstimateRewinds", 0))
+        estimated = float(relop.get("EstimateRows", 0)) * executions
+        physical = relop.get("PhysicalOp")
+        # The operator's own object sits under its operator element, not under child RelOps
+        target = relop.find(f"./*/{SHOWPLAN}Object")
+        name = target.get("Table", "").strip("[]") if target is not None else None
+        if physical in SCAN_OPERATORS and name:
+            summary["scans"].append({"operator": physical, "table": name, "index": (target.get("Index") or "").strip("[]") or None})
+        if actual_rows is not None:
+            operators.append((physical, name, estimated, actual_rows))
+    for group in root.iter(f"{SHOWPLAN}MissingIndexGroup"):
+        index = group.find(f"{SHOWPLAN}MissingIndex")
+        summary["missing_indexes"].append({
+            "impact": float(group.get("Impact", 0)),
+            "table": index.get("Table", "").strip("[]"),
+            "columns": {
+                column_group.get("Usage"): [column.get("Name").strip("[]") for column in column_group]
+                for column_group in index.findall(f"{SHOWPLAN}ColumnGroup")
+            },
+        })
+    if operators:
+        summary["actual_rows"] = operators[0][3]
+        summary["logical_reads"] = logical_reads
+        # Worst estimate errors first; these are where a plan goes wrong
+        ranked = sorted(operators, key=lambda op: misestimate_ratio(op[2], op[3]), reverse=True)
+        summary["misestimates"] = [
+            {"operator": op[0], "table": op[1], "estimated_rows": round(op[2], 1), "actual_rows": op[3]}
+            for op in ranked[:5]
+        ]
+    return summary
+
+
+class CapturingCursor:
+    # Runs each statement under SHOWPLAN_XML (estimated plan) and then STATISTICS XML
+    # (actual plan), buffering the rows so callers read them as usual
+    def __init__(self, conn, captures, include_xml):
+        self._cursor = conn.cursor()
+        self._captures = captures
+        self._include_xml = include_xml
+        self._rows = []
+        self.description = None
+
+    def execute(self, query, params=None):
+        params = tuple(params or ())
+        if query in (rollup.PIN_HIGH_WATER_MARK, rollup.RELEASE_HIGH_WATER_MARK):
+            self._cursor.execute(query, params)
+            self.description = self._cursor.description
+            self._rows = self._cursor.fetchall() if self.description else []
+            return self
+
+        estimated = None
+        try:
+            self._cursor.execute("SET SHOWPLAN_XML ON")
+            self._cursor.execute(query, params)
+            estimated = self._cursor.fetchone()[0]
+        except Exception as e:
+            logger.warning("Estimated plan failed: %s", e)
+        finally:
+            self._cursor.execute("SET SHOWPLAN_XML OFF")
+
+        self._cursor.execute("SET STATISTICS XML ON")
+        try:
+            started = time.perf_counter()
+            self._cursor.execute(query, params)
+            self.description = self._cursor.description
+            self._rows = self._cursor.fetchall() if self.description else []
+            elapsed = (time.perf_counter() - started) * 1000
+            actual = None
+            while self._cursor.nextset():
+                description = self._cursor.description
+                if description and "Showplan" in description[0][0]:
+                    actual = self._cursor.fetchone()[0]
+        finally:
+            self._cursor.execute("SET STATISTICS XML OFF")
+
+        capture = {
+            "statement": " ".join(query.split())[:300],
+            "elapsed_ms": round(elapsed, 3),
+            "rows_returned": len(self._rows),
+            "estimated": summarize_plan(estimated),
+            "actual": summarize_plan(actual),
+        }
+        if self._include_xml:
+            capture["estimated_plan_xml"] = estimated
+            capture["actual_plan_xml"] = actual
+        self._captures.append(capture)
+        return self
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+
+class CapturingConnection:
+    def __init__(self, conn, captures, include_xml):
+        self._conn = conn
+        self._captures = captures
+        self._include_xml = include_xml
+        self.has_rollup = getattr(conn, "has_rollup", True)
+
+    def cursor(self):
+        return CapturingCursor(self._conn, self._captures, self._include_xml)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+class PlanCapture:
+    # Stands in for a Database so the report functions run unchanged while every
+    # query they issue has its plans recorded
+    def __init__(self, db, include_xml=False):
+        self.db = db
+        self.server = db.server
+        self.database = db.database
+        self.include_xml = include_xml
+        self.captures = []
+
+    async def run(self, fn, *args):
+        return await self.db.run(lambda conn: fn(CapturingConnection(conn, self.captures, self.include_xml), *args))
+
+    async def read_sql(self, query, params=None):
+        return await self.run(read_frame, query, params)
+
+    async def fetch_rows(self, query, params=None):
+        return await self.run(fetch_rows, query, params)
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+import metrics
+import shaping
+from cache import make_key
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.expanduser("~"), ".vat-jobs"))
+# Reports running at once; keep it below DB_POOL_SIZE so interactive requests still get connections
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Submissions beyond this many queued jobs are refused
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "50"))
+# How long finished jobs and their results are kept
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", str(24 * 3600)))
+JOB_PURGE_SECONDS = 300
+# Every worker process touches its <owner>.worker file this often; unfinished jobs whose
+# owner has gone quiet for three beats were interrupted and are marked failed
+JOB_HEARTBEAT_SECONDS = 30
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class Job:
+    def __init__(self, id, report, params, scope, key=None, status=QUEUED, stage=None, submitted_at=None,
+                 started_at=None, finished_at=None, expires_at=None, error=None, result_bytes=None,
+                 duration_seconds=None, owner=None):
+        self.id = id
+        self.report = report
+        self.params = params
+        self.scope = scope
+        self.key = key
+        self.status = status
+        self.stage = stage
+        self.submitted_at = submitted_at or now()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.expires_at = expires_at
+        self.error = error
+        self.result_bytes = result_bytes
+        self.duration_seconds = duration_seconds
+        self.owner = owner
+        self.compute = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "report": self.report,
+            "params": self.params,
+            "scope": list(self.scope),
+            "status": self.status,
+            "stage": self.stage,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "error": self.error,
+            "result_bytes": self.result_bytes,
+            "duration_seconds": self.duration_seconds,
+            "owner": self.owner,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data, scope=tuple(data["scope"]))
+        return cls(**data)
+
+
+class JobQueue:
+    # Long reports run here instead of inside the request; results land on disk and are
+    # served until they expire. Identical queued or running jobs are shared.
+    def __init__(self, path=JOBS_DIR, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_RESULT_TTL_SECONDS):
+        self.path = path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        # This worker's jobs; the others' are read from disk when asked for
+        self.jobs = {}
+        self.owner = uuid.uuid4().hex
+        self._active = {}
+        self._queue = None
+        self._tasks = []
+
+    def _meta_path(self, job_id):
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def result_path(self, job_id):
+        return os.path.join(self.path, f"{job_id}.result.json")
+
+    def _save(self, job):
+        path = self._meta_path(job.id)
+        with open(path + ".tmp", "w") as handle:
+            json.dump(job.to_dict(), handle, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _owner_path(self, owner):
+        return os.path.join(self.path, f"{owner}.worker")
+
+    def _read(self, job_id):
+        try:
+            with open(self._meta_path(job_id)) as handle:
+                return Job.from_dict(json.load(handle))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Skipping unreadable job file %s: %s", job_id, e)
+            return None
+
+    def _scan(self):
+        # Every job on disk, including those submitted through the other worker processes
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".json") and not name.endswith(".result.json"):
+                job = self._read(name[:-len(".json")])
+                if job is not None:
+                    yield job
+
+    def _heartbeat(self):
+        with open(self._owner_path(self.owner), "w") as handle:
+            handle.write(now())
+
+    def _owner_alive(self, owner):
+        if owner == self.owner:
+            return True
+        try:
+            age = time.time() - os.path.getmtime(self._owner_path(owner))
+        except (OSError, TypeError):
+            return False
+        return age < 3 * JOB_HEARTBEAT_SECONDS
+
+    def _interrupt(self, job):
+        if job.status not in FINISHED and not self._owner_alive(job.owner):
+            # The closure that computes a report does not survive a restart
+            job.status = FAILED
+            job.error = "Interrupted by a restart; submit the report again"
+            job.finished_at = now()
+            job.expires_at = datetime.fromtimestamp(time.time() + self.ttl).isoformat(timespec="seconds")
+            self._save(job)
+        return job
+
+    def start(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._heartbeat()
+        for job in self._scan():
+            self._interrupt(job)
+        self.purge()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            os.remove(self._owner_path(self.owner))
+        except OSError:
+            pass
+
+    def submit(self, report, params, scope, compute):
+        hashable = {name: tuple(value) if isinstance(value, list) else value for name, value in params.items()}
+        key = (scope,) + make_key(report, hashable)
+        existing = self._active.get(key)
+        if existing is not None:
+            return existing, False
+        if self._queue is None:
+            raise Exception("The job queue is not running")
+        queued = sum(1 for job in self.jobs.values() if job.status == QUEUED)
+        if queued >= self.max_queued:
+            raise QueueFull(f"{queued} jobs are already queued; try again later")
+
+        job = Job(uuid.uuid4().hex, report, params, scope, key=key, owner=self.owner)
+        job.compute = compute
+        self.jobs[job.id] = job
+        self._active[key] = job
+        self._save(job)
+        self._queue.put_nowait(job)
+        return job, True
+
+    def find(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            job = self._read(job_id)
+            return self._interrupt(job) if job is not None else None
+        if job.status == QUEUED:
+            # Another worker may have cancelled it on disk
+            stored = self._read(job_id)
+            if stored is not None and stored.status == CANCELLED:
+                self._adopt(job, stored)
+        return job
+
+    def list(self):
+        # Newest first, across all worker processes
+        jobs = [self.jobs.get(job.id) or self._interrupt(job) for job in self._scan()]
+        return sorted(jobs, key=lambda job: job.submitted_at, reverse=True)
+
+    def _adopt(self, job, stored):
+        job.status, job.error, job.finished_at, job.expires_at = stored.status, stored.error, stored.finished_at, stored.expires_at
+        job.compute = None
+        self._active.pop(job.key, None)
+
+    def cancel(self, job_id):
+        job = self.find(job_id)
+        if job is None or job.status != QUEUED:
+            return False
+        # The owning worker skips it when it comes up
+        self._finish(job, CANCELLED)
+        return True
+
+    def position(self, job):
+        # Only known for this worker's queue
+        if job.status != QUEUED or job.id not in self.jobs:
+            return None
+        # Jobs are kept in submission order
+        queued = [other.id for other in self.jobs.values() if other.status == QUEUED]
+        return queued.index(job.id)
+
+    def describe(self, job):
+        data = job.to_dict()
+        data.pop("scope")
+        data["queue_position"] = self.position(job)
+        return data
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.stage = None
+        job.finished_at = now()
+        job.expires_at = datetime.fromtimestamp(time.time() + self.ttl).isoformat(timespec="seconds")
+        job.compute = None
+        self._active.pop(job.key, None)
+        self._save(job)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            stored = await loop.run_in_executor(None, self._read, job.id)
+            if stored is not None and stored.status == CANCELLED:
+                self._adopt(job, stored)
+            if job.status != QUEUED:
+                continue
+            job.status = RUNNING
+            job.stage = "querying"
+            job.started_at = now()
+            started = time.perf_counter()
+            await loop.run_in_executor(None, self._save, job)
+            token = metrics.endpoint.set(f"job:{job.report}")
+            try:
+                result = await job.compute()
+                job.stage = "writing result"
+                job.result_bytes = await loop.run_in_executor(None, self._write_result, job.id, result)
+                job.duration_seconds = round(time.perf_counter() - started, 3)
+                self._finish(job, SUCCEEDED)
+            except asyncio.CancelledError:
+                self._finish(job, FAILED, "Interrupted by shutdown; submit the report again")
+                raise
+            except Exception as e:
+                # HTTPException from the report functions carries its message in detail
+                error = getattr(e, "detail", None) or str(e)
+                logger.warning("Job %s (%s) failed: %s", job.id, job.report, error)
+                job.duration_seconds = round(time.perf_counter() - started, 3)
+                self._finish(job, FAILED, error)
+            finally:
+                metrics.endpoint.reset(token)
+
+    def _write_result(self, job_id, result):
+        path = self.result_path(job_id)
+        content = shaping.dumps(result)
+        with open(path + ".tmp", "wb") as handle:
+            handle.write(content)
+        os.replace(path + ".tmp", path)
+        return len(content)
+
+    def purge(self):
+        cutoff = now()
+        for job in list(self._scan()):
+            if job.status in FINISHED and job.expires_at and job.expires_at <= cutoff:
+                for path in (self._meta_path(job.id), self.result_path(job.id)):
+                    # Another worker may be removing the same files
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.jobs.pop(job.id, None)
+            elif job.id not in self.jobs:
+                self._interrupt(job)
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(".worker") and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(JOB_PURGE_SECONDS)
+            try:
+                self.purge()
+            except OSError as e:
+                logger.warning("Job purge failed: %s", e)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                self._heartbeat()
+            except OSError as e:
+                logger.warning("Job heartbeat failed: %s", e)
+
+    def stats(self):
+        counts = {}
+        for job in self._scan():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "max_queued": self.max_queued, "ttl_seconds": self.ttl, "jobs": counts}
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+import rollup
+import shaping
+from database import fetch_rows, read_only
+
+logger = logging.getLogger(__name__)
+
+# How often the feed looks for new transactions while anyone is subscribed
+LIVE_POLL_SECONDS = float(os.getenv("LIVE_POLL_SECONDS", "5"))
+# Deltas a slow client may fall behind by before it is told to refetch its reports instead
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+# Transactions folded into one delta at most, so a backlog after an outage goes out in slices
+LIVE_MAX_TRANSACTIONS = int(os.getenv("LIVE_MAX_TRANSACTIONS", "5000"))
+# Idle streams get a comment line this often so proxies do not close them
+LIVE_KEEPALIVE_SECONDS = 15
+
+LATEST_QUERY = "SELECT ISNULL(MAX(TransactionNumber), 0) FROM [Transaction] WITH (NOLOCK)"
+
+# Only the transactions in (low, high], at the grains the dashboard shows: day, day x
+# store and day x department. Same measures and joins as the daily rollup.
+DELTA_QUERY = """
+    SELECT
+        CAST(t.Time AS DATE) AS SaleDate,
+        te.StoreID,
+        i.DepartmentID,
+        GROUPING(te.StoreID) AS AllStores,
+        GROUPING(i.DepartmentID) AS AllDepartments,
+        SUM(te.Quantity * te.Price) AS SalesExclusive,
+        SUM(ISNULL(te.SalesTax, 0)) AS SalesTax,
+        SUM(te.Quantity) AS Quantity,
+        COUNT(*) AS LineCount,
+        COUNT(DISTINCT te.TransactionNumber) AS TransactionCount
+    FROM TransactionEntry te
+    JOIN Item i ON i.ID = te.ItemID
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    WHERE te.TransactionNumber > ? AND te.TransactionNumber <= ?
+    GROUP BY GROUPING SETS (
+        (CAST(t.Time AS DATE)),
+        (CAST(t.Time AS DATE), te.StoreID),
+        (CAST(t.Time AS DATE), i.DepartmentID)
+    )
+"""
+
+DELTA_COLUMNS = {
+    "SaleDate": shaping.text,
+    "StoreID": shaping.text,
+    "DepartmentID": shaping.text,
+    "AllStores": shaping.integer,
+    "AllDepartments": shaping.integer,
+    "SalesExclusive": shaping.money,
+    "SalesTax": shaping.money,
+    "Quantity": shaping.number,
+    "LineCount": shaping.integer,
+    "TransactionCount": shaping.integer,
+}
+
+
+@read_only
+def read_settled(conn, after=None):
+    # The last transaction a delta may include: like the rollup, the feed stops below a
+    # sale that is still being written, or it would never send it once it commits
+    if not getattr(conn, "has_rollup", True):
+        # A local snapshot only ever holds committed sales
+        _, rows = fetch_rows(conn, LATEST_QUERY)
+        return int(rows[0][0] or 0)
+    cursor = conn.cursor()
+    try:
+        if after is None:
+            # First tick: a sale still being written holds one of the latest numbers
+            latest = cursor.execute(LATEST_QUERY).fetchone()[0]
+            after = max(latest - LIVE_MAX_TRANSACTIONS, 0)
+        return int(rollup.settled_transaction(cursor, after))
+    finally:
+        cursor.close()
+
+
+@read_only
+def read_delta(conn, low, high):
+    columns, rows = fetch_rows(conn, DELTA_QUERY, (low, high))
+    return shaping.shape(columns, rows, DELTA_COLUMNS)
+
+
+def build_delta(records, low, high, dimensions):
+    days, stores, departments = [], [], []
+    for record in records:
+        all_stores = record.pop("AllStores")
+        all_departments = record.pop("AllDepartments")
+        record["SaleDate"] = str(record["SaleDate"])
+        record["SalesInclusive"] = round(record["SalesExclusive"] + record["SalesTax"], 2)
+        store_id = record.pop("StoreID")
+        department_id = record.pop("DepartmentID")
+        if not all_stores:
+            stores.append(dict({"SaleDate": record.pop("SaleDate"), "StoreID": store_id,
+                                "StoreName": dimensions.stores.get(store_id)}, **record))
+        elif not all_departments:
+            departments.append(dict({"SaleDate": record.pop("SaleDate"), "DepartmentID": department_id,
+                                     "DepartmentName": dimensions.department_name(department_id)}, **record))
+        else:
+            days.append(record)
+    return {
+        "from_transaction": low,
+        "to_transaction": high,
+        "transactions": sum(day["TransactionCount"] for day in days),
+        "days": sorted(days, key=lambda day: day["SaleDate"]),
+        "stores": sorted(stores, key=lambda row: (row["SaleDate"], row["StoreID"] is None, row["StoreID"] or 0)),
+        "departments": sorted(departments, key=lambda row: (row["SaleDate"], (row["DepartmentName"] or "").casefold())),
+    }
+
+
+def sse(event, data, event_id=None):
+    head = f"event: {event}\n"
+    if event_id is not None:
+        head += f"id: {event_id}\n"
+    return head.encode("utf-8") + b"data: " + shaping.dumps(data) + b"\n\n"
+
+
+class LiveFeed:
+    # One poller per database however many clients listen: each tick is one MAX() and, when
+    # something arrived, one delta query over the new transactions only. The poller runs
+    # only while there are subscribers.
+    def __init__(self, db, dimension_cache, interval=LIVE_POLL_SECONDS):
+        self.db = db
+        self.dimension_cache = dimension_cache
+        self.interval = interval
+        self.subscribers = set()
+        self.high_water_mark = None
+        self.task = None
+        self.ticks = 0
+        self.deltas = 0
+        self.resyncs = 0
+        self.errors = 0
+        self.last_tick_at = None
+        self.last_error = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            # The next first subscriber starts from the top, not from where this one left
+            self.high_water_mark = None
+
+    def publish(self, event, data, event_id=None):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait((event, data, event_id))
+            except asyncio.QueueFull:
+                # Dropping a delta would leave the client's totals wrong for good, so it
+                # loses the backlog and is told to refetch
+                self.resyncs += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {"reason": "Fell behind the feed; refetch the reports"}, None))
+
+    def close(self, reason):
+        self.publish("reset", {"reason": reason})
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.warning("Live feed tick failed for %s/%s: %s", self.db.server, self.db.database, e)
+            await asyncio.sleep(self.interval)
+
+    async def tick(self):
+        self.ticks += 1
+        self.last_tick_at = datetime.now().isoformat(timespec="seconds")
+        latest = await self.db.run(read_settled, self.high_water_mark)
+        if self.high_water_mark is None:
+            self.high_water_mark = latest
+            self.publish("ready", {"transaction": latest}, latest)
+            return
+        while latest > self.high_water_mark:
+            low = self.high_water_mark
+            high = min(latest, low + LIVE_MAX_TRANSACTIONS)
+            started = time.perf_counter()
+            records = await self.db.run(read_delta, low, high)
+            ids = [record["DepartmentID"] for record in records if not record["AllDepartments"]]
+            dimensions = await self.dimension_cache.resolve(self.db, "department", ids)
+            delta = build_delta(records, low, high, dimensions)
+            delta["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.high_water_mark = high
+            self.deltas += 1
+            self.publish("delta", delta, high)
+
+    async def stream(self, is_disconnected, last_event_id=None):
+        # Server-Sent Events: "ready" once the feed has its starting point, then a "delta"
+        # per batch of new transactions. The event id is the last transaction included.
+        # Subscribes only once the response starts, so a client gone before then leaves
+        # no queue or poller behind.
+        queue = self.subscribe()
+        try:
+            yield sse("hello", {"interval_seconds": self.interval, "transaction": self.high_water_mark})
+            if last_event_id is not None and last_event_id != str(self.high_water_mark):
+                # A reconnect cannot be replayed; the client refetches instead of missing deltas
+                yield sse("resync", {"reason": "Reconnected after missing deltas; refetch the reports"})
+            while True:
+                try:
+                    event, data, event_id = await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        return
+                    yield b": keepalive\n\n"
+                    continue
+                yield sse(event, data, event_id)
+                if event == "reset":
+                    return
+        finally:
+            self.unsubscribe(queue)
+
+
+class LiveHub:
+    def __init__(self, interval=LIVE_POLL_SECONDS):
+        self.interval = interval
+        self._feeds = {}
+
+    def feed(self, db, dimension_cache):
+        scope = (db.server, db.database)
+        feed = self._feeds.get(scope)
+        if feed is None or feed.db is not db:
+            if feed is not None:
+                feed.close("The connection was replaced; resubscribe")
+            feed = LiveFeed(db, dimension_cache, self.interval)
+            self._feeds[scope] = feed
+        return feed
+
+    def close(self, db):
+        for scope, feed in list(self._feeds.items()):
+            if feed.db is db:
+                feed.close("The connection was replaced; resubscribe")
+                del self._feeds[scope]
+
+    def stop(self):
+        for feed in self._feeds.values():
+            feed.close("The server is shutting down")
+        self._feeds.clear()
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "feeds": [
+                {"server": server, "database": database, "subscribers": len(feed.subscribers),
+                 "transaction": feed.high_water_mark, "ticks": feed.ticks, "deltas": feed.deltas,
+                 "resyncs": feed.resyncs, "errors": feed.errors, "last_tick_at": feed.last_tick_at,
+                 "last_error": feed.last_error}
+                for (server, database), feed in self._feeds.items()
+            ],
+        }
@@ -1,84 +1,360 @@
-from fastapi import FastAPI, Query, HTTPException, APIRouter
-import numpy as np
-import pandas as pd
-from database import Database
+from fastapi import FastAPI, Query, HTTPException, APIRouter, Request, Depends
+from database import Database, PoolTimeout
+import rollup
+import export
+import shaping
+import periods as period_module
+import indexes
+import metrics
+import federation
+import reconcile
+import closing
+import profiles
+import drilldown
+import partitions
+import startup
+from cache import ReportCache
+from jobs import JobQueue, QueueFull, SUCCEEDED
+from stock import StockSnapshot
+from dimensions import DimensionCache
+from livefeed import LiveHub
+from snapshot import SnapshotDatabase
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel
+import json
+import logging
+import os
 
-router = APIRouter()
+async def sync_connections():
+    # Profiles live in a store shared by every worker process, so a connection made through
+    # one worker is picked up here, with this worker's own pool built on first use
+    global db_instance
+    connections.sync()
+    if DEFAULT_CONNECTION in connections:
+        db_instance = await connections.get(DEFAULT_CONNECTION)
+
+# Routes that read a database pick up profile changes first
+router = APIRouter(dependencies=[Depends(sync_connections)])
+# Health, metrics and job status answer without touching the profile store or a pool
+service_router = APIRouter()
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECTION = "default"
 
 class DBConnection(BaseModel):
     server: str
     database: str
     username: str
     password: str
+    # "snapshot" answers reports from a local copy that keeps working when the link is down
+    mode: str = "live"
+    # Registers a named connection next to the others; the default one serves requests without targets
+    name: str = DEFAULT_CONNECTION
+
+class ClosePeriodRequest(BaseModel):
+    # Dates as /vat-return takes them; the results for exactly this range are frozen
+    start_date: str
+    end_date: str
+    connection: str = DEFAULT_CONNECTION
+
+class JobRequest(BaseModel):
+    # report is one of JOB_REPORTS; params are the report endpoint's query parameters
+    report: str
+    params: dict = {}
 
 db_instance = None
 
-@router.get("/")
+# Result shaping for the pandas-free endpoints, one converter per column
+VAT_RETURN_COLUMNS = {
+    "SalesInclusive": shaping.money,
+    "SalesExclusive": shaping.money,
+    "SalesTax": shaping.money,
+    "Vatable": shaping.money,
+    "NonVatable": shaping.money,
+    "SortOrder": shaping.integer,
+}
+# Date-range partials keep full precision and are rounded once they are summed
+VAT_RETURN_PARTIAL_COLUMNS = dict(VAT_RETURN_COLUMNS, **{name: shaping.number for name in federation.VAT_RETURN_MEASURES})
+VAT_PERIOD_COLUMNS = dict(VAT_RETURN_COLUMNS, PeriodIndex=shaping.integer, IsTotal=shaping.integer)
+VAT_SUMMARY_COLUMNS = {
+    "TotalExcl": shaping.number,
+    "TotalVAT": shaping.number,
+    "TotalIncl": shaping.number,
+    "TransactionCount": shaping.integer,
+}
+# Partials keep the database's exact money values until they are summed
+VAT_SUMMARY_PARTIAL_COLUMNS = dict(VAT_SUMMARY_COLUMNS, TotalExcl=shaping.exact, TotalVAT=shaping.exact, TotalIncl=shaping.exact)
+VAT_RATE_COLUMNS = {
+    "vat_rate": shaping.nullable_number,
+    "item_count": shaping.integer,
+    "total_sales": shaping.nullable_number,
+    "total_vat": shaping.nullable_number,
+}
+DASHBOARD_SERIES_COLUMNS = {
+    "DepartmentID": shaping.integer,
+    "DailySales": shaping.number,
+    "TransactionCount": shaping.integer,
+}
+DEPARTMENT_COLUMNS = {
+    "DepartmentID": shaping.integer,
+    "StockOnHandCost": shaping.number,
+    "CostOfSales": shaping.nullable_number,
+    "SalesExclusive": shaping.nullable_number,
+    "SalesInclusive": shaping.nullable_number,
+    "GrossProfitValue": shaping.nullable_number,
+    "GrossProfitPercent": shaping.nullable_number,
+    "SalesContributionPercent": shaping.nullable_number,
+}
+report_cache = ReportCache()
+stock_snapshot = StockSnapshot()
+dimension_cache = DimensionCache()
+live_hub = LiveHub()
+closed_periods = closing.ClosedPeriodStore()
+job_queue = JobQueue()
+profile_store = profiles.ProfileStore()
+# Bounds for /departments without a period, inside SQL Server's DATETIME range
+ALL_TIME_START = "1753-01-01"
+ALL_TIME_END = "9999-12-30"
+# Rows per keyset page of the /series endpoints
+SERIES_PAGE_SIZE = 1000
+SERIES_MAX_PAGE_SIZE = 10000
+# Departments past top_departments are folded into this one on the dashboard
+OTHER_DEPARTMENT = "Other"
+
+@service_router.get("/")
 async def home():
     return {"Your backend is running": "Yes"}
 
+def open_database(server, database, username, password, mode):
+    db = Database(server, database, username, password)
+    if mode == "snapshot":
+        if profiles.WEB_CONCURRENCY > 1:
+            # A snapshot syncs into one local directory under a lock that only covers its own process
+            raise Exception("Snapshot mode needs a single worker process (WEB_CONCURRENCY=1)")
+        db = SnapshotDatabase(db)
+    return db.connect()
+
+def release_database(db):
+    # A profile was replaced or removed, here or in another worker
+    global db_instance
+    if db is db_instance:
+        db_instance = None
+    live_hub.close(db)
+    db.close()
+    report_cache.clear()
+    stock_snapshot.clear()
+    dimension_cache.clear()
+
+# Every registered connection by name, the default one included
+connections = profiles.ConnectionRegistry(
+    profile_store,
+    lambda profile, password: open_database(
+        profile["server"], profile["database"], profile["username"], password, profile["mode"]
+    ),
+    release_database,
+)
+
 @router.post("/connect-db")
 async def connect_db(conn: DBConnection):
-    print(f"DEBUG: Connecting to server={conn.server}, database={conn.database}, username={conn.username} ")
+    logger.debug("Connecting to server=%s, database=%s, username=%s, mode=%s", conn.server, conn.database, conn.username, conn.mode)
     global db_instance
+    if conn.mode not in ("live", "snapshot"):
+        raise HTTPException(status_code=400, detail="mode must be live or snapshot")
+    if not conn.name or "," in conn.name or conn.name == "*":
+        raise HTTPException(status_code=400, detail="name must be non-empty and cannot contain commas or be *")
     try:
-        db_instance = Database(conn.server, conn.database, conn.username, conn.password)
-        db_instance.connect()
-        print("DEBUG: Connection Successful!")
-        return {"message": "Connection to the Database successfull"}
+        new_instance = await run_in_threadpool(open_database, conn.server, conn.database, conn.username, conn.password, conn.mode)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        error_msg=str(e)
-        print(f"DEBUG: Connection failed with error:{error_msg}")
+        logger.warning("Connection to %s/%s failed: %s", conn.server, conn.database, e)
         raise HTTPException(status_code=400, detail=str(e))
+    # Only credentials that worked are shared with the other workers
+    revision = await run_in_threadpool(
+        profile_store.save, conn.name, conn.server, conn.database, conn.username, conn.password, conn.mode
+    )
+    # Swaps in the new pool and releases the old one's connections
+    connections.install(conn.name, revision, new_instance)
+    if conn.name == DEFAULT_CONNECTION:
+        db_instance = new_instance
+    report_cache.clear()
+    stock_snapshot.clear()
+    dimension_cache.clear()
+    logger.info("Connected %s to %s/%s in %s mode", conn.name, conn.server, conn.database, conn.mode)
+    return {"message": "Connection to the Database successfull", "name": conn.name}
 
-@router.get("/vat-return")
-async def report_2(
-    start_date: str = Query(..., description="Format: YYYY-MM-DD"), 
-    end_date: str = Query(..., description="Format: YYYY-MM-DD"), 
-    StoreID: int = Query(None, description="Optional: Filter by specific store"),
-    DepartmentID: int = Query(None, description="Optional: Filter by department")
-):
-    global db_instance
-    if not db_instance:
-        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
-    
+@router.get("/connections")
+async def list_connections():
+    return {
+        "connections": [
+            {"name": name, "server": profile["server"], "database": profile["database"], "mode": profile["mode"],
+             "default": name == DEFAULT_CONNECTION, "updated_at": profile["updated_at"],
+             "open_in_worker": connections.pooled(name) is not None}
+            for name, profile in connections.profiles.items()
+        ]
+    }
+
+@router.delete("/connections/{name}")
+async def remove_connection(name: str):
+    if not await run_in_threadpool(profile_store.remove, name):
+        raise HTTPException(status_code=404, detail=f"No connection named {name}")
+    # Closes this worker's pool; the others close theirs on their next request
+    connections.sync()
+    return {"message": f"Connection {name} removed"}
+
+async def resolve_targets(targets):
+    names = list(connections) if targets.strip() == "*" else [name.strip() for name in targets.split(",") if name.strip()]
+    unknown = [name for name in names if name not in connections]
+    if not names:
+        raise HTTPException(status_code=400, detail="No connections registered. Connect with a name first")
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown connections: {', '.join(unknown)}")
+    # A pool that cannot be opened right now shows up as that target's error
+    return {name: await connections.get(name) for name in names}
+
+async def federated_report(targets, run, merge):
+    # Same report on every target at once; failed or slow targets are listed, not fatal
+    sources = await federation.fan_out(await resolve_targets(targets), run)
+    results = [source["result"] for source in sources.values() if source["status"] == "ok"]
+    failed = [name for name, source in sources.items() if source["status"] != "ok"]
+    if not results:
+        raise HTTPException(status_code=502, detail={"message": "No target answered", "sources": sources})
+    return {"group": merge(results), "sources": sources, "failed": failed}
+
+async def read_dimensions(db, kind, ids):
     try:
-        datetime.strptime(start_date, "%Y-%m-%d")
-        datetime.strptime(end_date, "%Y-%m-%d")
-    except:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+        return await dimension_cache.resolve(db, kind, ids)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch dimensions: {str(e)}")
+
+def with_department_name(record, dimensions, keep_id=False):
+    # Report queries group by DepartmentID only; the name comes from the dimension cache
+    department_id = record["DepartmentID"] if keep_id else record.pop("DepartmentID")
+    return dict({"DepartmentName": dimensions.department_name(department_id)}, **record)
+
+def read_closed(closed_part, period_id):
+    try:
+        return closed_part(period_id)
+    except closing.ClosedPeriodCorrupt as e:
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def from_closed_periods(db, start_date, end_date, closed_part, compute, merge):
+    # Closed periods inside the range come from the local store and only the open gaps
+    # between them are queried; None when no closed period lies inside the range.
+    # closed_part(period_id) returns a stored result or None, compute(start, end) a live
+    # one; both unrounded, so merge rounds the combined totals once.
+    covered = closed_periods.covering((db.server, db.database), start_date, end_date)
+    if not covered:
+        return None
+    parts = []
+    for period in covered:
+        part = read_closed(closed_part, period["id"])
+        if part is None:
+            return None
+        parts.append(part)
+    # Closed periods include both boundary days, so a gap ends the day before one starts
+    # and the next gap begins the day after it ends
+    gaps = []
+    cursor = period_module.parse_date(start_date)
+    for period in covered:
+        period_start = period_module.parse_date(period["start_date"])
+        if period_start > cursor:
+            gaps.append((cursor, period_start - timedelta(days=1)))
+        cursor = period_module.parse_date(period["end_date"]) + timedelta(days=1)
+    if cursor <= period_module.parse_date(end_date):
+        gaps.append((cursor, period_module.parse_date(end_date)))
+    for gap_start, gap_end in gaps:
+        # Through JSON like the stored parts, so both merge on the same key types
+        parts.append(json.loads(shaping.dumps(await compute(gap_start.isoformat(), gap_end.isoformat()))))
+    return merge(parts)
+
+def department_slice(result, department_name):
+    # A DepartmentID-filtered return out of the unfiltered one; None when the name is ambiguous
+    rows = [row for row in result["departments"] if row["DepartmentName"] == department_name]
+    if department_name is None or len(rows) > 1:
+        return None
+    totals = [rows[0][measure] for measure in federation.VAT_RETURN_MEASURES] if rows else [0.0] * len(federation.VAT_RETURN_MEASURES)
+    return {"departments": rows, "summary": dict(zip(federation.VAT_RETURN_SUMMARY, totals))}
+
+def parse_partitioning(start_date, end_date, partition_days=None, parallelism=None):
+    # (days, parallelism) when the range is to run as date-range partitions, otherwise None
+    days = partition_days or 0
+    if days < 0:
+        raise HTTPException(status_code=400, detail="partition_days cannot be negative")
+    if parallelism is not None and parallelism < 1:
+        raise HTTPException(status_code=400, detail="parallelism must be at least 1")
+    if days == 0:
+        return None
+    count = len(partitions.split_range(start_date, end_date, days))
+    if count > partitions.MAX_PARTITIONS:
+        raise HTTPException(status_code=400, detail=f"At most {partitions.MAX_PARTITIONS} partitions per request; use a larger partition_days")
+    if count <= 1:
+        return None
+    return days, parallelism or partitions.PARTITION_PARALLELISM
+
+async def vat_return_result(db, start_date, end_date, StoreID=None, DepartmentID=None, partitioning=None):
+    department_name = None
+    if DepartmentID is not None:
+        department_name = (await read_dimensions(db, "department", [DepartmentID])).department_name(DepartmentID)
+
+    def closed_part(period_id):
+        result = closed_periods.load(period_id, "vat-return", StoreID)
+        if result is None or DepartmentID is None:
+            return result
+        return department_slice(result, department_name)
 
-    conn = db_instance.get_connection()
+    live = lambda start, end: vat_return_report(db, start, end, StoreID, DepartmentID)
+    partial = lambda start, end: vat_return_report(db, start, end, StoreID, DepartmentID, partial=True)
+    gap = partial
+    split = None
+    if partitioning is not None:
+        # Open ranges run as partitions; closed periods still come from the store
+        split = partitions.RangeSplit("vat-return", *partitioning)
+        live = lambda start, end: split.run(start, end, partial, federation.merge_vat_return)
+        gap = lambda start, end: split.run(start, end, partial, federation.sum_vat_return)
 
+    result = await from_closed_periods(db, start_date, end_date, closed_part, gap, federation.merge_vat_return)
+    if result is None:
+        result = await live(start_date, end_date)
+    if split is not None:
+        result = dict(result, partitioning=split.describe())
+    return result
+
+async def vat_return_report(db, start_date, end_date, StoreID=None, DepartmentID=None, partial=False):
     dept_filter = ""
-    params = (start_date, end_date)
+    filter_params = ()
     if StoreID is not None:
-        dept_filter += " AND te.StoreID = ?"
-        params += (StoreID,)
+        dept_filter += " AND s.StoreID = ?"
+        filter_params += (StoreID,)
     if DepartmentID is not None:
-        dept_filter += " AND i.DepartmentID = ?"
-        params += (DepartmentID,)
+        dept_filter += " AND s.DepartmentID = ?"
+        filter_params += (DepartmentID,)
 
-    base_query = f"""
-    WITH DepartmentSales AS (
+    def build_query(hwm):
+        # Covered days come from the daily rollup, the rest from the raw tables
+        source_query, source_params = rollup.sales_source(hwm, start_date, end_date)
+        base_query = f"""
+    WITH Sales AS ({source_query}
+    ),
+    DepartmentSales AS (
         SELECT 
-            d.Name AS DepartmentName,
-            SUM(te.Quantity * te.Price) AS SalesExclusive,
-            SUM(te.SalesTax) AS SalesTax
-        FROM TransactionEntry te
-        JOIN Item i ON i.ID = te.ItemID
-        JOIN Department d ON d.ID = i.DepartmentID
-        JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
-        WHERE t.Time >= ? AND t.Time <= ?{dept_filter}
-        GROUP BY d.ID, d.Name
+            s.DepartmentID,
+            SUM(s.SalesExclusive) AS SalesExclusive,
+            SUM(s.SalesTax) AS SalesTax
+        FROM Sales s
+        WHERE s.DepartmentID IN (SELECT ID FROM Department){dept_filter}
+        GROUP BY s.DepartmentID
     )
     SELECT *
     FROM (
         SELECT 
-            'TOTAL' AS DepartmentName,
+            NULL AS DepartmentID,
             SUM(ds.SalesExclusive + ds.SalesTax) AS SalesInclusive,
             SUM(ds.SalesExclusive) AS SalesExclusive,
             SUM(ds.SalesTax) AS SalesTax,
@@ -90,7 +366,7 @@ async def report_2(
         UNION ALL
 
         SELECT 
-            ds.DepartmentName,
+            ds.DepartmentID,
             (ds.SalesExclusive + ds.SalesTax) AS SalesInclusive,
             ds.SalesExclusive,
             ds.SalesTax,
@@ -99,20 +375,22 @@ async def report_2(
             1 AS SortOrder
         FROM DepartmentSales ds
     ) t
-    ORDER BY t.SortOrder, t.DepartmentName;
+    ORDER BY t.SortOrder;
     """
+        params = source_params + filter_params
+        logger.debug("VAT return query: %s params=%r", base_query, params)
+        return base_query, params
 
     try:
-        print("VAT RETURN QUERY:", base_query)
-        print("PARAMS:", params)
-        df = pd.read_sql(base_query, conn, params=params)
+        columns, rows = await rollup.read_rows(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        import traceback
-        print("ERROR:", str(e))
-        traceback.print_exc()
+        logger.exception("Report query failed")
         raise HTTPException(status_code=400, detail=f"Database Query failed: {str(e)}")
 
-    if df.empty:
+    records = shaping.shape(columns, rows, VAT_RETURN_PARTIAL_COLUMNS if partial else VAT_RETURN_COLUMNS)
+    if not records:
         return {
             "departments": [],
             "summary": {
@@ -124,43 +402,412 @@ async def report_2(
             }
         }
 
-    df = df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
-
-    totals_row = df[df['DepartmentName'] == 'TOTAL'].iloc[0]
+    # The TOTAL row sorts first (SortOrder 0)
+    totals_row = records[0]
     summary = {
-        "total_sales_inclusive": round(float(totals_row['SalesInclusive']), 2),
-        "total_sales_exclusive": round(float(totals_row['SalesExclusive']), 2),
-        "total_sales_tax": round(float(totals_row['SalesTax']), 2),
-        "total_vatable": round(float(totals_row['Vatable']), 2),
-        "total_non_vatable": round(float(totals_row['NonVatable']), 2)
+        "total_sales_inclusive": totals_row['SalesInclusive'],
+        "total_sales_exclusive": totals_row['SalesExclusive'],
+        "total_sales_tax": totals_row['SalesTax'],
+        "total_vatable": totals_row['Vatable'],
+        "total_non_vatable": totals_row['NonVatable']
     }
 
-    departments_df = df[df['DepartmentName'] != 'TOTAL']
-
+    dimensions = await read_dimensions(db, "department", [record['DepartmentID'] for record in records[1:]])
     departments_list = []
-    for _, row in departments_df.iterrows():
-        departments_list.append({
-            "DepartmentName": row['DepartmentName'],
-            "SalesInclusive": round(float(row['SalesInclusive']), 2),
-            "SalesExclusive": round(float(row['SalesExclusive']), 2),
-            "SalesTax": round(float(row['SalesTax']), 2),
-            "Vatable": round(float(row['Vatable']), 2),
-            "NonVatable": round(float(row['NonVatable']), 2)
-        })
+    for record in records[1:]:
+        del record['SortOrder']
+        departments_list.append(with_department_name(record, dimensions))
+    departments_list.sort(key=federation.department_order)
 
     return {
         "departments": departments_list,
         "summary": summary
     }
 
+@router.get("/vat-return")
+async def report_2(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"), 
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"), 
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    DepartmentID: int = Query(None, description="Optional: Filter by department"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals"),
+    partition_days: int = Query(None, ge=0, description="Optional: run the period as partitions of this many days in parallel, 0 for one query"),
+    parallelism: int = Query(None, ge=1, description="Optional: partitions running at once")
+):
+    global db_instance
+    if not db_instance and not targets:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    partitioning = parse_partitioning(start_date, end_date, partition_days, parallelism)
+    params = {"start_date": start_date, "end_date": end_date, "StoreID": StoreID, "DepartmentID": DepartmentID,
+              "partitioning": partitioning}
+    run = lambda db: report_cache.get_or_compute(
+        db, "vat-return", params,
+        lambda: vat_return_result(db, start_date, end_date, StoreID, DepartmentID, partitioning)
+    )
+    if targets:
+        return shaping.ReportResponse(await federated_report(targets, run, federation.merge_vat_return))
+    return shaping.ReportResponse(await run(db_instance))
+
+async def vat_return_periods_report(db, period_list, StoreID=None, DepartmentID=None):
+    # period_list holds (start, end) dates with both days included
+    dept_filter = ""
+    filter_params = ()
+    if StoreID is not None:
+        dept_filter += " AND s.StoreID = ?"
+        filter_params += (StoreID,)
+    if DepartmentID is not None:
+        dept_filter += " AND s.DepartmentID = ?"
+        filter_params += (DepartmentID,)
+
+    period_values = ", ".join("(?, CAST(? AS DATE), CAST(? AS DATE))" for _ in period_list)
+    period_params = ()
+    for index, (period_start, period_end) in enumerate(period_list):
+        period_params += (index, period_start.isoformat(), (period_end + timedelta(days=1)).isoformat())
+    range_start = min(start for start, _ in period_list).isoformat()
+    range_end = max(end for _, end in period_list).isoformat()
+
+    def build_query(hwm):
+        # One scan over the union of all periods; overlapping periods each get their rows
+        source_query, source_params = rollup.sales_source(hwm, range_start, range_end)
+        query = f"""
+    WITH Periods AS (
+        SELECT * FROM (VALUES {period_values}) p(PeriodIndex, PeriodStart, PeriodStop)
+    ),
+    Sales AS ({source_query}
+    ),
+    PeriodSales AS (
+        SELECT 
+            p.PeriodIndex,
+            s.DepartmentID,
+            GROUPING(s.DepartmentID) AS IsTotal,
+            SUM(s.SalesExclusive) AS SalesExclusive,
+            SUM(s.SalesTax) AS SalesTax
+        FROM Sales s
+        JOIN Periods p ON s.SaleDate >= p.PeriodStart AND s.SaleDate < p.PeriodStop
+        WHERE s.DepartmentID IN (SELECT ID FROM Department){dept_filter}
+        GROUP BY GROUPING SETS ((p.PeriodIndex, s.DepartmentID), (p.PeriodIndex))
+    )
+    SELECT 
+        ps.PeriodIndex,
+        ps.IsTotal,
+        ps.DepartmentID,
+        (ps.SalesExclusive + ps.SalesTax) AS SalesInclusive,
+        ps.SalesExclusive,
+        ps.SalesTax,
+        (ps.SalesExclusive + ps.SalesTax - ps.SalesExclusive) * 6.25 AS Vatable,
+        ps.SalesExclusive - ((ps.SalesExclusive + ps.SalesTax - ps.SalesExclusive) * 6.25) AS NonVatable
+    FROM PeriodSales ps
+    ORDER BY ps.PeriodIndex, ps.IsTotal DESC;
+    """
+        return query, period_params + source_params + filter_params
+
+    try:
+        columns, rows = await rollup.read_rows(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception("Report query failed")
+        raise HTTPException(status_code=400, detail=f"Database Query failed: {str(e)}")
+
+    results = [
+        {
+            "period": {"start_date": period_start.isoformat(), "end_date": period_end.isoformat()},
+            "departments": [],
+            "summary": {
+                "total_sales_inclusive": 0.0,
+                "total_sales_exclusive": 0.0,
+                "total_sales_tax": 0.0,
+                "total_vatable": 0.0,
+                "total_non_vatable": 0.0
+            }
+        }
+        for period_start, period_end in period_list
+    ]
+    records = shaping.shape(columns, rows, VAT_PERIOD_COLUMNS)
+    dimensions = await read_dimensions(db, "department", [record['DepartmentID'] for record in records])
+    for record in records:
+        result = results[record.pop('PeriodIndex')]
+        if record.pop('IsTotal'):
+            result["summary"] = {
+                "total_sales_inclusive": record['SalesInclusive'],
+                "total_sales_exclusive": record['SalesExclusive'],
+                "total_sales_tax": record['SalesTax'],
+                "total_vatable": record['Vatable'],
+                "total_non_vatable": record['NonVatable']
+            }
+        else:
+            result["departments"].append(with_department_name(record, dimensions))
+    for result in results:
+        result["departments"].sort(key=federation.department_order)
+    return results
+
+def parse_period_list(periods, start_date, end_date, granularity, fiscal_year_start_month=1):
+    try:
+        if periods:
+            period_list = [period_module.parse_period(period) for period in periods]
+        elif granularity in period_module.GRANULARITIES and start_date and end_date:
+            period_list = period_module.generate_periods(
+                period_module.parse_date(start_date), period_module.parse_date(end_date), granularity, fiscal_year_start_month
+            )
+        else:
+            raise HTTPException(status_code=400, detail="Pass periods, or start_date, end_date and a granularity of month, quarter or year")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid period: {str(e)}. Use YYYY-MM-DD")
+
+    if not period_list:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    if len(period_list) > period_module.MAX_PERIODS:
+        raise HTTPException(status_code=400, detail=f"At most {period_module.MAX_PERIODS} periods per request")
+    return period_list
+
+def parse_buckets(start_date, end_date, granularity):
+    # None for a daily series, otherwise the (start, stop) buckets covering the range
+    if granularity not in period_module.SERIES_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(period_module.SERIES_GRANULARITIES)}")
+    if granularity == "day":
+        return None
+    buckets = period_module.generate_buckets(period_module.parse_date(start_date), period_module.parse_date(end_date), granularity)
+    if not buckets:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    if len(buckets) > period_module.MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {period_module.MAX_BUCKETS} buckets per request; use a coarser granularity")
+    return buckets
+
+def bucket_join(buckets, date_column):
+    # (bucket expression, join clause, params) that group date_column into buckets in the database
+    if buckets is None:
+        return date_column, "", ()
+    values = ", ".join("(CAST(? AS DATE), CAST(? AS DATE))" for _ in buckets)
+    clause = f"""
+            JOIN (VALUES {values}) b(BucketStart, BucketStop)
+                ON {date_column} >= b.BucketStart AND {date_column} < b.BucketStop"""
+    return "b.BucketStart", clause, tuple(day.isoformat() for bucket in buckets for day in bucket)
+
+@router.get("/vat-return/periods")
+async def vat_return_periods(
+    start_date: str = Query(None, description="Format: YYYY-MM-DD, required with granularity"),
+    end_date: str = Query(None, description="Format: YYYY-MM-DD, required with granularity"),
+    granularity: str = Query(None, description="month, quarter or year"),
+    fiscal_year_start_month: int = Query(1, ge=1, le=12, description="First month of the fiscal year for granularity=year"),
+    periods: list[str] = Query(None, description="Explicit periods as YYYY-MM-DD:YYYY-MM-DD, repeatable"),
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    DepartmentID: int = Query(None, description="Optional: Filter by department"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals")
+):
+    global db_instance
+    if not db_instance and not targets:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    period_list = parse_period_list(periods, start_date, end_date, granularity, fiscal_year_start_month)
+    params = {"periods": tuple(period_list), "StoreID": StoreID, "DepartmentID": DepartmentID}
+    run = lambda db: report_cache.get_or_compute(
+        db, "vat-return-periods", params,
+        lambda: vat_return_periods_report(db, period_list, StoreID, DepartmentID)
+    )
+    granularity = None if periods else granularity
+    if targets:
+        result = await federated_report(targets, run, federation.merge_vat_return_periods)
+        return shaping.ReportResponse(dict(result, granularity=granularity))
+    return shaping.ReportResponse({"granularity": granularity, "periods": await run(db_instance)})
+
+@router.get("/vat-return/export")
+async def export_vat_return(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"), 
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"), 
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    DepartmentID: int = Query(None, description="Optional: Filter by department"),
+    format: str = Query("csv", description="csv, ndjson or parquet")
+):
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format. Use one of: {', '.join(export.FORMATS)}")
+    if format == "parquet" and not export.HAS_PYARROW:
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow to be installed")
+
+    # Run the query before answering so SQL errors still get a proper status code
+    query, params = export.audit_query(start_date, end_date, StoreID, DepartmentID)
+    try:
+        stream = await run_in_threadpool(export.RowStream(db_instance, query, params).open)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Export query failed: {str(e)}")
+
+    media_type, chunks = export.FORMATS[format]
+    filename = f"vat-audit_{start_date}_{end_date}.{format}"
+    return StreamingResponse(
+        chunks(stream),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/rollup/refresh")
+async def refresh_rollup():
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    if isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="The rollup lives on the SQL Server; use /snapshot/sync for a local snapshot")
+
+    try:
+        return await db_instance.run(rollup.refresh)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Rollup refresh failed: {str(e)}")
+
+@router.get("/rollup/status")
+async def rollup_status():
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    try:
+        return await db_instance.run(rollup.status)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read rollup status: {str(e)}")
+
+async def vat_summary_rows(db, start_date, end_date, StoreID=None, buckets=None, after=None, limit=None, partial=False):
+    # buckets from parse_buckets make TransactionDate the bucket's first day; after and
+    # limit return one keyset page of the series
+    store_filter = ""
+    filter_params = ()
+    if StoreID is not None:
+        store_filter = " AND h.StoreID = ?"
+        filter_params = (StoreID,)
+    bucket, bucket_clause, bucket_params = bucket_join(buckets, "h.SaleDate")
+    page_filter = ""
+    page_params = ()
+    if after is not None:
+        # Days before the cursor's bucket cannot be on this page, so they are not read
+        start_date = max(start_date, after)
+        page_filter = " WHERE s.TransactionDate > CAST(? AS DATE)"
+        page_params = (after,)
+    page_limit = ""
+    if limit is not None:
+        page_limit = " OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY"
+        page_params += (limit,)
+
+    def build_query(hwm):
+        source_query, source_params = rollup.header_source(hwm, start_date, end_date)
+        transaction_query = f"""
+            WITH Headers AS ({source_query}
+            ),
+            Series AS (
+                SELECT 
+                    {bucket} as TransactionDate,
+                    SUM(h.HeaderTotal) - SUM(h.HeaderSalesTax) as TotalExcl,
+                    SUM(h.HeaderSalesTax) as TotalVAT,
+                    SUM(h.HeaderTotal) as TotalIncl,
+                    SUM(h.HeaderCount) as TransactionCount
+                FROM Headers h{bucket_clause}
+                WHERE 1 = 1{store_filter}
+                GROUP BY {bucket}
+            )
+            SELECT s.* FROM Series s{page_filter}
+            ORDER BY s.TransactionDate{page_limit}
+        """
+        return transaction_query, source_params + bucket_params + filter_params + page_params
+
+    try:
+        columns, rows = await rollup.read_rows(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    return shaping.shape(columns, rows, VAT_SUMMARY_PARTIAL_COLUMNS if partial else VAT_SUMMARY_COLUMNS)
+
+async def vat_summary_report(db, start_date, end_date, StoreID=None, buckets=None, partial=False):
+    daily_breakdown = await vat_summary_rows(db, start_date, end_date, StoreID, buckets, partial=partial)
+    logger.debug("VAT summary first days: %s", daily_breakdown[:10])
+    return {
+        "period": {
+            "start_date": start_date,
+            "end_date": end_date
+        },
+        "summary": {
+            "total_sales_excl_vat": shaping.column_total(daily_breakdown, 'TotalExcl'),
+            "total_vat_amount": shaping.column_total(daily_breakdown, 'TotalVAT'),
+            "total_sales_incl_vat": shaping.column_total(daily_breakdown, 'TotalIncl'),
+            "total_transactions": sum(day['TransactionCount'] for day in daily_breakdown)
+        },
+        "daily_breakdown": daily_breakdown
+    }
+
+def rebucket(daily_breakdown, granularity):
+    # Daily rows summed into calendar buckets labelled like parse_buckets labels them
+    relabelled = [
+        dict(day, TransactionDate=period_module.bucket_start(date.fromisoformat(str(day["TransactionDate"])[:10]), granularity).isoformat())
+        for day in daily_breakdown
+    ]
+    rows = federation.sum_records([relabelled], ("TransactionDate",), federation.VAT_SUMMARY_MEASURES)
+    return sorted(rows, key=lambda row: row["TransactionDate"])
+
+async def vat_summary_result(db, start_date, end_date, StoreID=None, buckets=None, granularity="day", partitioning=None):
+    # Closed periods hold daily rows; other granularities are summed up from them
+    live = lambda start, end: vat_summary_report(db, start, end, StoreID)
+    split = None
+    if partitioning is not None:
+        split = partitions.RangeSplit("vat-summary", *partitioning)
+        live = lambda start, end: split.run(
+            start, end, lambda part_start, part_end: vat_summary_report(db, part_start, part_end, StoreID, partial=True),
+            federation.merge_vat_summary,
+        )
+
+    result = await from_closed_periods(
+        db, start_date, end_date,
+        lambda period_id: closed_periods.load(period_id, "vat-summary", StoreID),
+        live,
+        federation.merge_vat_summary,
+    )
+    if result is not None:
+        if buckets is not None:
+            result["daily_breakdown"] = rebucket(result["daily_breakdown"], granularity)
+    elif split is None:
+        return await vat_summary_report(db, start_date, end_date, StoreID, buckets)
+    else:
+        # Every partition groups into the whole range's buckets, so a bucket cut by a
+        # partition boundary adds up again by its label
+        result = await split.run(
+            start_date, end_date,
+            lambda part_start, part_end: vat_summary_report(db, part_start, part_end, StoreID, buckets, partial=True),
+            federation.merge_vat_summary,
+        )
+    result["period"] = {"start_date": start_date, "end_date": end_date}
+    if split is not None:
+        result["partitioning"] = split.describe()
+    return result
+
 @router.get('/vat-summary')
 async def vat_summary(
     start_date: str =Query(..., description="Format: YYYY-MM-DD"),
     end_date: str = Query(..., description="Format: YYYY-MM-DD"),
-    StoreID: int = Query(None, description="Optional: Filter by specific store")
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    granularity: str = Query("day", description="daily_breakdown rows per day, week, month or quarter"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals"),
+    partition_days: int = Query(None, ge=0, description="Optional: run the period as partitions of this many days in parallel, 0 for one query"),
+    parallelism: int = Query(None, ge=1, description="Optional: partitions running at once")
 ):
     global db_instance
-    if not db_instance:
+    if not db_instance and not targets:
         raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
     
     try:
@@ -169,87 +816,221 @@ async def vat_summary(
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Please use YYYY-MM-DD")
     
-    conn = db_instance.get_connection()
-
-    transaction_query = """
-            SELECT 
-                CAST(Time as DATE) as TransactionDate,
-                SUM(Total) - SUM(SalesTax) as TotalExcl,
-                SUM(SalesTax) as TotalVAT,
-                SUM(Total) as TotalIncl,
-                COUNT(*) as TransactionCount
-            FROM [Transaction]
-            WHERE Time >= ? AND Time <= ?
-        """
-    
-    params = (start_date, end_date)
-    if StoreID is not None:
-        transaction_query += " AND StoreID = ?"
-        params += (StoreID,)
-    
-    transaction_query += " GROUP BY CAST(Time as DATE) ORDER BY CAST(Time AS Date)"
-    
+    buckets = parse_buckets(start_date, end_date, granularity)
+    partitioning = parse_partitioning(start_date, end_date, partition_days, parallelism)
+    params = {"start_date": start_date, "end_date": end_date, "StoreID": StoreID, "granularity": granularity,
+              "partitioning": partitioning}
+    run = lambda db: report_cache.get_or_compute(
+        db, "vat-summary", params,
+        lambda: vat_summary_result(db, start_date, end_date, StoreID, buckets, granularity, partitioning)
+    )
+    if targets:
+        result = await federated_report(targets, run, federation.merge_vat_summary)
+        return shaping.ReportResponse(dict(result, granularity=granularity))
+    return shaping.ReportResponse(dict(await run(db_instance), granularity=granularity))
+
+@router.get('/vat-summary/series')
+async def vat_summary_series(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    granularity: str = Query("day", description="Rows per day, week, month or quarter"),
+    after: str = Query(None, description="next_after of the previous page"),
+    limit: int = Query(SERIES_PAGE_SIZE, ge=1, le=SERIES_MAX_PAGE_SIZE)
+):
+    # daily_breakdown of /vat-summary one page at a time, oldest first
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
     try:
-        df = pd.read_sql(transaction_query, conn, params=params)
-        df = df.replace({np.nan: 0})
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+        if after is not None:
+            datetime.strptime(after, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Please use YYYY-MM-DD")
 
-        print("DEBUG")
-        print(df.head(10))
-        print(df.dtypes)
-        return {
-            "period": {
-                "start_date": start_date,
-                "end_date": end_date
-            },
-            "summary": {
-                "total_sales_excl_vat": round(df['TotalExcl'].sum(), 2),
-                "total_vat_amount": round(df['TotalVAT'].sum(), 2),
-                "total_sales_incl_vat": round(df['TotalIncl'].sum(), 2),
-                "total_transactions": int(df['TransactionCount'].sum())
-            },
-            "daily_breakdown": df.to_dict(orient="records")
-        }
+    db = db_instance
+    buckets = parse_buckets(start_date, end_date, granularity)
+    params = {"start_date": start_date, "end_date": end_date, "StoreID": StoreID, "granularity": granularity,
+              "after": after, "limit": limit}
+    # One extra row tells whether another page follows
+    rows = await report_cache.get_or_compute(
+        db, "vat-summary-series", params,
+        lambda: vat_summary_rows(db, start_date, end_date, StoreID, buckets, after, limit + 1)
+    )
+    page = rows[:limit]
+    next_after = str(page[-1]["TransactionDate"]) if len(rows) > limit else None
+    return shaping.ReportResponse({"granularity": granularity, "rows": page, "next_after": next_after})
+
+@router.post("/snapshot/sync")
+async def sync_snapshot():
+    global db_instance
+    if not isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="Not connected in snapshot mode")
+
+    try:
+        return await run_in_threadpool(db_instance.sync)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Snapshot sync failed, reports keep using the last snapshot: {str(e)}")
 
-@router.get("/departments")
-async def get_departments():
+@router.get("/snapshot/status")
+async def snapshot_status():
+    global db_instance
+    if not isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="Not connected in snapshot mode")
+    return db_instance.status()
+
+@router.get("/indexes")
+async def index_status():
     global db_instance
     if not db_instance:
         raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
-    
-    conn = db_instance.get_connection()
-    
+    if isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="Indexes live on the SQL Server; connect in live mode to inspect them")
+
     try:
-        query = """
-                WITH DepartmentSales AS (
-                    SELECT 
-                        d.Name AS DepartmentName,
-                        d.ID AS DepartmentID,
-                        SUM(te.Quantity * i.Cost) AS CostOfSales,
-                        SUM(te.Quantity * te.Price) AS SalesExclusive,
-                        SUM(te.SalesTax) AS SalesTax
-                FROM TransactionEntry te
-                JOIN Item i ON i.ID = te.ItemID
-                JOIN Department d ON d.ID = i.DepartmentID
-                JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
-                GROUP BY d.ID, d.Name
+        report = await db_instance.run(indexes.inspect)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to inspect indexes: {str(e)}")
+    return {
+        "indexes": report,
+        "missing": [index["name"] for index in report if index["status"] == "missing"],
+    }
+
+@router.post("/indexes/create")
+async def create_indexes(
+    allow_offline: bool = Query(False, description="Build offline where the edition cannot build online; this blocks writes to the table")
+):
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    if isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="Indexes live on the SQL Server; connect in live mode to create them")
+
+    try:
+        return await db_instance.run(indexes.create_missing, allow_offline)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Index creation failed: {str(e)}")
+
+@router.get("/indexes/plans")
+async def report_plans(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    DepartmentID: int = Query(None, description="Optional: Filter by department"),
+    include_xml: bool = Query(False, description="Return the raw showplan XML as well")
+):
+    # Runs every report once, bypassing the cache, and returns the estimated and actual
+    # plan of each query so a database can be compared before and after /indexes/create
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    if isinstance(db_instance, SnapshotDatabase):
+        raise HTTPException(status_code=400, detail="Query plans come from the SQL Server; connect in live mode to capture them")
+
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    reports = {
+        "vat-return": lambda db: vat_return_report(db, start_date, end_date, StoreID, DepartmentID),
+        "vat-return/periods": lambda db: vat_return_periods_report(db, [(start, end)], StoreID, DepartmentID),
+        "vat-summary": lambda db: vat_summary_report(db, start_date, end_date, StoreID),
+        "vat-rates": lambda db: vat_rates_report(db, start_date, end_date),
+        "departments": lambda db: departments_report(db, start_date, end_date, StoreID, DepartmentID),
+        "sales-dashboard": lambda db: sales_dashboard_report(db, start_date, end_date, DepartmentID),
+    }
+    results = {}
+    for name, report in reports.items():
+        capture = indexes.PlanCapture(db_instance, include_xml)
+        try:
+            with metrics.label(f"plans:{name}"):
+                await report(capture)
+            results[name] = {"queries": capture.captures}
+        except HTTPException as e:
+            results[name] = {"queries": capture.captures, "error": e.detail}
+    return {
+        "indexes": await db_instance.run(indexes.inspect),
+        "reports": results,
+    }
+
+@service_router.get("/metrics")
+async def get_metrics():
+    # This worker's counters only; scrapes land on any worker, so totals need the pid to tell them apart
+    stats = report_cache.stats()
+    gauges = {
+        "vat_report_cache_entries": ("Reports held in the cache", stats["entries"]),
+        "vat_report_cache_bytes": ("Approximate size of the cached reports", stats["bytes"]),
+        "vat_report_cache_hits": ("Report cache hits since start", stats["hits"]),
+        "vat_report_cache_misses": ("Report cache misses since start", stats["misses"]),
+        "vat_worker_pid": ("Process id of the worker that answered this scrape", os.getpid()),
+    }
+    if startup.timer.first_response_ms is not None:
+        gauges["vat_time_to_first_response_seconds"] = (
+            "Time from launch to the first response served", startup.timer.first_response_ms / 1000
+        )
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+@service_router.get("/cache/stats")
+async def cache_stats():
+    return report_cache.stats()
+
+@service_router.get("/startup")
+async def startup_report():
+    # Launch phases, imports deferred to first use and time to the first responses
+    return startup.timer.report()
+
+async def departments_report(db, start_date=None, end_date=None, StoreID=None, DepartmentID=None):
+    sales = await department_sales_report(db, start_date, end_date, StoreID, DepartmentID)
+    return with_stock_on_hand(sales, await read_stock_on_hand(db))
+
+async def department_sales_report(db, start_date=None, end_date=None, StoreID=None, DepartmentID=None):
+    # Without a period the rollup still answers everything before its high-water mark
+    start_date = start_date or ALL_TIME_START
+    end_date = end_date or ALL_TIME_END
+    store_filter = ""
+    filter_params = ()
+    if StoreID is not None:
+        store_filter = " AND s.StoreID = ?"
+        filter_params = (StoreID,)
+    # Applied after the total so contribution stays a share of all departments
+    dept_filter = ""
+    dept_params = ()
+    if DepartmentID is not None:
+        dept_filter = " WHERE ds.DepartmentID = ?"
+        dept_params = (DepartmentID,)
+
+    def build_query(hwm):
+        source_query, source_params = rollup.sales_source(hwm, start_date, end_date)
+        query = f"""
+                WITH Sales AS ({source_query}
                 ),
-                DepartmentStock AS (
-                    SELECT
-                        ios.DepartmentID,
-                        SUM(ios.Quantity * ios.Cost) AS StockOnHandCost
-                    FROM IX_ITEMOPENINGSTOCK ios
-                    GROUP BY ios.DepartmentID
+                DepartmentSales AS (
+                    SELECT 
+                        s.DepartmentID,
+                        SUM(s.Cost) AS CostOfSales,
+                        SUM(s.SalesExclusive) AS SalesExclusive,
+                        SUM(s.SalesTax) AS SalesTax
+                FROM Sales s
+                WHERE s.DepartmentID IN (SELECT ID FROM Department){store_filter}
+                GROUP BY s.DepartmentID
                 ),
                 TotalSales AS (
                     SELECT SUM(SalesExclusive) AS TotalSalesExclusive
                     FROM DepartmentSales
                 )
                 SELECT 
-                    ds.DepartmentName,
                     ds.DepartmentID,
-                    ISNULL(st.StockOnHandCost, 0) AS StockOnHandCost,
                     ds.CostOfSales,
                     ds.SalesExclusive,
                     (ds.SalesExclusive + ds.SalesTax) AS SalesInclusive,
@@ -263,209 +1044,806 @@ async def get_departments():
                         ELSE 0
                     END AS SalesContributionPercent
                 FROM DepartmentSales ds
-                LEFT JOIN DepartmentStock st ON st.DepartmentID = ds.DepartmentID
-                CROSS JOIN TotalSales ts
-                ORDER BY ds.DepartmentName;
+                CROSS JOIN TotalSales ts{dept_filter};
                """
-        df = pd.read_sql(query, conn)
-        return {"departments": df.to_dict(orient="records")}
-    
+        return query, source_params + filter_params + dept_params
+
+    try:
+        columns, rows = await rollup.read_rows(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch departments: {str(e)}")
+    records = shaping.shape(columns, rows, DEPARTMENT_COLUMNS)
+    dimensions = await read_dimensions(db, "department", [record["DepartmentID"] for record in records])
+    departments = [with_department_name(record, dimensions, keep_id=True) for record in records]
+    departments.sort(key=federation.department_order)
+    return departments
 
-@router.get("/vat-rates")
-async def get_vat_rates(
-    start_date: str = Query(None, description="Optional: Format YYYY-MM-DD"),
-    end_date: str = Query(None, description="Optional: Format YYYY-MM-DD")
+async def read_stock_on_hand(db):
+    try:
+        return await stock_snapshot.get(db)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch stock on hand: {str(e)}")
+
+def with_stock_on_hand(sales, stock):
+    # Stock is held per department across all stores, whatever the sales filters are
+    departments = []
+    for record in sales:
+        department = {"DepartmentName": record["DepartmentName"], "DepartmentID": record["DepartmentID"],
+                      "StockOnHandCost": shaping.number(stock.get(record["DepartmentID"]))}
+        department.update(record)
+        departments.append(department)
+    return {"departments": departments}
+
+@router.get("/departments")
+async def get_departments(
+    start_date: str = Query(None, description="Optional: Format YYYY-MM-DD, together with end_date"),
+    end_date: str = Query(None, description="Optional: Format YYYY-MM-DD, together with start_date"),
+    StoreID: int = Query(None, description="Optional: Filter sales by store"),
+    DepartmentID: int = Query(None, description="Optional: Filter by department"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals")
 ):
     global db_instance
-    if not db_instance:
+    if not db_instance and not targets:
         raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
-    
-    conn = db_instance.get_connection()
+    if (start_date is None) != (end_date is None):
+        raise HTTPException(status_code=400, detail="Pass both start_date and end_date, or neither")
+    if start_date is not None:
+        try:
+            datetime.strptime(start_date, "%Y-%m-%d")
+            datetime.strptime(end_date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+
+    # Sales go through the report cache; stock has its own change detection
+    params = {"start_date": start_date, "end_date": end_date, "StoreID": StoreID, "DepartmentID": DepartmentID}
+
+    async def run(db):
+        sales = await report_cache.get_or_compute(
+            db, "departments", params,
+            lambda: department_sales_report(db, start_date, end_date, StoreID, DepartmentID)
+        )
+        return with_stock_on_hand(sales, await read_stock_on_hand(db))
 
+    if targets:
+        return shaping.ReportResponse(await federated_report(targets, run, federation.merge_departments))
+    return shaping.ReportResponse(await run(db_instance))
+
+@router.get("/stock/status")
+async def stock_status():
+    return stock_snapshot.stats()
+
+@router.get("/dimensions/status")
+async def dimensions_status():
+    return dimension_cache.stats()
+
+async def vat_rates_report(db, start_date=None, end_date=None):
     # Build date filter if provided
     date_filter = ""
     params = ()
     if start_date and end_date:
-        date_filter = " AND t.Time >= ? AND t.Time <= ?"
-        params += (start_date, end_date)
+        date_filter = " AND t.Time >= ? AND t.Time < ?"
+        params += (start_date, period_module.day_after(end_date))
 
     # Only aggregate items with transactions in the period
     query = f"""
         SELECT 
-            t2.Percentage AS vat_rate,
-            d.Name AS department,
+            i.TaxID,
+            i.DepartmentID,
             COUNT(DISTINCT i.ID) AS item_count,
             SUM(te.Quantity * te.Price) AS total_sales,
             SUM(te.SalesTax) AS total_vat
         FROM TransactionEntry te
         JOIN Item i ON te.ItemID = i.ID
         JOIN [Transaction] t ON te.TransactionNumber = t.TransactionNumber
-        LEFT JOIN Tax t2 ON i.TaxID = t2.ID
-        LEFT JOIN Department d ON i.DepartmentID = d.ID
         WHERE i.TaxID IS NOT NULL{date_filter}
-        GROUP BY t2.Percentage, d.Name
-        ORDER BY t2.Percentage, d.Name
+        GROUP BY i.TaxID, i.DepartmentID
     """
     try:
-        print("VAT RATE QUERY:", query)
-        print("PARAMS:", params)
-        df = pd.read_sql(query, conn, params=params)
-        result = df.astype(object).where(pd.notnull(df), None).to_dict(orient="records")
-        return {"vat_rates": result}
+        logger.debug("VAT rate query: %s params=%r", query, params)
+        columns, rows = await db.fetch_rows(query, params)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        import traceback
-        print("ERROR:", str(e))
-        traceback.print_exc()
+        logger.exception("Report query failed")
         raise HTTPException(status_code=500, detail=f"Failed to fetch VAT rates: {str(e)}")
 
-@router.get("/sales-dashboard")
-async def sales_dashboard(
+    # Taxes with the same rate and departments with the same name share a row; item
+    # counts still add up because an item has one tax and one department
+    records = shaping.shape(columns, rows, VAT_RATE_COLUMNS)
+    await read_dimensions(db, "tax", [record["TaxID"] for record in records])
+    dimensions = await read_dimensions(db, "department", [record["DepartmentID"] for record in records])
+    for record in records:
+        record["vat_rate"] = dimensions.tax_rate(record.pop("TaxID"))
+        record["department"] = dimensions.department_name(record.pop("DepartmentID"))
+    rates = federation.sum_records([records], ("vat_rate", "department"), federation.VAT_RATE_MEASURES)
+    rates.sort(key=federation.vat_rate_order)
+    return {"vat_rates": [
+        {name: record[name] for name in ("vat_rate", "department") + federation.VAT_RATE_MEASURES}
+        for record in rates
+    ]}
+
+async def vat_rates_result(db, start_date=None, end_date=None):
+    # item_count counts distinct items, which do not add up across date ranges, so only
+    # a range that is exactly a closed period is served from the store
+    if start_date and end_date:
+        period = closed_periods.exact((db.server, db.database), start_date, end_date)
+        if period is not None:
+            result = read_closed(lambda period_id: closed_periods.load(period_id, "vat-rates"), period["id"])
+            if result is not None:
+                return result
+    return await vat_rates_report(db, start_date, end_date)
+
+@router.get("/vat-rates")
+async def get_vat_rates(
+    start_date: str = Query(None, description="Optional: Format YYYY-MM-DD"),
+    end_date: str = Query(None, description="Optional: Format YYYY-MM-DD"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals")
+):
+    global db_instance
+    if not db_instance and not targets:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+    
+    params = {"start_date": start_date, "end_date": end_date}
+    run = lambda db: report_cache.get_or_compute(
+        db, "vat-rates", params,
+        lambda: vat_rates_result(db, start_date, end_date)
+    )
+    if targets:
+        return shaping.ReportResponse(await federated_report(targets, run, federation.merge_vat_rates))
+    return shaping.ReportResponse(await run(db_instance))
+
+async def closing_db(connection):
+    db = await connections.get(connection)
+    if not db:
+        raise HTTPException(status_code=400, detail=f"No database connection named {connection}")
+    return db
+
+@router.post("/periods/close", status_code=201)
+async def close_period(request: ClosePeriodRequest):
+    # Freezes /vat-return, /vat-summary (all stores and each store) and /vat-rates for the
+    # range. Later requests covering it are answered from the local store.
+    db = await closing_db(request.connection)
+    try:
+        start = datetime.strptime(request.start_date, "%Y-%m-%d").date()
+        end = datetime.strptime(request.end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date cannot be before start_date")
+    # end_date is included whole, so today can only be closed tomorrow
+    if end >= date.today():
+        raise HTTPException(status_code=400, detail="Only a period that has ended can be closed")
+    scope = (db.server, db.database)
+    clash = closed_periods.overlapping(scope, request.start_date, request.end_date)
+    if clash:
+        raise HTTPException(status_code=409, detail=f"Overlaps closed period {clash[0]['start_date']} to {clash[0]['end_date']}")
+
+    start_date, end_date = request.start_date, request.end_date
+    dimensions = await dimension_cache.get(db)
+    results = {("vat-rates", None): await vat_rates_report(db, start_date, end_date)}
+    for store_id in [None] + sorted(dimensions.stores):
+        # Unrounded, so a range spanning it and open days rounds the combined totals once
+        results[("vat-return", store_id)] = await vat_return_report(db, start_date, end_date, store_id, partial=True)
+        results[("vat-summary", store_id)] = await vat_summary_report(db, start_date, end_date, store_id)
+    try:
+        return await run_in_threadpool(closed_periods.close, scope, start_date, end_date, results)
+    except closing.PeriodOverlap as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/periods/closed")
+async def list_closed_periods(connection: str = Query(DEFAULT_CONNECTION)):
+    db = await closing_db(connection)
+    return {"periods": closed_periods.list((db.server, db.database))}
+
+@service_router.get("/periods/closed/{period_id}/verify")
+async def verify_closed_period(period_id: int):
+    # Rehashes every stored result against the hashes recorded at close
+    result = await run_in_threadpool(closed_periods.verify, period_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Closed period not found")
+    return result
+
+async def reconciliation_report(db, start_date, end_date, StoreID=None, tolerance=reconcile.RECONCILE_TOLERANCE):
+    try:
+        return await reconcile.reconcile(db, dimension_cache, start_date, end_date, StoreID, tolerance)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception("Reconciliation failed")
+        raise HTTPException(status_code=500, detail=f"Reconciliation failed: {str(e)}")
+
+@router.get("/reconciliation")
+async def get_reconciliation(
     start_date: str = Query(..., description="Format: YYYY-MM-DD"),
     end_date: str = Query(..., description="Format: YYYY-MM-DD"),
-    DepartmentID: int = Query(None, description="Optional: Filter by specific department")
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    tolerance: float = Query(reconcile.RECONCILE_TOLERANCE, ge=0, description="Differences up to this amount are not flagged")
 ):
+    # Header tax against line tax, and line tax against the item's tax rate. Long periods
+    # are better submitted to POST /jobs as report "reconciliation".
     global db_instance
     if not db_instance:
-        raise HTTPException(status_code=400, detail="No database connection")
-    
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
     try:
         datetime.strptime(start_date, "%Y-%m-%d")
         datetime.strptime(end_date, "%Y-%m-%d")
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format")
-    
-    conn = db_instance.get_connection()
-    
-    # Build filter for optional department
-    dept_filter = ""
-    params = (start_date, end_date)
-    if DepartmentID is not None:
-        dept_filter = " AND i.DepartmentID = ?"
-        params += (DepartmentID,)
+        raise HTTPException(status_code=400, detail="Invalid date format. Please use YYYY-MM-DD")
+
+    db = db_instance
+    params = {"start_date": start_date, "end_date": end_date, "StoreID": StoreID, "tolerance": tolerance}
+    return shaping.ReportResponse(await report_cache.get_or_compute(
+        db, "reconciliation", params,
+        lambda: reconciliation_report(db, start_date, end_date, StoreID, tolerance)
+    ))
+
+async def sales_dashboard_report(db, start_date, end_date, DepartmentID=None, buckets=None, top_departments=None):
+    facts_df = await sales_dashboard_facts(db, start_date, end_date, DepartmentID, buckets)
+    try:
+        return build_sales_dashboard(facts_df, start_date, end_date, top_departments)
+    except Exception as e:
+        logger.exception("Sales dashboard shaping failed")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
-    # Summary Query
-    summary_query = f"""
+async def sales_dashboard_facts(db, start_date, end_date, DepartmentID=None, buckets=None):
+    # One scan at day x department grain, with per-day totals from the same pass. With
+    # buckets the department rows are summed per bucket in the database; day totals stay
+    # daily for trading days and the best day. Transaction counts still add up because a
+    # transaction falls on a single day.
+    bucket, bucket_clause, bucket_params = bucket_join(buckets, "f.SaleDate")
+    sale_date = f"CASE WHEN f.IsDayTotal = 1 THEN f.SaleDate ELSE {bucket} END" if buckets else "f.SaleDate"
+
+    def build_query(hwm):
+        source_query, source_params = rollup.daily_department_source(hwm, start_date, end_date, DepartmentID)
+        query = f"""
+        WITH Facts AS ({source_query}
+        )
         SELECT 
-            COUNT(DISTINCT t.TransactionNumber) as total_transactions,
-            COUNT(DISTINCT CAST(t.Time as DATE)) as trading_days,
-            SUM(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as total_sales_incl,
-            SUM(te.Quantity * te.Price) as total_sales_excl,
-            SUM(ISNULL(te.SalesTax, 0)) as total_tax,
-            AVG(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as avg_transaction_value,
-            SUM(te.Quantity) as total_items_sold
-        FROM [Transaction] t
-        JOIN TransactionEntry te ON t.TransactionNumber = te.TransactionNumber
-        JOIN Item i ON te.ItemID = i.ID
-        WHERE t.Time >= ? AND t.Time <= ?{dept_filter}
+            {sale_date} as SaleDate,
+            f.DepartmentID,
+            f.IsDayTotal,
+            SUM(f.SalesExclusive) as SalesExclusive,
+            SUM(f.SalesTax) as SalesTax,
+            SUM(f.Quantity) as Quantity,
+            SUM(f.LineCount) as LineCount,
+            SUM(f.TransactionCount) as TransactionCount
+        FROM Facts f{bucket_clause}
+        GROUP BY {sale_date}, f.DepartmentID, f.IsDayTotal
     """
+        return query, source_params + bucket_params
+
+    try:
+        facts_df = await rollup.read_report(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception("Report query failed")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    # Day totals have no department and keep a NULL name, as unknown departments do
+    ids = facts_df['DepartmentID'].dropna().unique().tolist()
+    dimensions = await read_dimensions(db, "department", ids)
+    facts_df.insert(
+        facts_df.columns.get_loc('DepartmentID') + 1, 'DepartmentName',
+        facts_df['DepartmentID'].map(dimensions.departments)
+    )
+    return facts_df
+
+def department_ids(ids):
+    # Folded "Other" rows have no DepartmentID
+    return ids.astype('Int64').astype(object).where(ids.notna(), None)
+
+def build_sales_dashboard(facts_df, start_date, end_date, top_departments=None):
+    np = startup.load("numpy")
+    pd = startup.load("pandas")
+    # Replace NaN and Inf values in the measures
+    measures = ['SalesExclusive', 'SalesTax', 'Quantity', 'LineCount', 'TransactionCount']
+    facts_df[measures] = facts_df[measures].astype(float).replace({np.nan: 0, np.inf: 0, -np.inf: 0})
+    facts_df['Sales'] = facts_df['SalesExclusive'] + facts_df['SalesTax']
+
+    day_df = facts_df[facts_df['IsDayTotal'] == 1]
+    dept_df = facts_df[(facts_df['IsDayTotal'] == 0) & facts_df['DepartmentName'].notna()]
+
+    # Process summary from the day totals
+    total_lines = day_df['LineCount'].sum()
+    summary = {
+        'total_transactions': day_df['TransactionCount'].sum(),
+        'trading_days': len(day_df),
+        'total_sales_incl': day_df['Sales'].sum(),
+        'total_sales_excl': day_df['SalesExclusive'].sum(),
+        'total_tax': day_df['SalesTax'].sum(),
+        'avg_transaction_value': day_df['Sales'].sum() / total_lines if total_lines else 0,
+        'total_items_sold': day_df['Quantity'].sum(),
+    }
+
+    # Departments outside the top N by sales over the range become one "Other" row per
+    # date. Its TransactionCount adds up the folded departments' counts, so a transaction
+    # that touched two of them counts twice, as it does across departments anyway.
+    if top_departments is not None and dept_df['DepartmentID'].nunique() > top_departments:
+        kept = dept_df.groupby('DepartmentID')['Sales'].sum().nlargest(top_departments).index
+        folded = ~dept_df['DepartmentID'].isin(kept)
+        dept_df = (
+            dept_df.assign(
+                DepartmentName=dept_df['DepartmentName'].mask(folded, OTHER_DEPARTMENT),
+                DepartmentID=dept_df['DepartmentID'].mask(folded),
+            )
+            .groupby(['SaleDate', 'DepartmentName', 'DepartmentID'], dropna=False, as_index=False)[['Sales', 'TransactionCount', 'LineCount']]
+            .sum()
+        )
+
+    # Daily sales by department
+    daily_by_dept_df = dept_df.sort_values(['SaleDate', 'DepartmentName'])
+    daily_by_dept_df = pd.DataFrame({
+        'SaleDate': daily_by_dept_df['SaleDate'],
+        'DepartmentName': daily_by_dept_df['DepartmentName'],
+        'DepartmentID': department_ids(daily_by_dept_df['DepartmentID']),
+        'DailySales': daily_by_dept_df['Sales'],
+        'TransactionCount': daily_by_dept_df['TransactionCount'].astype(int),
+    })
+
+    # Top performing departments; a transaction falls on a single day, so the
+    # per-day distinct counts add up to the period's distinct count. "Other" goes last,
+    # so the best department is always a real one.
+    dept_summary_df = (
+        dept_df.groupby(['DepartmentName', 'DepartmentID'], dropna=False, as_index=False)[['Sales', 'TransactionCount', 'LineCount']]
+        .sum()
+        .assign(Folded=lambda df: df['DepartmentID'].isna())
+        .sort_values(['Folded', 'Sales'], ascending=[True, False])
+    )
+    dept_summary_df = pd.DataFrame({
+        'DepartmentName': dept_summary_df['DepartmentName'],
+        'DepartmentID': department_ids(dept_summary_df['DepartmentID']),
+        'TotalSales': dept_summary_df['Sales'],
+        'TransactionCount': dept_summary_df['TransactionCount'].astype(int),
+        'AvgTransactionValue': (dept_summary_df['Sales'] / dept_summary_df['LineCount'].where(dept_summary_df['LineCount'] > 0)).fillna(0),
+    })
     
-    # Daily Sales by Department Query
-    daily_by_dept_query = f"""
-        SELECT 
-            CAST(t.Time as DATE) as SaleDate,
-            d.Name as DepartmentName,
-            d.ID as DepartmentID,
-            SUM(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as DailySales,
-            COUNT(DISTINCT t.TransactionNumber) as TransactionCount
-        FROM [Transaction] t
-        JOIN TransactionEntry te ON t.TransactionNumber = te.TransactionNumber
-        JOIN Item i ON te.ItemID = i.ID
-        JOIN Department d ON i.DepartmentID = d.ID
-        WHERE t.Time >= ? AND t.Time <= ?{dept_filter}
-        GROUP BY CAST(t.Time as DATE), d.Name, d.ID
-        ORDER BY CAST(t.Time as DATE), d.Name
-    """
+    # Process best day
+    best_day = {}
+    if not day_df.empty:
+        best_row = day_df.loc[day_df['Sales'].idxmax()]
+        best_day = {
+            "date": str(best_row['SaleDate']),
+            "sales": round(float(best_row['Sales']), 2),
+            "transactions": int(best_row['TransactionCount'])
+        }
     
-    # Top performing departments
-    dept_summary_query = f"""
-        SELECT 
-            d.Name as DepartmentName,
-            d.ID as DepartmentID,
-            SUM(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as TotalSales,
-            COUNT(DISTINCT t.TransactionNumber) as TransactionCount,
-            AVG(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as AvgTransactionValue
-        FROM [Transaction] t
-        JOIN TransactionEntry te ON t.TransactionNumber = te.TransactionNumber
-        JOIN Item i ON te.ItemID = i.ID
-        JOIN Department d ON i.DepartmentID = d.ID
-        WHERE t.Time >= ? AND t.Time <= ?{dept_filter}
-        GROUP BY d.Name, d.ID
-        ORDER BY TotalSales DESC
-    """
+    # Get best department
+    best_dept = {}
+    if not dept_summary_df.empty:
+        best_dept = {
+            "name": dept_summary_df.iloc[0]['DepartmentName'],
+            "sales": round(float(dept_summary_df.iloc[0]['TotalSales']), 2),
+            "transactions": int(dept_summary_df.iloc[0]['TransactionCount'])
+        }
     
-    # Best sales day
-    best_day_query = f"""
-        SELECT TOP 1
-            CAST(t.Time as DATE) as BestDate,
-            SUM(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) as DaySales,
-            COUNT(DISTINCT t.TransactionNumber) as Transactions
-        FROM [Transaction] t
-        JOIN TransactionEntry te ON t.TransactionNumber = te.TransactionNumber
-        JOIN Item i ON te.ItemID = i.ID
-        WHERE t.Time >= ? AND t.Time <= ?{dept_filter}
-        GROUP BY CAST(t.Time as DATE)
-        ORDER BY SUM(te.Quantity * te.Price + ISNULL(te.SalesTax, 0)) DESC
+    return {
+        "period": {
+            "start_date": start_date, 
+            "end_date": end_date
+        },
+        "summary": {
+            "total_transactions": int(summary.get('total_transactions', 0)),
+            "trading_days": int(summary.get('trading_days', 0)),
+            "total_sales_incl": round(float(summary.get('total_sales_incl', 0)), 2),
+            "total_sales_excl": round(float(summary.get('total_sales_excl', 0)), 2),
+            "total_tax": round(float(summary.get('total_tax', 0)), 2),
+            "avg_transaction_value": round(float(summary.get('avg_transaction_value', 0)), 2),
+            "total_items_sold": int(summary.get('total_items_sold', 0)),
+            "avg_daily_sales": round(float(summary.get('total_sales_incl', 0)) / max(int(summary.get('trading_days', 1)), 1), 2)
+        },
+        "best_day": best_day,
+        "best_department": best_dept,
+        "daily_by_department": daily_by_dept_df.to_dict(orient="records"),
+        "department_summary": dept_summary_df.to_dict(orient="records")
+    }
+
+@router.get("/sales-dashboard")
+async def sales_dashboard(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    DepartmentID: int = Query(None, description="Optional: Filter by specific department"),
+    granularity: str = Query("day", description="daily_by_department rows per day, week, month or quarter"),
+    top_departments: int = Query(None, ge=1, description="Optional: keep this many departments by sales and fold the rest into Other"),
+    targets: str = Query(None, description="Optional: comma-separated connection names, or * for all, consolidated into group totals")
+):
+    global db_instance
+    if not db_instance and not targets:
+        raise HTTPException(status_code=400, detail="No database connection")
+    
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+    buckets = parse_buckets(start_date, end_date, granularity)
+    if targets:
+        # Merged at fact level so trading days, best day and averages are group-wide
+        result = await federated_report(
+            targets,
+            lambda db: sales_dashboard_facts(db, start_date, end_date, DepartmentID, buckets),
+            lambda frames: build_sales_dashboard(federation.merge_facts(frames), start_date, end_date, top_departments)
+        )
+        for source in result["sources"].values():
+            if source["status"] == "ok":
+                source["result"] = build_sales_dashboard(source["result"], start_date, end_date, top_departments)
+        return shaping.ReportResponse(dict(result, granularity=granularity))
+    result = await sales_dashboard_report(db_instance, start_date, end_date, DepartmentID, buckets, top_departments)
+    return shaping.ReportResponse(dict(result, granularity=granularity))
+
+async def sales_dashboard_series(db, start_date, end_date, DepartmentID=None, buckets=None, after=None, limit=SERIES_PAGE_SIZE):
+    # One keyset page of daily_by_department in (SaleDate, DepartmentID) order; after is
+    # the (date, DepartmentID) of the previous page's last row
+    bucket, bucket_clause, bucket_params = bucket_join(buckets, "f.SaleDate")
+    page_filter = ""
+    page_params = ()
+    if after is not None:
+        after_date, after_department = after
+        # Days before the cursor's bucket cannot be on this page, so they are not read
+        start_date = max(start_date, after_date)
+        page_filter = " AND (s.SaleDate > CAST(? AS DATE) OR (s.SaleDate = CAST(? AS DATE) AND s.DepartmentID > ?))"
+        page_params = (after_date, after_date, after_department)
+
+    def build_query(hwm):
+        source_query, source_params = rollup.daily_department_source(hwm, start_date, end_date, DepartmentID)
+        query = f"""
+        WITH Facts AS ({source_query}
+        ),
+        Series AS (
+            SELECT
+                {bucket} as SaleDate,
+                f.DepartmentID,
+                ISNULL(SUM(f.SalesExclusive), 0) + ISNULL(SUM(f.SalesTax), 0) as DailySales,
+                SUM(f.TransactionCount) as TransactionCount
+            FROM Facts f{bucket_clause}
+            WHERE f.IsDayTotal = 0
+            GROUP BY {bucket}, f.DepartmentID
+        )
+        SELECT s.SaleDate, s.DepartmentID, s.DailySales, s.TransactionCount
+        FROM Series s
+        WHERE s.DepartmentID IN (SELECT ID FROM Department){page_filter}
+        ORDER BY s.SaleDate, s.DepartmentID
+        OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
     """
+        return query, source_params + bucket_params + page_params + (limit,)
 
     try:
-        # Execute queries
-        summary_df = pd.read_sql(summary_query, conn, params=params)
-        daily_by_dept_df = pd.read_sql(daily_by_dept_query, conn, params=params)
-        dept_summary_df = pd.read_sql(dept_summary_query, conn, params=params)
-        best_day_df = pd.read_sql(best_day_query, conn, params=params)
-        
-        # Replace NaN and Inf values
-        summary_df = summary_df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
-        daily_by_dept_df = daily_by_dept_df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
-        dept_summary_df = dept_summary_df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
-        best_day_df = best_day_df.replace({np.nan: 0, np.inf: 0, -np.inf: 0})
-        
-        # Process summary
-        summary = summary_df.iloc[0].to_dict() if not summary_df.empty else {}
-        
-        # Process best day
-        best_day = {}
-        if not best_day_df.empty:
-            best_day = {
-                "date": str(best_day_df.iloc[0]['BestDate']),
-                "sales": round(float(best_day_df.iloc[0]['DaySales']), 2),
-                "transactions": int(best_day_df.iloc[0]['Transactions'])
-            }
-        
-        # Get best department
-        best_dept = {}
-        if not dept_summary_df.empty:
-            best_dept = {
-                "name": dept_summary_df.iloc[0]['DepartmentName'],
-                "sales": round(float(dept_summary_df.iloc[0]['TotalSales']), 2),
-                "transactions": int(dept_summary_df.iloc[0]['TransactionCount'])
-            }
-        
-        return {
-            "period": {
-                "start_date": start_date, 
-                "end_date": end_date
-            },
-            "summary": {
-                "total_transactions": int(summary.get('total_transactions', 0)),
-                "trading_days": int(summary.get('trading_days', 0)),
-                "total_sales_incl": round(float(summary.get('total_sales_incl', 0)), 2),
-                "total_sales_excl": round(float(summary.get('total_sales_excl', 0)), 2),
-                "total_tax": round(float(summary.get('total_tax', 0)), 2),
-                "avg_transaction_value": round(float(summary.get('avg_transaction_value', 0)), 2),
-                "total_items_sold": int(summary.get('total_items_sold', 0)),
-                "avg_daily_sales": round(float(summary.get('total_sales_incl', 0)) / max(int(summary.get('trading_days', 1)), 1), 2)
-            },
-            "best_day": best_day,
-            "best_department": best_dept,
-            "daily_by_department": daily_by_dept_df.to_dict(orient="records"),
-            "department_summary": dept_summary_df.to_dict(orient="records")
-        }
-        
+        columns, rows = await rollup.read_rows(db, build_query)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        import traceback
-        print("ERROR:", str(e))
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
\ No newline at end of file
+        logger.exception("Report query failed")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    records = shaping.shape(columns, rows, DASHBOARD_SERIES_COLUMNS)
+    dimensions = await read_dimensions(db, "department", [record["DepartmentID"] for record in records])
+    return [
+        dict({"SaleDate": record.pop("SaleDate")}, **with_department_name(record, dimensions, keep_id=True))
+        for record in records
+    ]
+
+@router.get("/sales-dashboard/series")
+async def sales_dashboard_series_page(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    DepartmentID: int = Query(None, description="Optional: Filter by specific department"),
+    granularity: str = Query("day", description="Rows per day, week, month or quarter"),
+    after: str = Query(None, description="next_after of the previous page"),
+    limit: int = Query(SERIES_PAGE_SIZE, ge=1, le=SERIES_MAX_PAGE_SIZE)
+):
+    # daily_by_department of /sales-dashboard one page at a time, oldest first
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection")
+
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+        if after is not None:
+            after_date, _, after_department = after.partition(",")
+            datetime.strptime(after_date, "%Y-%m-%d")
+            after = (after_date, int(after_department))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format, or an after that is not YYYY-MM-DD,DepartmentID")
+
+    db = db_instance
+    buckets = parse_buckets(start_date, end_date, granularity)
+    params = {"start_date": start_date, "end_date": end_date, "DepartmentID": DepartmentID,
+              "granularity": granularity, "after": after, "limit": limit}
+    # One extra row tells whether another page follows
+    rows = await report_cache.get_or_compute(
+        db, "sales-dashboard-series", params,
+        lambda: sales_dashboard_series(db, start_date, end_date, DepartmentID, buckets, after, limit + 1)
+    )
+    page = rows[:limit]
+    next_after = f"{page[-1]['SaleDate']},{page[-1]['DepartmentID']}" if len(rows) > limit else None
+    return shaping.ReportResponse({"granularity": granularity, "rows": page, "next_after": next_after})
+
+async def drilldown_filters(db, DepartmentID=None, department=None, vat_rate=None):
+    # A /vat-return row names its department and a /vat-rates row its rate; both resolve to
+    # IDs here. An empty tuple means nothing can match.
+    department_ids = (DepartmentID,) if DepartmentID is not None else None
+    tax_ids = None
+    if department is not None or vat_rate is not None:
+        dimensions = await read_dimensions(db, "department", [])
+        if department is not None:
+            named = tuple(department_id for department_id, name in dimensions.departments.items() if name == department)
+            department_ids = named if department_ids is None else tuple(i for i in department_ids if i in named)
+        if vat_rate is not None:
+            tax_ids = tuple(tax_id for tax_id, (_, rate) in dimensions.taxes.items()
+                            if rate is not None and abs(rate - vat_rate) < 1e-9)
+    return department_ids, tax_ids
+
+async def drilldown_page(db, read, start_date, end_date, sort, order, after, limit, filters):
+    if filters["department_ids"] == () or filters["tax_ids"] == ():
+        return []
+    try:
+        return await db.run(read, start_date, end_date, sort, order, after, limit, filters)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.exception("Drilldown query failed")
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+def drilldown_arguments(start_date, end_date, sorts, sort, order, after):
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Please use YYYY-MM-DD")
+    try:
+        drilldown.parse_order(sorts, sort, order)
+        return drilldown.parse_after(after, sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def drilldown_items(db, start_date, end_date, sort, order, after, limit, filters):
+    records = await drilldown_page(db, drilldown.read_items, start_date, end_date, sort, order, after, limit, filters)
+    await read_dimensions(db, "tax", [record["TaxID"] for record in records])
+    dimensions = await read_dimensions(db, "department", [record["DepartmentID"] for record in records])
+    for record in records:
+        record["SalesInclusive"] = round(record["SalesExclusive"] + record["SalesTax"], 2)
+        record["DepartmentName"] = dimensions.department_name(record["DepartmentID"])
+        record["vat_rate"] = dimensions.tax_rate(record.pop("TaxID"))
+    return records
+
+async def drilldown_lines(db, start_date, end_date, sort, order, after, limit, filters):
+    records = await drilldown_page(db, drilldown.read_lines, start_date, end_date, sort, order, after, limit, filters)
+    dimensions = await read_dimensions(db, "store", [record["StoreID"] for record in records])
+    for record in records:
+        record["SalesInclusive"] = round(record["SalesExclusive"] + record["SalesTax"], 2)
+        record["StoreName"] = dimensions.stores.get(record["StoreID"])
+    return records
+
+@router.get("/drilldown/items")
+async def drilldown_items_page(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    DepartmentID: int = Query(None, description="Optional: Filter by specific department"),
+    department: str = Query(None, description="Optional: a DepartmentName from /vat-return or department from /vat-rates"),
+    vat_rate: float = Query(None, description="Optional: a vat_rate from /vat-rates"),
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    sort: str = Query("sales", description="sales, tax, quantity or code"),
+    order: str = Query(None, description="asc or desc; largest first by default, codes A to Z"),
+    after: str = Query(None, description="next_after of the previous page"),
+    limit: int = Query(drilldown.DRILLDOWN_PAGE_SIZE, ge=1, le=drilldown.DRILLDOWN_MAX_PAGE_SIZE)
+):
+    # Per-item sales, tax and quantity behind a department row, one keyset page at a time
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    cursor = drilldown_arguments(start_date, end_date, drilldown.ITEM_SORTS, sort, order, after)
+    db = db_instance
+    department_ids, tax_ids = await drilldown_filters(db, DepartmentID, department, vat_rate)
+    filters = {"StoreID": StoreID, "department_ids": department_ids, "tax_ids": tax_ids}
+    params = dict(filters, start_date=start_date, end_date=end_date, sort=sort, order=order, after=after, limit=limit)
+    # One extra row tells whether another page follows
+    rows = await report_cache.get_or_compute(
+        db, "drilldown-items", params,
+        lambda: drilldown_items(db, start_date, end_date, sort, order, cursor, limit + 1, filters)
+    )
+    page, next_after = drilldown.next_after([dict(row) for row in rows], limit, "ItemID")
+    return shaping.ReportResponse({"sort": sort, "rows": page, "next_after": next_after})
+
+@router.get("/drilldown/lines")
+async def drilldown_lines_page(
+    start_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    end_date: str = Query(..., description="Format: YYYY-MM-DD"),
+    ItemID: int = Query(None, description="Optional: an ItemID from /drilldown/items"),
+    DepartmentID: int = Query(None, description="Optional: Filter by specific department"),
+    department: str = Query(None, description="Optional: a DepartmentName from /vat-return or department from /vat-rates"),
+    vat_rate: float = Query(None, description="Optional: a vat_rate from /vat-rates"),
+    StoreID: int = Query(None, description="Optional: Filter by specific store"),
+    sort: str = Query("transaction", description="transaction (newest first by default) or amount"),
+    order: str = Query(None, description="asc or desc; descending by default"),
+    after: str = Query(None, description="next_after of the previous page"),
+    limit: int = Query(drilldown.DRILLDOWN_PAGE_SIZE, ge=1, le=drilldown.DRILLDOWN_MAX_PAGE_SIZE)
+):
+    # The transaction lines behind an item or department row, one keyset page at a time
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    cursor = drilldown_arguments(start_date, end_date, drilldown.LINE_SORTS, sort, order, after)
+    db = db_instance
+    department_ids, tax_ids = await drilldown_filters(db, DepartmentID, department, vat_rate)
+    filters = {"StoreID": StoreID, "department_ids": department_ids, "tax_ids": tax_ids, "ItemID": ItemID}
+    params = dict(filters, start_date=start_date, end_date=end_date, sort=sort, order=order, after=after, limit=limit)
+    rows = await report_cache.get_or_compute(
+        db, "drilldown-lines", params,
+        lambda: drilldown_lines(db, start_date, end_date, sort, order, cursor, limit + 1, filters)
+    )
+    page, next_after = drilldown.next_after([dict(row) for row in rows], limit, "LineID")
+    return shaping.ReportResponse({"sort": sort, "rows": page, "next_after": next_after})
+
+@router.get("/live/sales")
+async def live_sales(
+    request: Request,
+    connection: str = Query(None, description="Optional: a registered connection name; the default one otherwise")
+):
+    # Server-Sent Events with each batch of new transactions' contribution to the day,
+    # store and department totals. Subscribe first, then fetch the reports the deltas apply to.
+    db = await connections.get(connection) if connection else db_instance
+    if not db:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    feed = live_hub.feed(db, dimension_cache)
+    return StreamingResponse(
+        feed.stream(request.is_disconnected, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        # Proxies must neither cache nor buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@service_router.get("/live/status")
+async def live_status():
+    return live_hub.stats()
+
+def job_date(params, name, required=True):
+    value = params.get(name)
+    if value is None and not required:
+        return None
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be a date in YYYY-MM-DD format")
+    return value
+
+def job_int(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+
+def build_job(db, report, params):
+    # Validates like the report endpoints do and returns (params, compute)
+    store_id = job_int(params, "StoreID")
+    department_id = job_int(params, "DepartmentID")
+    granularity = params.get("granularity") or "day"
+    if report == "sales-dashboard":
+        start_date, end_date = job_date(params, "start_date"), job_date(params, "end_date")
+        buckets = parse_buckets(start_date, end_date, granularity)
+        top_departments = job_int(params, "top_departments")
+        if top_departments is not None and top_departments < 1:
+            raise HTTPException(status_code=400, detail="top_departments must be at least 1")
+
+        async def compute():
+            result = await sales_dashboard_report(db, start_date, end_date, department_id, buckets, top_departments)
+            return dict(result, granularity=granularity)
+        return ({"start_date": start_date, "end_date": end_date, "DepartmentID": department_id,
+                 "granularity": granularity, "top_departments": top_departments}, compute)
+    if report == "departments":
+        start_date, end_date = job_date(params, "start_date", False), job_date(params, "end_date", False)
+        if (start_date is None) != (end_date is None):
+            raise HTTPException(status_code=400, detail="Pass both start_date and end_date, or neither")
+        return ({"start_date": start_date, "end_date": end_date, "StoreID": store_id, "DepartmentID": department_id},
+                lambda: departments_report(db, start_date, end_date, store_id, department_id))
+    if report == "vat-return":
+        start_date, end_date = job_date(params, "start_date"), job_date(params, "end_date")
+        partitioning = parse_partitioning(start_date, end_date, job_int(params, "partition_days"), job_int(params, "parallelism"))
+        return ({"start_date": start_date, "end_date": end_date, "StoreID": store_id, "DepartmentID": department_id,
+                 "partitioning": partitioning},
+                lambda: vat_return_result(db, start_date, end_date, store_id, department_id, partitioning))
+    if report == "vat-return/periods":
+        periods = params.get("periods")
+        granularity = params.get("granularity")
+        fiscal_year_start_month = job_int(params, "fiscal_year_start_month") or 1
+        period_list = parse_period_list(periods, params.get("start_date"), params.get("end_date"), granularity, fiscal_year_start_month)
+        normalized = {"periods": [f"{start.isoformat()}:{end.isoformat()}" for start, end in period_list],
+                      "StoreID": store_id, "DepartmentID": department_id}
+
+        async def compute():
+            result = await vat_return_periods_report(db, period_list, store_id, department_id)
+            return {"granularity": None if periods else granularity, "periods": result}
+        return normalized, compute
+    if report == "vat-summary":
+        start_date, end_date = job_date(params, "start_date"), job_date(params, "end_date")
+        buckets = parse_buckets(start_date, end_date, granularity)
+        partitioning = parse_partitioning(start_date, end_date, job_int(params, "partition_days"), job_int(params, "parallelism"))
+
+        async def compute():
+            result = await vat_summary_result(db, start_date, end_date, store_id, buckets, granularity, partitioning)
+            return dict(result, granularity=granularity)
+        return ({"start_date": start_date, "end_date": end_date, "StoreID": store_id, "granularity": granularity,
+                 "partitioning": partitioning}, compute)
+    if report == "vat-rates":
+        start_date, end_date = job_date(params, "start_date", False), job_date(params, "end_date", False)
+        return ({"start_date": start_date, "end_date": end_date},
+                lambda: vat_rates_result(db, start_date, end_date))
+    if report == "reconciliation":
+        start_date, end_date = job_date(params, "start_date"), job_date(params, "end_date")
+        try:
+            tolerance = float(params.get("tolerance", reconcile.RECONCILE_TOLERANCE))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="tolerance must be a number")
+        if tolerance < 0:
+            raise HTTPException(status_code=400, detail="tolerance cannot be negative")
+        return ({"start_date": start_date, "end_date": end_date, "StoreID": store_id, "tolerance": tolerance},
+                lambda: reconciliation_report(db, start_date, end_date, store_id, tolerance))
+    raise HTTPException(status_code=400, detail=f"Unknown report. Use one of: {', '.join(JOB_REPORTS)}")
+
+JOB_REPORTS = ("sales-dashboard", "departments", "vat-return", "vat-return/periods", "vat-summary", "vat-rates", "reconciliation")
+
+@router.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    global db_instance
+    if not db_instance:
+        raise HTTPException(status_code=400, detail="No database connection. Please connect to the database")
+
+    db = db_instance
+    params, compute = build_job(db, request.report, request.params)
+    try:
+        job, created = job_queue.submit(request.report, params, (db.server, db.database), compute)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return dict(job_queue.describe(job), created=created)
+
+@service_router.get("/jobs")
+async def list_jobs():
+    return {
+        "stats": job_queue.stats(),
+        "jobs": [job_queue.describe(job) for job in job_queue.list()],
+    }
+
+@service_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.find(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job_queue.describe(job)
+
+@service_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_queue.find(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}" + (f": {job.error}" if job.error else ""))
+
+    # Stored already encoded, so it goes out without another serialization pass
+    try:
+        content = await run_in_threadpool(read_file, job_queue.result_path(job_id))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Job result is no longer available")
+    return Response(content=content, media_type="application/json")
+
+@service_router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = job_queue.find(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Only queued jobs can be cancelled; this one is {job.status}")
+    return job_queue.describe(job_queue.find(job_id))
+
+def read_file(path):
+    with open(path, "rb") as handle:
+        return handle.read()
@@ -1,8 +1,42 @@
+import startup
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from logic import router 
+import compression
+import logic
+import metrics
+import shaping
+import rollup
+import snapshot
+from logic import router, service_router
 
-app = FastAPI(title="VAT RETURN API")
+@asynccontextmanager
+async def lifespan(app):
+    # Keep the daily rollup topped up in the background when an interval is configured
+    refresh_task = None
+    if rollup.ROLLUP_REFRESH_SECONDS > 0:
+        refresh_task = asyncio.create_task(rollup.refresh_loop(lambda: logic.db_instance))
+    # Same for local snapshots, which just fail quietly while the link is down
+    sync_task = None
+    if snapshot.SNAPSHOT_SYNC_SECONDS > 0:
+        sync_task = asyncio.create_task(snapshot.sync_loop(lambda: logic.db_instance))
+    # Workers for POST /jobs; results from before a restart stay readable until they expire
+    logic.job_queue.start()
+    # Closed VAT periods, served from the local store
+    logic.closed_periods.start()
+    startup.timer.mark("app_started")
+    yield
+    logic.live_hub.stop()
+    await logic.job_queue.stop()
+    if refresh_task:
+        refresh_task.cancel()
+    if sync_task:
+        sync_task.cancel()
+
+metrics.configure_logging()
+
+app = FastAPI(title="VAT RETURN API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -12,4 +46,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(service_router)
 app.include_router(router)
+app.add_middleware(shaping.NegotiationMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
+# Added last so it wraps CORS too and times the whole request
+app.add_middleware(metrics.MetricsMiddleware, routes=app.routes)
+
+startup.timer.mark("app_imported")
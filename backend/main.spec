@@ -1,12 +1,20 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
+# onedir (the default) starts straight from dist/main; BACKEND_BUILD=onefile gives the single
+# main.exe, which unpacks itself to a temporary folder on every launch
+ONEFILE = os.getenv("BACKEND_BUILD", "onedir") == "onefile"
 
 a = Analysis(
-    ['main.py'],
+    ['desktop.py'],
     pathex=[],
     binaries=[],
-    datas=[('logic.py', '.'), ('database.py', '.')],
-    hiddenimports=[],
+    datas=[('logic.py', '.'), ('database.py', '.'), ('rollup.py', '.'), ('cache.py', '.'), ('export.py', '.'), ('shaping.py', '.'), ('periods.py', '.'), ('snapshot.py', '.'), ('indexes.py', '.'), ('metrics.py', '.'), ('stock.py', '.'), ('jobs.py', '.'), ('federation.py', '.'), ('reconcile.py', '.'), ('compression.py', '.'), ('dimensions.py', '.'), ('livefeed.py', '.'), ('closing.py', '.'), ('profiles.py', '.'), ('drilldown.py', '.'), ('startup.py', '.'), ('partitions.py', '.'), ('desktop.py', '.')],
+    # main is imported by name once the server is up, uvicorn picks its loop and protocols at
+    # runtime and the heavy libraries are loaded on first use (startup.load)
+    hiddenimports=['main', 'uvicorn.logging', 'uvicorn.loops.auto', 'uvicorn.protocols.http.auto',
+                   'uvicorn.protocols.websockets.auto', 'uvicorn.lifespan.on',
+                   'pandas', 'pyodbc', 'pyarrow', 'pyarrow.parquet', 'duckdb'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -19,14 +27,15 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
+    *([a.binaries, a.datas] if ONEFILE else []),
     [],
+    exclude_binaries=not ONEFILE,
     name='main',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # UPX-packed libraries have to be decompressed at every load
+    upx=False,
     upx_exclude=[],
     runtime_tmpdir=None,
     console=True,
@@ -36,3 +45,14 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+if not ONEFILE:
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='main',
+    )
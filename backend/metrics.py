@@ -0,0 +1,226 @@
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+import startup
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Queries slower than this are logged with their SQL and params; 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+# Optional file for the slow-query log, on top of the normal log output
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("slow_queries")
+
+# Route template of the request being served; Database.run copies it onto the worker thread
+endpoint = contextvars.ContextVar("endpoint", default="background")
+# Overrides the endpoint as the query label where one request runs several report queries
+query_label = contextvars.ContextVar("query_label", default=None)
+
+
+def configure_logging():
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if SLOW_QUERY_LOG:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_logger.addHandler(handler)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = format_labels(self.labels, key, [("le", format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("vat_request_duration_seconds", "Time to serve a request, body included", ("endpoint", "method", "status"))
+REQUEST_ERRORS = Counter("vat_request_errors_total", "Requests answered with a 4xx or 5xx status", ("endpoint", "status"))
+POOL_WAIT_SECONDS = Histogram("vat_pool_wait_seconds", "Time spent waiting for a pooled connection", ("endpoint",))
+DB_CALL_SECONDS = Histogram("vat_db_call_duration_seconds", "Time a request holds a pooled connection", ("endpoint",))
+QUERY_SECONDS = Histogram("vat_query_duration_seconds", "Query time split into execute and fetch", ("query", "phase"))
+QUERY_ROWS = Histogram("vat_query_rows", "Rows returned per query", ("query",), ROW_BUCKETS)
+QUERY_ERRORS = Counter("vat_query_errors_total", "Queries that raised", ("query",))
+SLOW_QUERIES = Counter("vat_slow_queries_total", "Queries slower than SLOW_QUERY_MS", ("query",))
+SHAPE_SECONDS = Histogram("vat_shape_duration_seconds", "Time converting rows into response records", ("endpoint",))
+SERIALIZE_SECONDS = Histogram("vat_serialize_duration_seconds", "Time encoding JSON responses", ("endpoint",))
+PARTITION_SECONDS = Histogram("vat_partition_duration_seconds", "Time to compute one date-range partition of a report", ("report",))
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUEST_ERRORS, POOL_WAIT_SECONDS, DB_CALL_SECONDS, QUERY_SECONDS,
+    QUERY_ROWS, QUERY_ERRORS, SLOW_QUERIES, SHAPE_SECONDS, SERIALIZE_SECONDS, PARTITION_SECONDS,
+]
+
+
+def render(gauges=None):
+    # gauges: {name: (help, value)} read at scrape time, e.g. cache occupancy
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, (help, value) in (gauges or {}).items():
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {format_value(value)}"])
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def label(name):
+    token = query_label.set(name)
+    try:
+        yield
+    finally:
+        query_label.reset(token)
+
+
+def current_query():
+    return query_label.get() or endpoint.get()
+
+
+def record_query(query, params, execute_seconds, fetch_seconds, rows):
+    name = current_query()
+    QUERY_SECONDS.observe(execute_seconds, query=name, phase="execute")
+    QUERY_SECONDS.observe(fetch_seconds, query=name, phase="fetch")
+    QUERY_ROWS.observe(rows, query=name)
+    elapsed_ms = (execute_seconds + fetch_seconds) * 1000
+    if SLOW_QUERY_MS and elapsed_ms >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc(query=name)
+        slow_query_logger.warning(
+            "%s took %.0f ms (execute %.0f ms, fetch %.0f ms, %d rows) params=%r: %s",
+            name, elapsed_ms, execute_seconds * 1000, fetch_seconds * 1000, rows, tuple(params or ()),
+            " ".join(query.split()),
+        )
+
+
+def record_query_error(query):
+    QUERY_ERRORS.inc(query=current_query())
+    logger.debug("Query failed under %s: %s", current_query(), " ".join(query.split()))
+
+
+def route_label(routes, scope):
+    # Label by route template so /metrics stays small whatever the query strings are
+    for route in routes:
+        # Newer FastAPI keeps included routers as one entry wrapping the original
+        nested = getattr(getattr(route, "original_router", None), "routes", None)
+        if nested is not None:
+            name = route_label(nested, scope)
+            if name:
+                return name
+            continue
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware so streamed exports are timed to the last chunk
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name = route_label(self.routes, scope) or "unmatched"
+        token = endpoint.set(name)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=name, method=scope["method"], status=status)
+            if status >= 400:
+                REQUEST_ERRORS.inc(endpoint=name, status=status)
+            endpoint.reset(token)
+            startup.timer.responded(scope["path"])
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+from datetime import date, timedelta
+
+import metrics
+from database import POOL_SIZE
+
+# Long report periods can run as date-range partitions at the same time, each on its own
+# pooled connection, with the partial results merged like federated ones. Only requests
+# passing partition_days are split.
+# Partitions of one report running at once; one pooled connection is left for other requests
+PARTITION_PARALLELISM = int(os.getenv("PARTITION_PARALLELISM", str(max(1, POOL_SIZE - 1))))
+MAX_PARTITIONS = 400
+
+
+def split_range(start_date, end_date, days):
+    # Consecutive ranges of `days` days, both ends included like report ranges, so no day
+    # is in two of them; the last one may be shorter
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    step = timedelta(days=days)
+    ranges = []
+    while start + step <= end:
+        ranges.append((start.isoformat(), (start + step - timedelta(days=1)).isoformat()))
+        start += step
+    if start <= end:
+        ranges.append((start.isoformat(), end.isoformat()))
+    return ranges
+
+
+class RangeSplit:
+    # One report run split by date range. compute(start, end) runs once per partition, at
+    # most `parallelism` at a time, and merge(results) combines their results; sums and
+    # counts of transactions add up because the partitions share no day. compute returns
+    # unrounded partials, so merge is also what rounds a single partition's result.
+    def __init__(self, report, days, parallelism=PARTITION_PARALLELISM):
+        self.report = report
+        self.days = days
+        # More would only queue for a pooled connection
+        self.parallelism = max(1, min(parallelism, POOL_SIZE))
+        self.timings = []
+
+    async def run(self, start_date, end_date, compute, merge):
+        semaphore = asyncio.Semaphore(self.parallelism)
+
+        async def one(start, end):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await compute(start, end)
+                elapsed = time.perf_counter() - started
+            metrics.PARTITION_SECONDS.observe(elapsed, report=self.report)
+            self.timings.append({"start_date": start, "end_date": end, "elapsed_ms": round(elapsed * 1000, 1)})
+            return result
+
+        tasks = [asyncio.ensure_future(one(start, end)) for start, end in split_range(start_date, end_date, self.days)]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed partition fails the report; the rest stop waiting for connections
+            for task in tasks:
+                task.cancel()
+            raise
+        return merge(results)
+
+    def describe(self):
+        return {
+            "partition_days": self.days,
+            "parallelism": self.parallelism,
+            "partitions": sorted(self.timings, key=lambda timing: timing["start_date"]),
+        }
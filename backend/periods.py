@@ -0,0 +1,74 @@
+from datetime import date, datetime, timedelta
+
+GRANULARITIES = ("month", "quarter", "year")
+# SQL Server caps parameters at 2100; three per period keeps well clear of it
+MAX_PERIODS = 200
+# Chart series buckets; "day" needs no bucket table
+SERIES_GRANULARITIES = ("day", "week", "month", "quarter")
+# Two parameters per bucket: weekly buckets over fifteen years still fit
+MAX_BUCKETS = 800
+
+
+def parse_date(value):
+    return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+
+
+def day_after(value):
+    # Reports take end_date as a whole day, so their queries stop before the next midnight
+    day = value if isinstance(value, date) else parse_date(value)
+    return (day + timedelta(days=1)).isoformat()
+
+
+def parse_period(value):
+    # "YYYY-MM-DD:YYYY-MM-DD", both days included
+    start, _, end = value.partition(":")
+    start_date, end_date = parse_date(start), parse_date(end)
+    if end_date < start_date:
+        raise ValueError(f"Period {value} ends before it starts")
+    return start_date, end_date
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def period_start(day, granularity, fiscal_year_start_month=1):
+    if granularity == "month":
+        return date(day.year, day.month, 1)
+    if granularity == "quarter":
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    # Fiscal years start on the first of fiscal_year_start_month
+    year = day.year if day.month >= fiscal_year_start_month else day.year - 1
+    return date(year, fiscal_year_start_month, 1)
+
+
+def generate_periods(start_date, end_date, granularity, fiscal_year_start_month=1):
+    # Calendar-aligned periods covering [start_date, end_date], clipped to the range
+    step = {"month": 1, "quarter": 3, "year": 12}[granularity]
+    periods = []
+    current = period_start(start_date, granularity, fiscal_year_start_month)
+    while current <= end_date:
+        following = add_months(current, step)
+        periods.append((max(current, start_date), min(following - timedelta(days=1), end_date)))
+        current = following
+    return periods
+
+
+def bucket_start(day, granularity):
+    # Weeks start on Monday
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return period_start(day, granularity)
+
+
+def generate_buckets(start_date, end_date, granularity):
+    # [start, stop) pairs on calendar boundaries, not clipped to the range, so a
+    # bucket has the same label whatever range it was requested with
+    buckets = []
+    current = bucket_start(start_date, granularity)
+    while current <= end_date:
+        following = current + timedelta(days=7) if granularity == "week" else add_months(current, {"month": 1, "quarter": 3}[granularity])
+        buckets.append((current, following))
+        current = following
+    return buckets
@@ -1,119 +1,304 @@
-import random
-from datetime import datetime, timedelta
+# Bulk demo / load-test data for the VAT reports.
+#
+#   python populate_dema_data.py --lines 100m --days 1095 --stores 20 --workers 8 --seed 7
+#
+# Taxes, stores, departments and items are inserted once. Sales are then generated
+# per store in parallel worker processes: each worker builds batches of transactions
+# and lines with numpy and loads them with fast_executemany, committing once per batch.
+# TransactionNumber and TransactionEntry.ID ranges are reserved per store before any
+# worker starts and inserted under IDENTITY_INSERT, so workers never contend on the
+# identity columns and the same seed always produces the same rows.
+import argparse
+import multiprocessing
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
 import pyodbc
 
 # --- Database connection ---
-server = "mssql2022"   # Change if needed
-database = "CHOMA"
-username = "SA"
-password = "Black99raiser%*"
-
-conn = pyodbc.connect(
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={server};DATABASE={database};UID={username};PWD={password}"
-)
-cursor = conn.cursor()
-
-# --- Insert VAT rates ---
-vat_rates = [0, 16]  # Non-taxable and standard VAT
-tax_ids = {}
-
-for rate in vat_rates:
-    cursor.execute("INSERT INTO Tax (Percentage) OUTPUT INSERTED.ID VALUES (?)", (rate,))
-    result = cursor.fetchone()
-    if result is not None:
-        tax_ids[rate] = result[0]
-    else:
-        raise Exception(f"Failed to insert VAT rate {rate}")
-print("Inserted VAT rates:", tax_ids)
-
-# --- Insert Stores (company style) ---
-store_names = [
-    ("Choma SuperMart", "CHM001"),
-    ("Lusaka Grocery Hub", "LSK002"),
-    ("Kitwe Wholesale Center", "KTW003"),
+server = os.getenv("DEMO_DB_SERVER", "mssql2022")   # Change if needed
+database = os.getenv("DEMO_DB_NAME", "CHOMA")
+username = os.getenv("DEMO_DB_USER", "SA")
+password = os.getenv("DEMO_DB_PASSWORD", "Black99raiser%*")
+
+MAX_LINES_PER_TRANSACTION = 5
+# Relative trade per weekday, Monday first
+WEEKDAY_WEIGHTS = np.array([0.9, 0.85, 0.9, 1.0, 1.25, 1.4, 1.0])
+# Trading day runs 07:00-21:00
+OPENING_SECONDS = 7 * 3600
+TRADING_SECONDS = 14 * 3600
+# SQL Server allows 2100 parameters per statement
+PARAMETER_LIMIT = 2000
+
+DEPARTMENT_NAMES = [
+    "UnAssigned", "AIRTIME", "BAKERY BREADS", "BAKERY CONFECTIONERY", "BUTCHERY", "CIGARETTES",
+    "DELI", "DRINKS", "EMPTIES", "EXPENSE", "FRUIT & VEG", "GROCERIES", "HABA", "KVI",
+    "LIQUOR", "NON-FOODS", "PERISHABLES", "VOUCHERS",
 ]
-store_ids = []
+STORE_NAMES = ["Choma SuperMart", "Lusaka Grocery Hub", "Kitwe Wholesale Center"]
 
-for name, code in store_names:
-    cursor.execute(
-        "INSERT INTO Store (Name, StoreCode) OUTPUT INSERTED.ID VALUES (?, ?)", 
-        (name, code)
+
+def connect():
+    return pyodbc.connect(
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={server};DATABASE={database};UID={username};PWD={password}"
     )
-    result = cursor.fetchone()
-    if result is not None:
-        store_ids.append(result[0])
-    else:
-        raise Exception(f"Failed to insert store {name}")
-print(f"Inserted {len(store_ids)} stores.")
-
-# --- Insert Items (realistic) ---
-item_data = [
-    ("Maize Meal 25kg", 120.0, 16),
-    ("Cooking Oil 2L", 65.0, 16),
-    ("Sugar 1kg", 25.0, 16),
-    ("Fresh Milk 500ml", 10.0, 16),
-    ("Bread Loaf", 15.0, 0),
-    ("Soap Bar", 12.0, 16),
-    ("Salt 1kg", 8.0, 0),
-]
-items = []
 
-for name, price, vat in item_data:
-    cursor.execute(
-        "INSERT INTO Item (Description, Price, TaxID) OUTPUT INSERTED.ID VALUES (?, ?, ?)",
-        (name, price, tax_ids[vat]),
+
+def parse_count(value):
+    # 250k, 1.5m, 100m or a plain number
+    value = value.strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(value[-1:], 1)
+    if factor != 1:
+        value = value[:-1]
+    return int(float(value) * factor)
+
+
+def insert_returning_ids(cursor, table, columns, rows, key):
+    # Multi-row INSERT ... OUTPUT, keyed because OUTPUT order isn't guaranteed
+    ids = {}
+    per_statement = max(PARAMETER_LIMIT // len(columns), 1)
+    placeholders = "(" + ", ".join("?" for _ in columns) + ")"
+    for offset in range(0, len(rows), per_statement):
+        chunk = rows[offset:offset + per_statement]
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) OUTPUT INSERTED.ID, INSERTED.{key} "
+            f"VALUES {', '.join(placeholders for _ in chunk)}",
+            [value for row in chunk for value in row],
+        )
+        ids.update({row_key: row_id for row_id, row_key in cursor.fetchall()})
+    return ids
+
+
+def insert_reference_data(cursor, args, rng):
+    tag = f"{args.seed}"
+
+    tax_rows = [(f"VAT {rate:g}% #{tag}", rate) for rate in args.tax_rates]
+    tax_ids = insert_returning_ids(cursor, "Tax", ["Description", "Percentage"], tax_rows, "Description")
+    print("Inserted VAT rates:", {rate: tax_ids[name] for name, rate in tax_rows})
+
+    store_rows = [
+        (STORE_NAMES[index] if index < len(STORE_NAMES) else f"Demo Store {index + 1}", f"S{index + 1:03d}-{tag}")
+        for index in range(args.stores)
+    ]
+    store_ids = insert_returning_ids(cursor, "Store", ["Name", "StoreCode"], store_rows, "StoreCode")
+    store_ids = [store_ids[code] for _, code in store_rows]
+    print(f"Inserted {len(store_ids)} stores.")
+
+    department_rows = [
+        (DEPARTMENT_NAMES[index] if index < len(DEPARTMENT_NAMES) else f"DEPARTMENT {index + 1}", f"D{index + 1:03d}-{tag}", 1)
+        for index in range(args.departments)
+    ]
+    department_ids = insert_returning_ids(cursor, "Department", ["Name", "Code", "HQID"], department_rows, "Code")
+    department_ids = np.array([department_ids[code] for _, code, _ in department_rows])
+    print(f"Inserted {len(department_ids)} departments.")
+
+    # Log-normal shelf prices around 25, cost at 55-85% of price
+    prices = np.round(np.clip(rng.lognormal(np.log(25), 0.9, args.items), 1, 2000), 2)
+    costs = np.round(prices * rng.uniform(0.55, 0.85, args.items), 2)
+    rates = rng.choice(np.array(args.tax_rates, dtype=float), args.items)
+    item_departments = rng.integers(0, len(department_ids), args.items)
+    item_rows = [
+        (
+            f"I{index + 1:05d}-{tag}",
+            f"{department_rows[item_departments[index]][0].title()} Item {index + 1}"[:30],
+            int(department_ids[item_departments[index]]),
+            float(prices[index]),
+            float(costs[index]),
+            tax_ids[f"VAT {rates[index]:g}% #{tag}"],
+            bool(rates[index] > 0),
+        )
+        for index in range(args.items)
+    ]
+    item_ids = insert_returning_ids(
+        cursor, "Item", ["ItemLookupCode", "Description", "DepartmentID", "Price", "Cost", "TaxID", "Taxable"],
+        item_rows, "ItemLookupCode",
     )
-    result = cursor.fetchone()
-    if result is not None:
-        items.append((result[0], price, vat))
-    else:
-        raise Exception(f"Failed to insert item {name}")
-print(f"Inserted {len(items)} items.")
-
-# --- Generate Transactions for 3 months ---
-start_date = datetime.now() - timedelta(days=90)
-transaction_number = 1
-
-for day in range(90):
-    current_date = start_date + timedelta(days=day)
-    for store_id in store_ids:
-        for _ in range(random.randint(10, 20)):  # 10–20 transactions per store per day
-            batch_number = random.randint(1000, 9999)
-            cursor.execute(
-                "INSERT INTO [Transaction] (Time, BatchNumber, StoreID, Total, SalesTax) "
-                "OUTPUT INSERTED.TransactionNumber VALUES (?, ?, ?, ?, ?)",
-                (current_date, batch_number, store_id, 0, 0),
-            )
-            txn_result = cursor.fetchone()
-            if txn_result is None:
-                raise Exception(f"Failed to insert transaction {transaction_number}")
-
-            total, tax = 0, 0
-            for _ in range(random.randint(1, 5)):  # 1–5 items per transaction
-                item_id, price, vat = random.choice(items)
-                qty = random.randint(1, 3)
-                sales_tax = round((price * qty * vat) / 100, 2)
-                line_total = round(price * qty + sales_tax, 2)
-
-                cursor.execute(
-                    "INSERT INTO TransactionEntry (TransactionNumber, ItemID, Quantity, Price, SalesTax, StoreID) "
-                    "VALUES (?, ?, ?, ?, ?, ?)",
-                    (transaction_number, item_id, qty, price, sales_tax, store_id),
-                )
-
-                total += line_total
-                tax += sales_tax
-
-            # Update transaction totals
-            cursor.execute(
-                "UPDATE [Transaction] SET Total=?, SalesTax=? WHERE TransactionNumber=?",
-                (total, tax, transaction_number),
-            )
-            conn.commit()
-            transaction_number += 1
-
-print("✅ Demo data population complete!")
-
-cursor.close()
-conn.close()
\ No newline at end of file
+    print(f"Inserted {len(item_ids)} items.")
+
+    # A few items sell far more than the rest
+    popularity = 1.0 / np.arange(1, args.items + 1) ** 1.1
+    popularity = popularity[rng.permutation(args.items)]
+    return store_ids, {
+        "ids": np.array([item_ids[row[0]] for row in item_rows]),
+        "prices": prices,
+        "costs": costs,
+        "rates": rates,
+        "popularity": popularity / popularity.sum(),
+    }
+
+
+def line_counts(seed, store_index, transactions, batch_transactions):
+    # Own random stream so the planner and the worker see the same basket sizes
+    rng = np.random.default_rng([seed, store_index, 1])
+    for offset in range(0, transactions, batch_transactions):
+        yield rng.integers(1, MAX_LINES_PER_TRANSACTION + 1, min(batch_transactions, transactions - offset))
+
+
+def plan_stores(args, store_ids, start_date, rng, next_transaction, next_entry):
+    # Split the line target across stores of uneven size, spread each store's trade
+    # over the days with weekday seasonality, then reserve its identity ranges
+    shares = rng.uniform(0.5, 1.5, len(store_ids))
+    shares /= shares.sum()
+    weekdays = (np.arange(args.days) + start_date.weekday()) % 7
+    day_weights = WEEKDAY_WEIGHTS[weekdays]
+    plans = []
+    for index, store_id in enumerate(store_ids):
+        transactions = max(int(args.lines * shares[index] / ((MAX_LINES_PER_TRANSACTION + 1) / 2)), 1)
+        store_rng = np.random.default_rng([args.seed, index, 2])
+        weights = day_weights * store_rng.uniform(0.85, 1.15, args.days)
+        day_counts = store_rng.multinomial(transactions, weights / weights.sum())
+        lines = int(sum(counts.sum() for counts in line_counts(args.seed, index, transactions, args.batch_transactions)))
+        plans.append({
+            "index": index,
+            "store_id": store_id,
+            "transactions": transactions,
+            "lines": lines,
+            "day_counts": day_counts,
+            "first_transaction": next_transaction,
+            "first_entry": next_entry,
+        })
+        next_transaction += transactions
+        next_entry += lines
+    return plans
+
+
+worker_state = {}
+
+
+def init_worker(items, start_date, seed, batch_transactions):
+    worker_state.update(items=items, start_date=start_date, seed=seed, batch_transactions=batch_transactions)
+
+
+def load_store(plan):
+    items = worker_state["items"]
+    seed = worker_state["seed"]
+    batch_transactions = worker_state["batch_transactions"]
+    rng = np.random.default_rng([seed, plan["index"], 3])
+    day_ends = np.cumsum(plan["day_counts"])
+    day_starts = day_ends - plan["day_counts"]
+    opening = np.datetime64(worker_state["start_date"], "s") + np.timedelta64(OPENING_SECONDS, "s")
+
+    started = time.perf_counter()
+    conn = connect()
+    cursor = conn.cursor()
+    cursor.fast_executemany = True
+    next_entry = plan["first_entry"]
+    offset = 0
+    for counts in line_counts(seed, plan["index"], plan["transactions"], batch_transactions):
+        size = len(counts)
+        positions = np.arange(offset, offset + size)
+        numbers = plan["first_transaction"] + positions
+        # Times rise with TransactionNumber through each trading day
+        days = np.searchsorted(day_ends, positions, side="right")
+        rank = (positions - day_starts[days] + rng.random(size)) / np.maximum(plan["day_counts"][days], 1)
+        times = opening + days.astype("timedelta64[D]") + (rank * TRADING_SECONDS).astype("timedelta64[s]")
+
+        lines = int(counts.sum())
+        picks = rng.choice(len(items["ids"]), lines, p=items["popularity"])
+        quantities = rng.integers(1, 4, lines).astype(float)
+        prices = items["prices"][picks]
+        rates = items["rates"][picks]
+        sales_tax = np.round(prices * quantities * rates / 100, 2)
+        line_totals = np.round(prices * quantities + sales_tax, 2)
+        firsts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        transaction_rows = list(zip(
+            numbers.tolist(),
+            [plan["store_id"]] * size,
+            times.astype("datetime64[ms]").tolist(),
+            rng.integers(1000, 10000, size).tolist(),
+            np.round(np.add.reduceat(line_totals, firsts), 2).tolist(),
+            np.round(np.add.reduceat(sales_tax, firsts), 2).tolist(),
+        ))
+        entry_rows = list(zip(
+            range(next_entry, next_entry + lines),
+            np.repeat(numbers, counts).tolist(),
+            [plan["store_id"]] * lines,
+            items["ids"][picks].tolist(),
+            quantities.tolist(),
+            prices.tolist(),
+            prices.tolist(),
+            items["costs"][picks].tolist(),
+            (rates > 0).tolist(),
+            sales_tax.tolist(),
+        ))
+
+        # IDENTITY_INSERT can only be on for one table per session at a time
+        cursor.execute("SET IDENTITY_INSERT [Transaction] ON")
+        cursor.executemany(
+            "INSERT INTO [Transaction] (TransactionNumber, StoreID, Time, BatchNumber, Total, SalesTax) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            transaction_rows,
+        )
+        cursor.execute("SET IDENTITY_INSERT [Transaction] OFF")
+        cursor.execute("SET IDENTITY_INSERT TransactionEntry ON")
+        cursor.executemany(
+            "INSERT INTO TransactionEntry (ID, TransactionNumber, StoreID, ItemID, Quantity, Price, FullPrice, Cost, Taxable, SalesTax) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            entry_rows,
+        )
+        cursor.execute("SET IDENTITY_INSERT TransactionEntry OFF")
+        conn.commit()
+        next_entry += lines
+        offset += size
+
+    cursor.close()
+    conn.close()
+    return plan["store_id"], plan["transactions"], plan["lines"], time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate demo sales data in bulk")
+    parser.add_argument("--lines", type=parse_count, default=parse_count("100k"), help="Total TransactionEntry rows, e.g. 250k, 100m")
+    parser.add_argument("--days", type=int, default=90, help="Days of history ending at --end-date")
+    parser.add_argument("--end-date", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(), default=date.today())
+    parser.add_argument("--stores", type=int, default=3)
+    parser.add_argument("--departments", type=int, default=len(DEPARTMENT_NAMES))
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--tax-rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[0.0, 16.0],
+                        help="Comma separated VAT percentages")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-transactions", type=int, default=50_000, help="Transactions per insert batch and commit")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    start_date = args.end_date - timedelta(days=args.days - 1)
+    rng = np.random.default_rng([args.seed, 0])
+
+    conn = connect()
+    cursor = conn.cursor()
+    store_ids, items = insert_reference_data(cursor, args, rng)
+    conn.commit()
+
+    # Reserve identity ranges after the current maximums; don't run against a live till
+    next_transaction = cursor.execute("SELECT ISNULL(MAX(TransactionNumber), 0) + 1 FROM [Transaction]").fetchone()[0]
+    next_entry = cursor.execute("SELECT ISNULL(MAX(ID), 0) + 1 FROM TransactionEntry").fetchone()[0]
+    cursor.close()
+    conn.close()
+
+    plans = plan_stores(args, store_ids, start_date, rng, next_transaction, next_entry)
+    total_lines = sum(plan["lines"] for plan in plans)
+    print(f"Generating {total_lines:,} lines in {sum(plan['transactions'] for plan in plans):,} transactions "
+          f"from {start_date} to {args.end_date} with {args.workers} workers")
+
+    done = 0
+    with multiprocessing.Pool(
+        min(args.workers, len(plans)), initializer=init_worker,
+        initargs=(items, start_date, args.seed, args.batch_transactions),
+    ) as pool:
+        for store_id, transactions, lines, seconds in pool.imap_unordered(load_store, plans):
+            done += lines
+            elapsed = time.perf_counter() - started
+            print(f"  store {store_id}: {lines:,} lines in {seconds:.0f}s "
+                  f"({done:,} / {total_lines:,}, {done / elapsed:,.0f} lines/s overall)")
+
+    print(f"✅ Demo data population complete in {time.perf_counter() - started:.0f}s")
+    print("Run POST /rollup/refresh to fold the new sales into the report rollup.")
+
+
+if __name__ == "__main__":
+    main()
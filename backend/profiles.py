@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+# Connection profiles shared by every worker process; /connect-db writes here and each
+# worker builds its own pools from it
+CONNECTION_PROFILES_PATH = os.getenv(
+    "CONNECTION_PROFILES_PATH", os.path.join(os.path.expanduser("~"), ".vat-connections.db")
+)
+# Fernet key for the stored passwords. When unset one is generated into <path>.key on first use.
+CONNECTION_SECRET_KEY = os.getenv("CONNECTION_SECRET_KEY")
+# Worker processes uvicorn starts (it reads the same variable)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# A worker whose pool for a profile failed to build tries again after this long
+PROFILE_RETRY_SECONDS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    name TEXT PRIMARY KEY,
+    server TEXT NOT NULL,
+    database TEXT NOT NULL,
+    username TEXT NOT NULL,
+    password BLOB NOT NULL,
+    mode TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profile_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO profile_version (id, version) VALUES (1, 0);
+"""
+
+
+def private_file(path):
+    # Owner read/write only; a no-op beyond the read-only flag on Windows
+    try:
+        os.chmod(path, 0o600)
+    except OSError as e:
+        logger.warning("Could not restrict permissions on %s: %s", path, e)
+
+
+class ProfileStore:
+    # SQLite file holding the named connection profiles, passwords encrypted with Fernet.
+    # Every write bumps one version number, so workers notice changes with a stat and, only
+    # when the file changed, a one-row read.
+    def __init__(self, path=CONNECTION_PROFILES_PATH, secret_key=CONNECTION_SECRET_KEY):
+        self.path = path
+        self.secret_key = secret_key
+        self._cipher = None
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        if not self._ready:
+            self._create()
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+        private_file(self.path)
+        self._ready = True
+
+    def _key(self):
+        if self.secret_key:
+            return self.secret_key.encode("ascii")
+        path = self.path + ".key"
+        try:
+            with open(path, "rb") as handle:
+                return handle.read().strip()
+        except FileNotFoundError:
+            pass
+        # Written aside and linked into place, so workers racing here all end up with the
+        # one key that won
+        key = Fernet.generate_key()
+        temporary = f"{path}.{os.getpid()}"
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "wb") as handle:
+            handle.write(key)
+        try:
+            os.link(temporary, path)
+            logger.info("Generated a connection secret key at %s", path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+        with open(path, "rb") as handle:
+            return handle.read().strip()
+
+    def _encrypt(self, password):
+        if Fernet is None:
+            # The file is still private to the service account
+            return password.encode("utf-8")
+        if self._cipher is None:
+            self._cipher = Fernet(self._key())
+        return self._cipher.encrypt(password.encode("utf-8"))
+
+    def _decrypt(self, stored):
+        stored = bytes(stored)
+        if Fernet is None:
+            return stored.decode("utf-8")
+        if self._cipher is None:
+            self._cipher = Fernet(self._key())
+        try:
+            return self._cipher.decrypt(stored).decode("utf-8")
+        except InvalidToken:
+            raise Exception("Stored password cannot be decrypted; reconnect with CONNECTION_SECRET_KEY set as before")
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def save(self, name, server, database, username, password, mode):
+        encrypted = self._encrypt(password)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE profile_version SET version = version + 1 WHERE id = 1")
+            revision = conn.execute("SELECT version FROM profile_version WHERE id = 1").fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO profile (name, server, database, username, password, mode, revision, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, server, database, username, encrypted, mode, revision,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+        return revision
+
+    def remove(self, name):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            removed = conn.execute("DELETE FROM profile WHERE name = ?", (name,)).rowcount
+            if removed:
+                conn.execute("UPDATE profile_version SET version = version + 1 WHERE id = 1")
+        return bool(removed)
+
+    def load(self):
+        # (version, {name: profile}); passwords stay encrypted until a pool is built
+        with self._connect() as conn:
+            version = conn.execute("SELECT version FROM profile_version WHERE id = 1").fetchone()[0]
+            rows = conn.execute(
+                "SELECT name, server, database, username, password, mode, revision, updated_at FROM profile"
+            ).fetchall()
+        return version, {
+            row[0]: {"name": row[0], "server": row[1], "database": row[2], "username": row[3],
+                     "password": bytes(row[4]), "mode": row[5], "revision": row[6], "updated_at": row[7]}
+            for row in rows
+        }
+
+    def password(self, profile):
+        return self._decrypt(profile["password"])
+
+
+class ConnectionRegistry:
+    # This worker's view of the shared profiles. A pool is built the first time a profile is
+    # used here, and closed once the profile changes or goes away in any worker.
+    def __init__(self, store, build, on_close):
+        # build(profile, password) -> connected database, run in a thread; on_close(db)
+        self.store = store
+        self.build = build
+        self.on_close = on_close
+        self.profiles = {}
+        self.version = None
+        self._seen = None
+        self._pools = {}
+        self._failed = {}
+        self._locks = {}
+
+    def sync(self):
+        # True when the profiles changed since the last call
+        seen = self.store.stat()
+        if self.version is not None and seen == self._seen:
+            return False
+        try:
+            version, profiles = self.store.load()
+        except sqlite3.Error as e:
+            # Keep serving with the profiles already known
+            logger.warning("Could not read connection profiles from %s: %s", self.store.path, e)
+            return False
+        self._seen = seen
+        if version == self.version:
+            return False
+        for name, (revision, db) in list(self._pools.items()):
+            profile = profiles.get(name)
+            if profile is None or profile["revision"] != revision:
+                del self._pools[name]
+                self.on_close(db)
+        self.profiles, self.version = profiles, version
+        self._failed.clear()
+        return True
+
+    def __contains__(self, name):
+        return name in self.profiles
+
+    def __iter__(self):
+        return iter(self.profiles)
+
+    def install(self, name, revision, db):
+        # The worker that served /connect-db keeps the pool it validated the profile with
+        self.sync()
+        previous = self._pools.get(name)
+        self._pools[name] = (revision, db)
+        self._failed.pop(name, None)
+        if previous is not None and previous[1] is not db:
+            self.on_close(previous[1])
+
+    async def get(self, name):
+        # None for an unknown profile or one whose pool could not be built just now
+        profile = self.profiles.get(name)
+        if profile is None:
+            return None
+        pooled = self._pools.get(name)
+        if pooled is not None and pooled[0] == profile["revision"]:
+            return pooled[1]
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            pooled = self._pools.get(name)
+            if pooled is not None and pooled[0] == profile["revision"]:
+                return pooled[1]
+            failed_at = self._failed.get(name)
+            if failed_at is not None and time.monotonic() - failed_at < PROFILE_RETRY_SECONDS:
+                return None
+            try:
+                loop = asyncio.get_running_loop()
+                db = await loop.run_in_executor(None, self.build, profile, self.store.password(profile))
+            except Exception as e:
+                self._failed[name] = time.monotonic()
+                logger.warning("Could not open connection %s to %s/%s: %s", name, profile["server"], profile["database"], e)
+                return None
+            if self.profiles.get(name, {}).get("revision") != profile["revision"]:
+                # Replaced while connecting
+                self.on_close(db)
+                return None
+            self._pools[name] = (profile["revision"], db)
+            logger.info("Opened connection %s to %s/%s in this worker", name, profile["server"], profile["database"])
+            return db
+
+    def pooled(self, name):
+        pooled = self._pools.get(name)
+        return pooled[1] if pooled is not None else None
+
+    def close(self):
+        for _, db in self._pools.values():
+            self.on_close(db)
+        self._pools.clear()
@@ -0,0 +1,249 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+import periods
+from database import fetch_rows, read_only
+
+logger = logging.getLogger(__name__)
+
+# Transaction numbers per chunk. Each chunk is read and reduced on its own, so memory
+# holds one chunk's lines whatever the length of the period
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "50000"))
+# Differences up to this amount are rounding, not mismatches
+RECONCILE_TOLERANCE = float(os.getenv("RECONCILE_TOLERANCE", "0.01"))
+# Largest mismatches kept as examples per check
+RECONCILE_SAMPLE_SIZE = 50
+# /vat-return derives vatable sales as SalesTax * 6.25, which only holds when every taxed line is at 16%
+VAT_RETURN_VATABLE_FACTOR = 6.25
+# Stands in for a missing department or store in the group keys, NaN does not group
+MISSING_KEY = -1
+
+BOUNDS_QUERY = """
+    SELECT MIN(t.TransactionNumber), MAX(t.TransactionNumber)
+    FROM [Transaction] t
+    WHERE t.Time >= ? AND t.Time < ?"""
+
+# Both chunk queries return numbers only, so a chunk converts straight into one float array
+HEADER_QUERY = """
+    SELECT t.TransactionNumber, t.StoreID, CAST(ISNULL(t.SalesTax, 0) AS FLOAT)
+    FROM [Transaction] t
+    WHERE t.TransactionNumber > ? AND t.TransactionNumber <= ? AND t.Time >= ? AND t.Time < ?"""
+
+# The item's department and tax rate come from the dimension cache, so lines cross the
+# wire as six numbers. Lines without an item or tax row still count towards their header's tax.
+LINE_QUERY = """
+    SELECT
+        te.ID,
+        te.TransactionNumber,
+        te.StoreID,
+        te.ItemID,
+        CAST(te.Quantity * te.Price AS FLOAT),
+        CAST(ISNULL(te.SalesTax, 0) AS FLOAT)
+    FROM TransactionEntry te
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    WHERE te.TransactionNumber > ? AND te.TransactionNumber <= ? AND t.Time >= ? AND t.Time < ?"""
+
+
+@read_only
+def read_bounds(conn, start_date, stop_date):
+    _, rows = fetch_rows(conn, BOUNDS_QUERY, (start_date, stop_date))
+    return rows[0][0], rows[0][1]
+
+
+def read_array(conn, query, params, width):
+    _, rows = fetch_rows(conn, query, params)
+    if not rows:
+        return np.empty((0, width))
+    # NULLs become NaN
+    return np.array([tuple(row) for row in rows], dtype=np.float64)
+
+
+def key_value(value):
+    return None if value == MISSING_KEY else int(value)
+
+
+def money(value):
+    return round(float(value), 2) + 0.0
+
+
+class Totals:
+    # Per-group sums of (recorded, expected) tax over the mismatched rows, plus the
+    # largest single mismatches seen so far
+    def __init__(self, key_names, sample_fields):
+        self.key_names = key_names
+        self.sample_fields = sample_fields
+        self.groups = {}
+        self.samples = np.empty((0, len(sample_fields)))
+
+    def add(self, keys, recorded, expected, samples):
+        if not len(keys):
+            return
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(unique))
+        recorded_sums = np.bincount(inverse, weights=recorded, minlength=len(unique))
+        expected_sums = np.bincount(inverse, weights=expected, minlength=len(unique))
+        for key, count, recorded_sum, expected_sum in zip(map(tuple, unique), counts, recorded_sums, expected_sums):
+            group = self.groups.setdefault(key, [0, 0.0, 0.0])
+            group[0] += int(count)
+            group[1] += recorded_sum
+            group[2] += expected_sum
+        # Last sample column is the difference; keep the largest by size
+        merged = np.concatenate([self.samples, samples])
+        largest = np.argsort(-np.abs(merged[:, -1]), kind="stable")[:RECONCILE_SAMPLE_SIZE]
+        self.samples = merged[largest]
+
+    def result(self, names, recorded, expected):
+        # recorded and expected: (record field, summary field) names for the two sides
+        (recorded_name, recorded_total), (expected_name, expected_total) = recorded, expected
+        records = []
+        for key, (count, recorded, expected) in self.groups.items():
+            record = {}
+            for name, value in zip(self.key_names, key):
+                record[f"{name.capitalize()}ID"] = key_value(value)
+                record[f"{name.capitalize()}Name"] = names[name].get(key_value(value))
+            record.update({"Count": count, recorded_name: money(recorded), expected_name: money(expected),
+                           "Difference": money(recorded - expected)})
+            records.append(record)
+        records.sort(key=lambda record: -abs(record["Difference"]))
+        recorded_sum = sum(group[1] for group in self.groups.values())
+        expected_sum = sum(group[2] for group in self.groups.values())
+        return {
+            "count": sum(group[0] for group in self.groups.values()),
+            recorded_total: money(recorded_sum),
+            expected_total: money(expected_sum),
+            "difference": money(recorded_sum - expected_sum),
+            "groups": records,
+            "largest": [
+                {name: convert(value) for (name, convert), value in zip(self.sample_fields, row)}
+                for row in self.samples
+            ],
+        }
+
+
+class Reconciliation:
+    # Accumulates one chunk at a time. A chunk holds whole transactions (it is a
+    # TransactionNumber range), so header/line sums never straddle two chunks.
+    def __init__(self, tolerance=RECONCILE_TOLERANCE):
+        self.tolerance = tolerance
+        self.chunks = 0
+        self.transactions = 0
+        self.lines = 0
+        self.unrated_lines = 0
+        self.header_tax = 0.0
+        self.line_tax = 0.0
+        self.vatable_sales = 0.0
+        self.headers = Totals(
+            ("store",),
+            (("TransactionNumber", key_value), ("StoreID", key_value), ("HeaderTax", money), ("LineTax", money), ("Difference", money)),
+        )
+        self.rates = Totals(
+            ("store", "department"),
+            (("EntryID", key_value), ("TransactionNumber", key_value), ("StoreID", key_value), ("DepartmentID", key_value),
+             ("SalesExclusive", money), ("TaxRate", float), ("RecordedTax", money), ("ExpectedTax", money), ("Difference", money)),
+        )
+
+    @staticmethod
+    @read_only
+    def read_chunk(conn, low, high, start_date, stop_date, store_filter, filter_params):
+        params = (low, high, start_date, stop_date) + filter_params
+        headers = read_array(conn, HEADER_QUERY + store_filter, params, 3)
+        lines = read_array(conn, LINE_QUERY + store_filter, params, 6)
+        return headers, lines
+
+    @staticmethod
+    def with_items(lines, dimensions):
+        # (entry, number, store, item, sales, tax) -> (entry, number, store, department, sales, tax, rate)
+        departments, taxes = dimensions.items.lookup(lines[:, 3])
+        return np.column_stack([lines[:, :3], departments, lines[:, 4:], dimensions.tax_rate_array(taxes)])
+
+    def add_chunk(self, headers, lines):
+        self.chunks += 1
+        self.transactions += len(headers)
+        self.lines += len(lines)
+        headers = headers[np.argsort(headers[:, 0], kind="stable")]
+        numbers, stores, header_tax = headers[:, 0], np.nan_to_num(headers[:, 1], nan=MISSING_KEY), headers[:, 2]
+        entries, line_numbers, line_stores, departments, sales, tax, rates = lines.T
+        line_stores = np.nan_to_num(line_stores, nan=MISSING_KEY)
+        departments = np.nan_to_num(departments, nan=MISSING_KEY)
+        sales = np.nan_to_num(sales)
+
+        # Header tax against the sum of its lines' tax
+        position = np.searchsorted(numbers, line_numbers)
+        line_tax = np.bincount(position, weights=tax, minlength=len(numbers))
+        difference = header_tax - line_tax
+        bad = np.abs(difference) > self.tolerance
+        self.header_tax += header_tax.sum()
+        self.line_tax += tax.sum()
+        self.headers.add(
+            stores[bad][:, None], header_tax[bad], line_tax[bad],
+            np.column_stack([numbers, stores, header_tax, line_tax, difference])[bad],
+        )
+
+        # Line tax against the item's tax rate
+        rated = ~np.isnan(rates)
+        self.unrated_lines += int((~rated).sum())
+        expected = np.round(sales * np.nan_to_num(rates) / 100, 2)
+        line_difference = tax - expected
+        bad = rated & (np.abs(line_difference) > self.tolerance)
+        self.vatable_sales += sales[rated & (rates > 0)].sum()
+        self.rates.add(
+            np.column_stack([line_stores, departments])[bad], tax[bad], expected[bad],
+            np.column_stack([entries, line_numbers, line_stores, departments, sales, rates, tax, expected, line_difference])[bad],
+        )
+
+    def result(self, names):
+        derived_vatable = self.line_tax * VAT_RETURN_VATABLE_FACTOR
+        return {
+            "tolerance": self.tolerance,
+            "chunks": self.chunks,
+            "transactions": self.transactions,
+            "lines": self.lines,
+            "unrated_lines": self.unrated_lines,
+            "header_tax": money(self.header_tax),
+            "line_tax": money(self.line_tax),
+            "header_line_mismatches": self.headers.result(names, ("HeaderTax", "header_tax"), ("LineTax", "line_tax")),
+            "rate_mismatches": self.rates.result(names, ("RecordedTax", "recorded_tax"), ("ExpectedTax", "expected_tax")),
+            # What /vat-return reports as vatable against the taxed lines' actual sales
+            "vatable": {
+                "vat_return_factor": VAT_RETURN_VATABLE_FACTOR,
+                "derived_from_tax": money(derived_vatable),
+                "taxed_line_sales": money(self.vatable_sales),
+                "difference": money(derived_vatable - self.vatable_sales),
+            },
+        }
+
+
+async def reconcile(db, dimension_cache, start_date, end_date, StoreID=None, tolerance=RECONCILE_TOLERANCE,
+                    chunk_size=RECONCILE_CHUNK_SIZE):
+    # Chunks run one after another, each on a connection of its own, so a long period
+    # never holds a pooled connection for its whole duration
+    started = time.perf_counter()
+    store_filter = ""
+    filter_params = ()
+    if StoreID is not None:
+        # On the header for both queries, so a transaction is never split by the filter
+        store_filter = " AND t.StoreID = ?"
+        filter_params = (StoreID,)
+
+    state = Reconciliation(tolerance)
+    dimensions = await dimension_cache.get(db)
+    # The whole end day is included
+    stop_date = periods.day_after(end_date)
+    low, high = await db.run(read_bounds, start_date, stop_date)
+    if low is not None:
+        current = low - 1
+        while current < high:
+            upto = min(current + chunk_size, high)
+            headers, lines = await db.run(state.read_chunk, current, upto, start_date, stop_date, store_filter, filter_params)
+            dimensions = await dimension_cache.resolve(db, "item", lines[:, 3])
+            state.add_chunk(headers, state.with_items(lines, dimensions))
+            current = upto
+    result = state.result({"store": dimensions.stores, "department": dimensions.departments})
+    result["period"] = {"start_date": start_date, "end_date": end_date}
+    result["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Reconciled %d lines in %d chunks in %.1fs", state.lines, state.chunks, result["elapsed_seconds"])
+    return result
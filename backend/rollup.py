@@ -0,0 +1,487 @@
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+import periods
+from database import fetch_rows, read_frame, read_only
+
+logger = logging.getLogger(__name__)
+
+# Transactions folded into the rollup per committed batch
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "50000"))
+# How often the background task refreshes the rollup, 0 disables it
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "0"))
+# How long a report waits for a running refresh batch before reading raw tables
+ROLLUP_LOCK_TIMEOUT_MS = int(os.getenv("ROLLUP_LOCK_TIMEOUT_MS", "5000"))
+
+ROLLUP_NAME = "daily_sales"
+ROLLUP_LOCK = "RPT_DailySales"
+
+CREATE_TABLES = """
+IF OBJECT_ID('dbo.RPT_RollupState') IS NULL
+    CREATE TABLE dbo.RPT_RollupState (
+        Name varchar(50) NOT NULL CONSTRAINT PK_RPT_RollupState PRIMARY KEY,
+        HighWaterMark int NOT NULL,
+        RefreshedAt datetime NOT NULL,
+        ClassificationChecksum int NULL
+    );
+
+IF COL_LENGTH('dbo.RPT_RollupState', 'ClassificationChecksum') IS NULL
+    ALTER TABLE dbo.RPT_RollupState ADD ClassificationChecksum int NULL;
+
+IF OBJECT_ID('dbo.RPT_DailySales') IS NULL
+    CREATE TABLE dbo.RPT_DailySales (
+        SaleDate date NOT NULL,
+        StoreID int NOT NULL,
+        DepartmentID int NOT NULL,
+        TaxID int NOT NULL,
+        TaxRate real NULL,
+        Quantity float NOT NULL,
+        SalesExclusive money NOT NULL,
+        SalesTax money NOT NULL,
+        Cost money NOT NULL,
+        LineCount int NOT NULL,
+        TransactionCount int NOT NULL,
+        CONSTRAINT PK_RPT_DailySales PRIMARY KEY CLUSTERED (SaleDate, StoreID, DepartmentID, TaxID)
+    );
+
+IF OBJECT_ID('dbo.RPT_DailyDepartmentTransactions') IS NULL
+    CREATE TABLE dbo.RPT_DailyDepartmentTransactions (
+        SaleDate date NOT NULL,
+        StoreID int NOT NULL,
+        DepartmentID int NOT NULL,
+        TransactionCount int NOT NULL,
+        CONSTRAINT PK_RPT_DailyDepartmentTransactions PRIMARY KEY CLUSTERED (SaleDate, StoreID, DepartmentID)
+    );
+
+IF OBJECT_ID('dbo.RPT_DailyTransactions') IS NULL
+    CREATE TABLE dbo.RPT_DailyTransactions (
+        SaleDate date NOT NULL,
+        StoreID int NOT NULL,
+        HeaderCount int NOT NULL,
+        HeaderTotal money NOT NULL,
+        HeaderSalesTax money NOT NULL,
+        TransactionCount int NOT NULL,
+        CONSTRAINT PK_RPT_DailyTransactions PRIMARY KEY CLUSTERED (SaleDate, StoreID)
+    );
+
+IF NOT EXISTS (SELECT 1 FROM dbo.RPT_RollupState WHERE Name = ?)
+    INSERT INTO dbo.RPT_RollupState (Name, HighWaterMark, RefreshedAt) VALUES (?, 0, GETDATE());
+"""
+
+ROLLUP_TABLES = ("RPT_DailySales", "RPT_DailyDepartmentTransactions", "RPT_DailyTransactions")
+
+# TransactionNumber is an identity handed out at insert, so a sale still being written
+# can hold a lower number than sales that committed after it. Rows visible to NOLOCK but
+# skipped by READPAST are such uncommitted sales; the rollup and the live feed stop just
+# below the first one and pick it up once it commits.
+SETTLED_TRANSACTION = """
+SELECT
+    MIN(CASE WHEN c.TransactionNumber IS NULL THEN u.TransactionNumber END) - 1,
+    MAX(u.TransactionNumber)
+FROM [Transaction] u WITH (NOLOCK)
+LEFT JOIN [Transaction] c WITH (READCOMMITTEDLOCK, READPAST) ON c.TransactionNumber = u.TransactionNumber
+WHERE u.TransactionNumber > ?
+"""
+
+# Folded rows keep the department and tax rate their items had when they were folded,
+# so a change to either rebuilds the rollup. Cost is also taken at fold time but is not
+# tracked: item costs change with every delivery and the rollup reports sales, not margin.
+CLASSIFICATION_CHECKSUM = """
+SELECT CHECKSUM(
+    (SELECT COUNT_BIG(*) FROM Item),
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(ID, DepartmentID, TaxID)) FROM Item),
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(ID, Percentage)) FROM Tax)
+)
+"""
+
+# Each MERGE folds the transactions in (low, high] into the existing day rows
+MERGE_DAILY_SALES = """
+MERGE dbo.RPT_DailySales AS r
+USING (
+    SELECT
+        CAST(t.Time AS DATE) AS SaleDate,
+        te.StoreID,
+        i.DepartmentID,
+        i.TaxID,
+        MAX(tx.Percentage) AS TaxRate,
+        SUM(te.Quantity) AS Quantity,
+        SUM(te.Quantity * te.Price) AS SalesExclusive,
+        SUM(ISNULL(te.SalesTax, 0)) AS SalesTax,
+        SUM(te.Quantity * i.Cost) AS Cost,
+        COUNT(*) AS LineCount,
+        COUNT(DISTINCT te.TransactionNumber) AS TransactionCount
+    FROM TransactionEntry te
+    JOIN Item i ON i.ID = te.ItemID
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    LEFT JOIN Tax tx ON tx.ID = i.TaxID
+    WHERE te.TransactionNumber > ? AND te.TransactionNumber <= ?
+    GROUP BY CAST(t.Time AS DATE), te.StoreID, i.DepartmentID, i.TaxID
+) AS s
+ON r.SaleDate = s.SaleDate AND r.StoreID = s.StoreID AND r.DepartmentID = s.DepartmentID AND r.TaxID = s.TaxID
+WHEN MATCHED THEN UPDATE SET
+    r.TaxRate = s.TaxRate,
+    r.Quantity = r.Quantity + s.Quantity,
+    r.SalesExclusive = r.SalesExclusive + s.SalesExclusive,
+    r.SalesTax = r.SalesTax + s.SalesTax,
+    r.Cost = r.Cost + s.Cost,
+    r.LineCount = r.LineCount + s.LineCount,
+    r.TransactionCount = r.TransactionCount + s.TransactionCount
+WHEN NOT MATCHED THEN
+    INSERT (SaleDate, StoreID, DepartmentID, TaxID, TaxRate, Quantity, SalesExclusive, SalesTax, Cost, LineCount, TransactionCount)
+    VALUES (s.SaleDate, s.StoreID, s.DepartmentID, s.TaxID, s.TaxRate, s.Quantity, s.SalesExclusive, s.SalesTax, s.Cost, s.LineCount, s.TransactionCount);
+"""
+
+MERGE_DAILY_DEPARTMENT_TRANSACTIONS = """
+MERGE dbo.RPT_DailyDepartmentTransactions AS r
+USING (
+    SELECT
+        CAST(t.Time AS DATE) AS SaleDate,
+        te.StoreID,
+        i.DepartmentID,
+        COUNT(DISTINCT te.TransactionNumber) AS TransactionCount
+    FROM TransactionEntry te
+    JOIN Item i ON i.ID = te.ItemID
+    JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+    WHERE te.TransactionNumber > ? AND te.TransactionNumber <= ?
+    GROUP BY CAST(t.Time AS DATE), te.StoreID, i.DepartmentID
+) AS s
+ON r.SaleDate = s.SaleDate AND r.StoreID = s.StoreID AND r.DepartmentID = s.DepartmentID
+WHEN MATCHED THEN UPDATE SET r.TransactionCount = r.TransactionCount + s.TransactionCount
+WHEN NOT MATCHED THEN
+    INSERT (SaleDate, StoreID, DepartmentID, TransactionCount)
+    VALUES (s.SaleDate, s.StoreID, s.DepartmentID, s.TransactionCount);
+"""
+
+MERGE_DAILY_TRANSACTIONS = """
+MERGE dbo.RPT_DailyTransactions AS r
+USING (
+    SELECT
+        CAST(t.Time AS DATE) AS SaleDate,
+        t.StoreID,
+        COUNT(*) AS HeaderCount,
+        SUM(t.Total) AS HeaderTotal,
+        SUM(t.SalesTax) AS HeaderSalesTax,
+        SUM(l.HasLines) AS TransactionCount
+    FROM [Transaction] t
+    CROSS APPLY (
+        SELECT CASE WHEN EXISTS (
+            SELECT 1 FROM TransactionEntry te JOIN Item i ON i.ID = te.ItemID
+            WHERE te.TransactionNumber = t.TransactionNumber
+        ) THEN 1 ELSE 0 END AS HasLines
+    ) l
+    WHERE t.TransactionNumber > ? AND t.TransactionNumber <= ?
+    GROUP BY CAST(t.Time AS DATE), t.StoreID
+) AS s
+ON r.SaleDate = s.SaleDate AND r.StoreID = s.StoreID
+WHEN MATCHED THEN UPDATE SET
+    r.HeaderCount = r.HeaderCount + s.HeaderCount,
+    r.HeaderTotal = r.HeaderTotal + s.HeaderTotal,
+    r.HeaderSalesTax = r.HeaderSalesTax + s.HeaderSalesTax,
+    r.TransactionCount = r.TransactionCount + s.TransactionCount
+WHEN NOT MATCHED THEN
+    INSERT (SaleDate, StoreID, HeaderCount, HeaderTotal, HeaderSalesTax, TransactionCount)
+    VALUES (s.SaleDate, s.StoreID, s.HeaderCount, s.HeaderTotal, s.HeaderSalesTax, s.TransactionCount);
+"""
+
+# Readers share the applock with each other and wait out a refresh batch, so the
+# high-water mark they read always matches the rows in the rollup tables
+PIN_HIGH_WATER_MARK = f"""
+SET NOCOUNT ON;
+DECLARE @hwm int = NULL, @rc int;
+IF OBJECT_ID('dbo.RPT_RollupState') IS NOT NULL
+BEGIN
+    EXEC @rc = sp_getapplock @Resource = '{ROLLUP_LOCK}', @LockMode = 'Shared', @LockOwner = 'Session', @LockTimeout = {ROLLUP_LOCK_TIMEOUT_MS};
+    IF @rc >= 0
+        SELECT @hwm = NULLIF(HighWaterMark, 0) FROM dbo.RPT_RollupState WHERE Name = '{ROLLUP_NAME}';
+END
+SELECT @hwm AS HighWaterMark;
+"""
+
+RELEASE_HIGH_WATER_MARK = f"""
+IF APPLOCK_MODE('public', '{ROLLUP_LOCK}', 'Session') <> 'NoLock'
+    EXEC sp_releaseapplock @Resource = '{ROLLUP_LOCK}', @LockOwner = 'Session';
+"""
+
+
+@contextmanager
+def pinned_high_water_mark(conn):
+    # Local snapshots have no rollup tables, so reports fall back to the raw lines
+    if not getattr(conn, "has_rollup", True):
+        yield None
+        return
+    cursor = conn.cursor()
+    try:
+        hwm = cursor.execute(PIN_HIGH_WATER_MARK).fetchone()[0]
+        yield hwm
+    finally:
+        cursor.execute(RELEASE_HIGH_WATER_MARK)
+        cursor.close()
+
+
+async def read_report(db, build):
+    # build(hwm) returns (query, params); hwm is None when there is no usable rollup
+    @read_only
+    def run(conn):
+        with pinned_high_water_mark(conn) as hwm:
+            query, params = build(hwm)
+            return read_frame(conn, query, params)
+    return await db.run(run)
+
+
+async def read_rows(db, build):
+    # Same as read_report, returning (columns, rows) straight from the cursor
+    @read_only
+    def run(conn):
+        with pinned_high_water_mark(conn) as hwm:
+            query, params = build(hwm)
+            return fetch_rows(conn, query, params)
+    return await db.run(run)
+
+
+def sales_source(hwm, start_date, end_date):
+    # Line facts for the days start_date to end_date, both included, at day x store x
+    # department x tax grain
+    stop_date = periods.day_after(end_date)
+    raw_query = """
+        SELECT
+            CAST(t.Time AS DATE) AS SaleDate,
+            te.StoreID,
+            i.DepartmentID,
+            i.TaxID,
+            tx.Percentage AS TaxRate,
+            te.Quantity,
+            te.Quantity * te.Price AS SalesExclusive,
+            ISNULL(te.SalesTax, 0) AS SalesTax,
+            te.Quantity * i.Cost AS Cost,
+            1 AS LineCount
+        FROM TransactionEntry te
+        JOIN Item i ON i.ID = te.ItemID
+        JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+        LEFT JOIN Tax tx ON tx.ID = i.TaxID
+        WHERE t.Time >= ? AND t.Time < ?"""
+    if hwm is None:
+        return raw_query, (start_date, stop_date)
+
+    # Folded transactions come from the rollup's day rows, the rest from the raw tables
+    query = f"""
+        SELECT r.SaleDate, r.StoreID, r.DepartmentID, r.TaxID, r.TaxRate,
+               r.Quantity, r.SalesExclusive, r.SalesTax, r.Cost, r.LineCount
+        FROM RPT_DailySales r
+        WHERE r.SaleDate >= ? AND r.SaleDate < ?
+        UNION ALL
+        {raw_query} AND t.TransactionNumber > ?"""
+    return query, (start_date, stop_date, start_date, stop_date, hwm)
+
+
+def daily_department_source(hwm, start_date, end_date, department_id=None):
+    # Day x department rows plus one day total row per day (IsDayTotal = 1). Distinct
+    # transaction counts are exact at both grains, and the rollup and the raw tail
+    # never share a transaction, so summing their rows keeps them exact
+    stop_date = periods.day_after(end_date)
+    dept_filter = ""
+    dept_params = ()
+    if department_id is not None:
+        dept_filter = " AND {alias}DepartmentID = ?"
+        dept_params = (department_id,)
+
+    raw_query = f"""
+        SELECT
+            CAST(t.Time AS DATE) AS SaleDate,
+            i.DepartmentID,
+            GROUPING(i.DepartmentID) AS IsDayTotal,
+            SUM(te.Quantity * te.Price) AS SalesExclusive,
+            SUM(ISNULL(te.SalesTax, 0)) AS SalesTax,
+            SUM(te.Quantity) AS Quantity,
+            COUNT(*) AS LineCount,
+            COUNT(DISTINCT te.TransactionNumber) AS TransactionCount
+        FROM TransactionEntry te
+        JOIN Item i ON i.ID = te.ItemID
+        JOIN [Transaction] t ON t.TransactionNumber = te.TransactionNumber
+        WHERE t.Time >= ? AND t.Time < ?{{tail}}{dept_filter.format(alias="i.")}
+        GROUP BY GROUPING SETS ((CAST(t.Time AS DATE), i.DepartmentID), (CAST(t.Time AS DATE)))"""
+    if hwm is None:
+        return raw_query.format(tail=""), (start_date, stop_date) + dept_params
+
+    # Day totals count transactions across departments unless only one is selected
+    day_count_table = "RPT_DailyDepartmentTransactions" if department_id is not None else "RPT_DailyTransactions"
+    rollup_filter = dept_filter.format(alias="")
+    day_count_filter = rollup_filter if department_id is not None else ""
+    day_count_params = dept_params if department_id is not None else ()
+    query = f"""
+        SELECT s.SaleDate, s.DepartmentID, 0 AS IsDayTotal, s.SalesExclusive, s.SalesTax,
+               s.Quantity, s.LineCount, ISNULL(c.TransactionCount, 0) AS TransactionCount
+        FROM (
+            SELECT SaleDate, DepartmentID, SUM(SalesExclusive) AS SalesExclusive, SUM(SalesTax) AS SalesTax,
+                   SUM(Quantity) AS Quantity, SUM(LineCount) AS LineCount
+            FROM RPT_DailySales
+            WHERE SaleDate >= ? AND SaleDate < ?{rollup_filter}
+            GROUP BY SaleDate, DepartmentID
+        ) s
+        LEFT JOIN (
+            SELECT SaleDate, DepartmentID, SUM(TransactionCount) AS TransactionCount
+            FROM RPT_DailyDepartmentTransactions
+            WHERE SaleDate >= ? AND SaleDate < ?{rollup_filter}
+            GROUP BY SaleDate, DepartmentID
+        ) c ON c.SaleDate = s.SaleDate AND c.DepartmentID = s.DepartmentID
+        UNION ALL
+        SELECT s.SaleDate, NULL, 1, s.SalesExclusive, s.SalesTax,
+               s.Quantity, s.LineCount, ISNULL(c.TransactionCount, 0)
+        FROM (
+            SELECT SaleDate, SUM(SalesExclusive) AS SalesExclusive, SUM(SalesTax) AS SalesTax,
+                   SUM(Quantity) AS Quantity, SUM(LineCount) AS LineCount
+            FROM RPT_DailySales
+            WHERE SaleDate >= ? AND SaleDate < ?{rollup_filter}
+            GROUP BY SaleDate
+        ) s
+        LEFT JOIN (
+            SELECT SaleDate, SUM(TransactionCount) AS TransactionCount
+            FROM {day_count_table}
+            WHERE SaleDate >= ? AND SaleDate < ?{day_count_filter}
+            GROUP BY SaleDate
+        ) c ON c.SaleDate = s.SaleDate
+        UNION ALL
+        {raw_query.format(tail=" AND t.TransactionNumber > ?")}"""
+    rollup_range = (start_date, stop_date)
+    params = (
+        rollup_range + dept_params + rollup_range + dept_params
+        + rollup_range + dept_params + rollup_range + day_count_params
+        + (start_date, stop_date, hwm) + dept_params
+    )
+    return query, params
+
+
+def header_source(hwm, start_date, end_date):
+    # [Transaction] header totals for the days start_date to end_date, both included, at
+    # day x store grain
+    stop_date = periods.day_after(end_date)
+    raw_query = """
+        SELECT
+            CAST(t.Time AS DATE) AS SaleDate,
+            t.StoreID,
+            1 AS HeaderCount,
+            t.Total AS HeaderTotal,
+            t.SalesTax AS HeaderSalesTax
+        FROM [Transaction] t
+        WHERE t.Time >= ? AND t.Time < ?"""
+    if hwm is None:
+        return raw_query, (start_date, stop_date)
+
+    query = f"""
+        SELECT r.SaleDate, r.StoreID, r.HeaderCount, r.HeaderTotal, r.HeaderSalesTax
+        FROM RPT_DailyTransactions r
+        WHERE r.SaleDate >= ? AND r.SaleDate < ?
+        UNION ALL
+        {raw_query} AND t.TransactionNumber > ?"""
+    return query, (start_date, stop_date, start_date, stop_date, hwm)
+
+
+def settled_transaction(cursor, after):
+    # Highest TransactionNumber at or below which every sale has committed, given that all
+    # up to `after` already had
+    before_pending, latest = cursor.execute(SETTLED_TRANSACTION, after).fetchone()
+    if before_pending is not None:
+        return before_pending
+    return latest if latest is not None else after
+
+
+def refresh(conn, batch_size=ROLLUP_BATCH_SIZE):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_TABLES, (ROLLUP_NAME, ROLLUP_NAME))
+    conn.commit()
+
+    start = cursor.execute("SELECT HighWaterMark FROM dbo.RPT_RollupState WHERE Name = ?", ROLLUP_NAME).fetchone()[0]
+    target = settled_transaction(cursor, start)
+    classification = cursor.execute(CLASSIFICATION_CHECKSUM).fetchone()[0]
+    conn.commit()
+    folded = 0
+    rebuilt = False
+    while True:
+        cursor.execute(
+            f"EXEC sp_getapplock @Resource = '{ROLLUP_LOCK}', @LockMode = 'Exclusive', @LockOwner = 'Session'"
+        )
+        try:
+            # UPDLOCK keeps two refreshers from folding the same batch twice
+            hwm, folded_classification = cursor.execute(
+                "SELECT HighWaterMark, ClassificationChecksum FROM dbo.RPT_RollupState WITH (UPDLOCK, HOLDLOCK) WHERE Name = ?",
+                ROLLUP_NAME,
+            ).fetchone()
+            if folded_classification != classification:
+                # Items moved department or tax rates changed: fold everything again
+                for table in ROLLUP_TABLES:
+                    cursor.execute(f"DELETE FROM dbo.{table}")
+                cursor.execute(
+                    "UPDATE dbo.RPT_RollupState SET HighWaterMark = 0, ClassificationChecksum = ? WHERE Name = ?",
+                    (classification, ROLLUP_NAME),
+                )
+                hwm = 0
+                rebuilt = True
+            if hwm >= target:
+                conn.commit()
+                break
+            upto = min(hwm + batch_size, target)
+            for statement in (MERGE_DAILY_SALES, MERGE_DAILY_DEPARTMENT_TRANSACTIONS, MERGE_DAILY_TRANSACTIONS):
+                cursor.execute(statement, (hwm, upto))
+            cursor.execute(
+                "UPDATE dbo.RPT_RollupState SET HighWaterMark = ?, RefreshedAt = GETDATE() WHERE Name = ?",
+                (upto, ROLLUP_NAME),
+            )
+            conn.commit()
+            folded += upto - hwm
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute(RELEASE_HIGH_WATER_MARK)
+    cursor.close()
+    return {"high_water_mark": target, "transactions_folded": folded, "rebuilt": rebuilt}
+
+
+@read_only
+def status(conn):
+    if not getattr(conn, "has_rollup", True):
+        return {"enabled": False}
+    cursor = conn.cursor()
+    row = cursor.execute(
+        """
+        IF OBJECT_ID('dbo.RPT_RollupState') IS NOT NULL
+            SELECT
+                s.HighWaterMark,
+                s.RefreshedAt,
+                (SELECT ISNULL(MAX(TransactionNumber), 0) FROM [Transaction]) AS LatestTransaction,
+                (SELECT MIN(SaleDate) FROM dbo.RPT_DailySales) AS FirstDate,
+                (SELECT MAX(SaleDate) FROM dbo.RPT_DailySales) AS LastDate
+            FROM dbo.RPT_RollupState s WHERE s.Name = ?
+        ELSE
+            SELECT NULL, NULL, NULL, NULL, NULL
+        """,
+        ROLLUP_NAME,
+    ).fetchone()
+    cursor.close()
+    if row is None or row[0] is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "high_water_mark": row[0],
+        "refreshed_at": row[1].isoformat() if isinstance(row[1], datetime) else row[1],
+        "latest_transaction": row[2],
+        "pending_transactions": max(row[2] - row[0], 0),
+        "first_date": str(row[3]) if row[3] else None,
+        "last_date": str(row[4]) if row[4] else None,
+    }
+
+
+async def refresh_loop(get_db, interval=ROLLUP_REFRESH_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        db = get_db()
+        if not db or not getattr(db, "has_rollup", True):
+            continue
+        try:
+            result = await db.run(refresh)
+            if result["transactions_folded"]:
+                logger.info("Rollup refresh: %s", result)
+        except Exception as e:
+            logger.warning("Rollup refresh failed: %s", e)
@@ -0,0 +1,186 @@
+import contextvars
+import importlib.util
+import json
+import logging
+import math
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse, Response
+
+import metrics
+import startup
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/x-msgpack"
+
+# Accept header of the request being served, recorded by NegotiationMiddleware
+accept = contextvars.ContextVar("accept", default="")
+
+
+# Column converters: NULL, NaN and +/-inf become 0 (or None for nullable columns)
+def number(value):
+    if value is None:
+        return 0.0
+    value = float(value)
+    return value if math.isfinite(value) else 0.0
+
+
+def money(value):
+    # + 0.0 turns the -0.0 that float sums can produce into 0.0
+    return round(number(value), 2) + 0.0
+
+
+def integer(value):
+    if value is None:
+        return 0
+    if isinstance(value, float) and not math.isfinite(value):
+        return 0
+    return int(value)
+
+
+def nullable_number(value):
+    if value is None:
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def text(value):
+    return value
+
+
+def exact(value):
+    # The database's own value (Decimal for money columns), for partials that are summed
+    # before being converted with number
+    return 0 if value is None else value
+
+
+def shape(columns, rows, converters):
+    # Resolve each column's converter once, then convert row by row without a DataFrame
+    started = time.perf_counter()
+    plan = [(name, index, converters.get(name, text)) for index, name in enumerate(columns)]
+    records = [{name: convert(row[index]) for name, index, convert in plan} for row in rows]
+    metrics.SHAPE_SECONDS.observe(time.perf_counter() - started, endpoint=metrics.endpoint.get())
+    return records
+
+
+def column_total(records, name):
+    return round(math.fsum(record[name] for record in records), 2)
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        # NumPy scalars from the pandas-based reports
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=json_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    # Skips FastAPI's jsonable_encoder pass; content must already be plain data
+    def render(self, content):
+        with metrics.SERIALIZE_SECONDS.time(endpoint=metrics.endpoint.get()):
+            return dumps(content)
+
+
+def msgpack_dumps(content):
+    return msgpack.packb(content, default=json_default, use_bin_type=True)
+
+
+def arrow_dumps(content):
+    # A report object becomes a one-row table whose lists of records are list<struct>
+    # columns, so each field of a series is stored as one contiguous column
+    pa = startup.load("pyarrow")
+    table = pa.Table.from_pylist(content if isinstance(content, list) else [content])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# Media type -> encoder, for the formats whose library is installed
+ENCODERS = {JSON: dumps}
+if msgpack is not None:
+    ENCODERS[MSGPACK] = msgpack_dumps
+    ENCODERS["application/msgpack"] = msgpack_dumps
+# pyarrow itself is imported with the first Arrow response
+if importlib.util.find_spec("pyarrow") is not None:
+    ENCODERS[ARROW] = arrow_dumps
+
+
+def negotiate(header):
+    # Highest-q supported media type in an Accept header; JSON when nothing matches
+    choices = []
+    for position, part in enumerate(header.split(",")):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.strip().lower() in ENCODERS and quality > 0:
+            choices.append((-quality, position, media_type.strip().lower()))
+    return min(choices)[2] if choices else JSON
+
+
+class ReportResponse(Response):
+    # Report payloads in the format the client accepts: JSON by default, or Arrow IPC
+    # stream or MessagePack. Like FastJSONResponse, content must already be plain data.
+    def __init__(self, content, status_code=200, headers=None):
+        self.media_type = negotiate(accept.get())
+        super().__init__(content, status_code, headers)
+        self.headers["Vary"] = "Accept"
+
+    def render(self, content):
+        with metrics.SERIALIZE_SECONDS.time(endpoint=metrics.endpoint.get()):
+            if self.media_type != JSON:
+                try:
+                    return ENCODERS[self.media_type](content)
+                except Exception as e:
+                    # Payloads Arrow cannot type (e.g. mixed values in one field) still go out as JSON
+                    logger.debug("Encoding as %s failed, sending JSON: %s", self.media_type, e)
+                    self.media_type = JSON
+            return dumps(content)
+
+
+class NegotiationMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept"), "")
+        token = accept.set(header)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            accept.reset(token)
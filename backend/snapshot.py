@@ -0,0 +1,400 @@
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+import export
+import metrics
+import rollup
+import startup
+from database import POOL_SIZE, fetch_rows, read_frame
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.expanduser("~"), ".vat-snapshots"))
+# 0 disables the background sync; POST /snapshot/sync still works
+SNAPSHOT_SYNC_SECONDS = float(os.getenv("SNAPSHOT_SYNC_SECONDS", "0"))
+# Transactions per Parquet part written during a sync
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "100000"))
+# Parts per sales table before they are merged into one file
+SNAPSHOT_MAX_PARTS = int(os.getenv("SNAPSHOT_MAX_PARTS", "32"))
+SNAPSHOT_FETCH_SIZE = 50000
+
+# Sales tables only grow, so each sync appends the TransactionNumber range (low, high]
+FACT_TABLES = {
+    "Transaction": """
+        SELECT TransactionNumber, StoreID, Time, Total, SalesTax
+        FROM [Transaction]
+        WHERE TransactionNumber > ? AND TransactionNumber <= ?""",
+    "TransactionEntry": """
+        SELECT ID, TransactionNumber, StoreID, ItemID, Quantity, Price, Cost, SalesTax
+        FROM TransactionEntry
+        WHERE TransactionNumber > ? AND TransactionNumber <= ?""",
+}
+# Small enough to copy whole on every sync, which also picks up renames and price changes
+DIMENSION_TABLES = {
+    "Item": "SELECT ID, ItemLookupCode, Description, DepartmentID, TaxID, Price, Cost FROM Item",
+    "Department": "SELECT ID, Name FROM Department",
+    "Tax": "SELECT ID, Description, Percentage FROM Tax",
+    "Store": "SELECT ID, Name, StoreCode FROM Store",
+}
+# Copied when the source has it; /departments reads opening stock from it
+OPTIONAL_TABLES = {
+    "IX_ITEMOPENINGSTOCK": "SELECT DepartmentID, Department, Lookupcode, Quantity, Cost, Price FROM IX_ITEMOPENINGSTOCK",
+}
+# Empty stand-ins for optional tables the source lacks, so reports read no rows from them
+MISSING_TABLE_VIEWS = {
+    "IX_ITEMOPENINGSTOCK": (
+        "SELECT CAST(NULL AS INTEGER) AS DepartmentID, CAST(NULL AS VARCHAR) AS Department, "
+        "CAST(NULL AS VARCHAR) AS Lookupcode, CAST(NULL AS DOUBLE) AS Quantity, "
+        "CAST(NULL AS DOUBLE) AS Cost, CAST(NULL AS DOUBLE) AS Price WHERE false"
+    ),
+}
+
+# The report SQL is written for SQL Server; these cover every construct it uses
+TSQL_REWRITES = [
+    (re.compile(r"\[([^\]]+)\]"), r'"\1"'),
+    (re.compile(r"\bISNULL\s*\(", re.IGNORECASE), "COALESCE("),
+    (re.compile(r"\bGETDATE\s*\(\s*\)", re.IGNORECASE), "current_timestamp"),
+    (re.compile(r"\bdbo\.", re.IGNORECASE), ""),
+    (re.compile(r"\bWITH\s*\(\s*NOLOCK\s*\)", re.IGNORECASE), ""),
+]
+
+
+@lru_cache(maxsize=512)
+def translate(query):
+    for pattern, replacement in TSQL_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def python_type(type_code):
+    # DuckDB reports column types by name; the exporters expect Python types like pyodbc's
+    name = str(type_code).upper()
+    if name.startswith("DECIMAL"):
+        return Decimal
+    if "INT" in name:
+        return int
+    if name in ("DOUBLE", "FLOAT", "REAL"):
+        return float
+    if name.startswith("TIMESTAMP"):
+        return datetime
+    if name == "DATE":
+        return date
+    if name == "BOOLEAN":
+        return bool
+    return str
+
+
+class SnapshotCursor:
+    def __init__(self, engine):
+        self._cursor = engine.cursor()
+
+    def execute(self, query, params=None):
+        self._cursor.execute(translate(query), list(params) if params else None)
+        return self
+
+    @property
+    def description(self):
+        if self._cursor.description is None:
+            return None
+        return [(column[0], python_type(column[1])) + tuple(column[2:]) for column in self._cursor.description]
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SnapshotConnection:
+    # Reports read raw lines locally; the rollup only exists on the SQL Server
+    has_rollup = False
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def cursor(self):
+        return SnapshotCursor(self._engine)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SnapshotPool:
+    # Same acquire/release contract as ConnectionPool; DuckDB cursors are cheap, so no reuse
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def acquire(self):
+        if self.snapshot.engine is None:
+            raise Exception("Local snapshot is not open")
+        return SnapshotConnection(self.snapshot.engine)
+
+    def release(self, conn, broken=False):
+        conn.close()
+
+    def close(self):
+        pass
+
+
+def write_parquet(conn, query, params, path):
+    pa = startup.load("pyarrow")
+    pq = startup.load("pyarrow.parquet")
+    cursor = conn.cursor()
+    writer = None
+    rows_written = 0
+    try:
+        cursor.execute(query, params)
+        schema = pa.schema([
+            (column[0], export.arrow_type(column[1])) for column in cursor.description
+        ])
+        writer = pq.ParquetWriter(path + ".tmp", schema, compression="zstd")
+        while True:
+            rows = cursor.fetchmany(SNAPSHOT_FETCH_SIZE)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            rows_written += len(rows)
+    finally:
+        cursor.close()
+        if writer is not None:
+            writer.close()
+    os.replace(path + ".tmp", path)
+    return rows_written
+
+
+def quote_path(path):
+    return "'" + path.replace("\\", "/").replace("'", "''") + "'"
+
+
+class SnapshotDatabase:
+    # Same interface as Database, answering every query from a local Parquet copy
+    # of the source through an embedded DuckDB engine
+    has_rollup = False
+
+    def __init__(self, source, path=None, pool_size=POOL_SIZE):
+        self.source = source
+        self.server = source.server
+        self.database = source.database
+        self.path = path or os.path.join(SNAPSHOT_DIR, re.sub(r"[^\w.-]", "_", f"{source.server}_{source.database}"))
+        self.engine = None
+        self.pool = SnapshotPool(self)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="snapshot")
+        self._sync_lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _state_path(self):
+        return os.path.join(self.path, "state.json")
+
+    def _load_state(self):
+        try:
+            with open(self._state_path()) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {"high_water_mark": 0, "synced_at": None, "sync_id": 0, "files": {}, "rows": {}}
+
+    def _save_state(self, state):
+        with open(self._state_path() + ".tmp", "w") as handle:
+            json.dump(state, handle, indent=2)
+        os.replace(self._state_path() + ".tmp", self._state_path())
+
+    def connect(self):
+        duckdb = startup.optional("duckdb")
+        if duckdb is None or not export.HAS_PYARROW:
+            raise Exception("Local snapshots require duckdb and pyarrow to be installed")
+        os.makedirs(self.path, exist_ok=True)
+        self.engine = duckdb.connect()
+        try:
+            self.sync()
+        except Exception as e:
+            # Offline: keep answering from the last snapshot if there is one
+            if not self.state.get("synced_at"):
+                raise Exception(f"No local snapshot yet and the source is unreachable: {e}")
+            logger.warning("Source unreachable, using snapshot from %s: %s", self.state["synced_at"], e)
+            self._create_views()
+        return self
+
+    def sync(self, batch_size=SNAPSHOT_BATCH_SIZE):
+        with self._sync_lock:
+            started = time.perf_counter()
+            self._remove_unreferenced()
+            state = json.loads(json.dumps(self.state))
+            state["sync_id"] += 1
+            files = state["files"]
+            rows = state["rows"]
+            counter = itertools.count()
+
+            def part_name(table):
+                return f"{table}-{state['sync_id']:06d}-{next(counter):04d}.parquet"
+
+            with self.source.connection() as conn:
+                cursor = conn.cursor()
+                dimensions = dict(DIMENSION_TABLES)
+                for table, query in OPTIONAL_TABLES.items():
+                    if cursor.execute("SELECT OBJECT_ID(?)", table).fetchone()[0] is not None:
+                        dimensions[table] = query
+                    else:
+                        files.pop(table, None)
+                        rows.pop(table, None)
+                latest = cursor.execute("SELECT ISNULL(MAX(TransactionNumber), 0) FROM [Transaction]").fetchone()[0]
+                if latest < state["high_water_mark"]:
+                    # The source was restored or rebuilt; start the sales tables over
+                    state["high_water_mark"] = 0
+                    for table in FACT_TABLES:
+                        files[table] = []
+                        rows[table] = 0
+                low = state["high_water_mark"]
+                # Like the rollup, stop below a sale still being written, or it would be
+                # skipped for good once it commits
+                target = rollup.settled_transaction(cursor, low)
+                cursor.close()
+
+                for table, query in dimensions.items():
+                    name = part_name(table)
+                    rows[table] = write_parquet(conn, query, (), os.path.join(self.path, name))
+                    files[table] = [name]
+
+                ranges = [(start, min(start + batch_size, target)) for start in range(low, target, batch_size)]
+                if not files.get("Transaction"):
+                    # Even an empty first sync writes parts, so the views always have a schema
+                    ranges = ranges or [(low, low)]
+                for range_low, range_high in ranges:
+                    for table, query in FACT_TABLES.items():
+                        name = part_name(table)
+                        written = write_parquet(conn, query, (range_low, range_high), os.path.join(self.path, name))
+                        files.setdefault(table, []).append(name)
+                        rows[table] = rows.get(table, 0) + written
+
+            for table in FACT_TABLES:
+                if len(files[table]) > SNAPSHOT_MAX_PARTS:
+                    files[table] = [self._compact(table, files[table], part_name(table))]
+
+            state["high_water_mark"] = target
+            state["synced_at"] = datetime.now().isoformat(timespec="seconds")
+            self._save_state(state)
+            self.state = state
+            self._create_views()
+            self._remove_unreferenced()
+            return {
+                "high_water_mark": target,
+                "transactions_appended": target - low,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+
+    def _compact(self, table, names, target):
+        listing = ", ".join(quote_path(os.path.join(self.path, name)) for name in names)
+        path = os.path.join(self.path, target)
+        self.engine.execute(
+            f"COPY (SELECT * FROM read_parquet([{listing}])) TO {quote_path(path + '.tmp')} (FORMAT PARQUET, COMPRESSION ZSTD)"
+        )
+        os.replace(path + ".tmp", path)
+        return target
+
+    def _create_views(self):
+        for table, names in self.state["files"].items():
+            listing = ", ".join(quote_path(os.path.join(self.path, name)) for name in names)
+            self.engine.execute(f'CREATE OR REPLACE VIEW "{table}" AS SELECT * FROM read_parquet([{listing}])')
+        for table, query in MISSING_TABLE_VIEWS.items():
+            if table not in self.state["files"]:
+                self.engine.execute(f'CREATE OR REPLACE VIEW "{table}" AS {query}')
+
+    def _remove_unreferenced(self):
+        # Superseded parts and leftovers of an interrupted sync; files still open
+        # by a running query (Windows) are retried on the next sync
+        referenced = {name for names in self.state["files"].values() for name in names}
+        for name in os.listdir(self.path):
+            if name.endswith((".parquet", ".parquet.tmp")) and name not in referenced:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def status(self):
+        size = sum(
+            os.path.getsize(os.path.join(self.path, name))
+            for names in self.state["files"].values() for name in names
+            if os.path.exists(os.path.join(self.path, name))
+        )
+        return {
+            "path": self.path,
+            "high_water_mark": self.state["high_water_mark"],
+            "synced_at": self.state["synced_at"],
+            "rows": self.state["rows"],
+            "parts": {table: len(names) for table, names in self.state["files"].items()},
+            "bytes": size,
+        }
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        conn = self.pool.acquire()
+        acquired = time.perf_counter()
+        metrics.POOL_WAIT_SECONDS.observe(acquired - started, endpoint=metrics.endpoint.get())
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+            metrics.DB_CALL_SECONDS.observe(time.perf_counter() - acquired, endpoint=metrics.endpoint.get())
+
+    def _call(self, fn, args):
+        with self.connection() as conn:
+            return fn(conn, *args)
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, context.run, self._call, fn, args)
+
+    async def read_sql(self, query, params=None):
+        return await self.run(read_frame, query, params)
+
+    async def fetch_rows(self, query, params=None):
+        return await self.run(fetch_rows, query, params)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+        self.source.close()
+
+
+async def sync_loop(get_db, interval=SNAPSHOT_SYNC_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        db = get_db()
+        if not isinstance(db, SnapshotDatabase):
+            continue
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, db.sync)
+            if result["transactions_appended"]:
+                logger.info("Snapshot sync: %s", result)
+        except Exception as e:
+            logger.warning("Snapshot sync failed: %s", e)
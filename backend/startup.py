@@ -0,0 +1,149 @@
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+# Standard library only: the desktop build imports this before anything else, and the
+# health check is answered from here while FastAPI, pandas and the rest are still loading
+
+logger = logging.getLogger(__name__)
+
+# Set by the Electron shell to Date.now() when it spawns the backend, so the timings also
+# cover the bootloader and interpreter start that happen before any of this code runs
+APP_LAUNCHED_AT = os.getenv("APP_LAUNCHED_AT")
+IMPORTED_AT = time.time()
+
+HEALTH_BODY = b'{"Your backend is running":"Yes"}'
+
+
+class StartupTimer:
+    # Wall-clock phases since launch, in milliseconds, plus the first response and the
+    # first report response
+    def __init__(self, launched_at=None):
+        self.launched_at = launched_at or IMPORTED_AT
+        self.measured_from = "launch" if launched_at else "import"
+        self.phases = []
+        self.imports = {}
+        self.first_response_ms = None
+        self.first_report_ms = None
+        self._lock = threading.Lock()
+        self.mark("interpreter_ready", IMPORTED_AT)
+
+    def _elapsed_ms(self, at=None):
+        return round(((at or time.time()) - self.launched_at) * 1000, 1)
+
+    def mark(self, phase, at=None):
+        with self._lock:
+            self.phases.append((phase, self._elapsed_ms(at)))
+        logger.debug("Startup phase %s", phase)
+
+    def loaded(self, name, seconds):
+        with self._lock:
+            self.imports[name] = round(seconds * 1000, 1)
+        logger.info("Loaded %s on first use in %.0f ms", name, seconds * 1000)
+
+    def responded(self, path):
+        if self.first_report_ms is not None:
+            return
+        elapsed = self._elapsed_ms()
+        with self._lock:
+            if self.first_response_ms is None:
+                self.first_response_ms = elapsed
+                logger.info("First response after %.0f ms (since %s)", elapsed, self.measured_from)
+            if path != "/" and self.first_report_ms is None:
+                self.first_report_ms = elapsed
+                logger.info("First report response after %.0f ms (since %s)", elapsed, self.measured_from)
+
+    def report(self):
+        with self._lock:
+            phases, previous = [], 0.0
+            for phase, at_ms in self.phases:
+                phases.append({"phase": phase, "at_ms": at_ms, "took_ms": round(at_ms - previous, 1)})
+                previous = at_ms
+            return {
+                "measured_from": self.measured_from,
+                "phases": phases,
+                "lazy_imports_ms": dict(self.imports),
+                "time_to_first_response_ms": self.first_response_ms,
+                "time_to_first_report_ms": self.first_report_ms,
+            }
+
+
+timer = StartupTimer(float(APP_LAUNCHED_AT) / 1000 if APP_LAUNCHED_AT else None)
+
+
+def load(name):
+    # Heavy modules are imported on first use of a report rather than at startup. The
+    # import system's locks make this safe from the worker threads too.
+    first = name not in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    if first:
+        timer.loaded(name, time.perf_counter() - started)
+    return module
+
+
+def optional(name):
+    # Same for the optional ones, None when not installed
+    try:
+        return load(name)
+    except ImportError:
+        return None
+
+
+class LazyApp:
+    # ASGI app for the desktop build. GET / is answered as soon as the server listens,
+    # while the real app is imported in the background; other requests wait for it.
+    def __init__(self, module, attribute="app"):
+        self.module = module
+        self.attribute = attribute
+        self.app = None
+        self._loading = None
+        self._lifespan = None
+
+    def _import(self):
+        return getattr(importlib.import_module(self.module), self.attribute)
+
+    async def _load(self):
+        app = await asyncio.get_running_loop().run_in_executor(None, self._import)
+        # The real app's lifespan runs once it is imported, not at server start
+        self._lifespan = app.router.lifespan_context(app)
+        await self._lifespan.__aenter__()
+        self.app = app
+
+    def _loaded(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Backend failed to load", exc_info=task.exception())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._serve_lifespan(receive, send)
+            return
+        if self.app is None:
+            if scope["type"] == "http" and scope["path"] == "/" and scope["method"] in ("GET", "HEAD"):
+                await send({"type": "http.response.start", "status": 200,
+                            "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body", "body": HEALTH_BODY})
+                timer.responded("/")
+                return
+            await asyncio.shield(self._loading)
+        await self.app(scope, receive, send)
+
+    async def _serve_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                timer.mark("server_started")
+                self._loading = asyncio.ensure_future(self._load())
+                self._loading.add_done_callback(self._loaded)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._lifespan is not None:
+                    await self._lifespan.__aexit__(None, None, None)
+                elif self._loading is not None:
+                    self._loading.cancel()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
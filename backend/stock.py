@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from database import read_only
+
+logger = logging.getLogger(__name__)
+
+# How often a request may look for changes to IX_ITEMOPENINGSTOCK; in between the
+# cached stock is served without touching the database
+STOCK_CHECK_SECONDS = float(os.getenv("STOCK_CHECK_SECONDS", "30"))
+
+STOCK_QUERY = """
+    SELECT ios.DepartmentID, SUM(ios.Quantity * ios.Cost) AS StockOnHandCost
+    FROM IX_ITEMOPENINGSTOCK ios
+    GROUP BY ios.DepartmentID
+"""
+
+# Row count and the last write SQL Server recorded for the table: catalog lookups only
+CATALOG_SIGNATURE_QUERY = """
+    SELECT
+        (SELECT SUM(p.rows) FROM sys.partitions p
+         WHERE p.object_id = OBJECT_ID('dbo.IX_ITEMOPENINGSTOCK') AND p.index_id IN (0, 1)),
+        (SELECT MAX(us.last_user_update) FROM sys.dm_db_index_usage_stats us
+         WHERE us.database_id = DB_ID() AND us.object_id = OBJECT_ID('dbo.IX_ITEMOPENINGSTOCK'))
+"""
+# Without VIEW SERVER STATE: one narrow pass with no grouping
+CHECKSUM_SIGNATURE_QUERY = """
+    SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(DepartmentID, Quantity, Cost))
+    FROM IX_ITEMOPENINGSTOCK
+"""
+
+
+@read_only
+def read_signature(conn):
+    for query in (CATALOG_SIGNATURE_QUERY, CHECKSUM_SIGNATURE_QUERY):
+        cursor = conn.cursor()
+        try:
+            return tuple(cursor.execute(query).fetchone())
+        except Exception as e:
+            logger.debug("Stock signature query failed: %s", e)
+            conn.rollback()
+        finally:
+            cursor.close()
+    # Neither works (e.g. a local snapshot): reload every check interval
+    return None
+
+
+@read_only
+def read_stock(conn):
+    cursor = conn.cursor()
+    try:
+        rows = cursor.execute(STOCK_QUERY).fetchall()
+    finally:
+        cursor.close()
+    return {row[0]: float(row[1] or 0) for row in rows}
+
+
+class StockEntry:
+    def __init__(self, signature, by_department):
+        self.signature = signature
+        self.by_department = by_department
+        self.checked_at = time.monotonic()
+        self.loaded_at = datetime.now().isoformat(timespec="seconds")
+
+
+class StockSnapshot:
+    # Per-department stock-on-hand cost per database, reloaded only when the table changes
+    def __init__(self, check_interval=STOCK_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._locks = {}
+        self.reloads = 0
+        self.checks = 0
+
+    async def get(self, db):
+        scope = (db.server, db.database)
+        entry = self._entries.get(scope)
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            return entry.by_department
+
+        # Concurrent requests share one check and at most one reload
+        lock = self._locks.setdefault(scope, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(scope)
+            if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+                return entry.by_department
+            signature = await db.run(read_signature)
+            self.checks += 1
+            if entry is not None and signature is not None and signature == entry.signature:
+                entry.checked_at = time.monotonic()
+                return entry.by_department
+            by_department = await db.run(read_stock)
+            self.reloads += 1
+            self._entries[scope] = StockEntry(signature, by_department)
+            return by_department
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "reloads": self.reloads,
+            "check_interval_seconds": self.check_interval,
+            "databases": [
+                {"server": server, "database": database, "departments": len(entry.by_department),
+                 "loaded_at": entry.loaded_at}
+                for (server, database), entry in self._entries.items()
+            ],
+        }
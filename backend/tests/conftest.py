@@ -0,0 +1,151 @@
+# Reports run against an in-memory DuckDB "source" served through a local snapshot, so the
+# tests need neither SQL Server nor an ODBC driver
+import os
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+STATE_DIR = tempfile.mkdtemp(prefix="vat-tests-")
+os.environ.setdefault("CONNECTION_PROFILES_PATH", os.path.join(STATE_DIR, "profiles.db"))
+os.environ.setdefault("CLOSED_PERIODS_PATH", os.path.join(STATE_DIR, "closed-periods.db"))
+os.environ.setdefault("JOBS_DIR", os.path.join(STATE_DIR, "jobs"))
+
+SCHEMA = """
+CREATE TABLE "Transaction" (TransactionNumber INT, StoreID INT, Time TIMESTAMP, Total DECIMAL(19, 4), SalesTax DECIMAL(19, 4));
+CREATE TABLE TransactionEntry (ID INT, TransactionNumber INT, StoreID INT, ItemID INT, Quantity DOUBLE,
+                               Price DECIMAL(19, 4), Cost DECIMAL(19, 4), SalesTax DECIMAL(19, 4));
+CREATE TABLE Item (ID INT, ItemLookupCode VARCHAR, Description VARCHAR, DepartmentID INT, TaxID INT,
+                   Price DECIMAL(19, 4), Cost DECIMAL(19, 4));
+CREATE TABLE Department (ID INT, Name VARCHAR);
+CREATE TABLE Tax (ID INT, Description VARCHAR, Percentage REAL);
+CREATE TABLE Store (ID INT, Name VARCHAR, StoreCode VARCHAR);
+INSERT INTO Tax VALUES (1, 'Exempt', 0), (2, 'Standard', 16);
+INSERT INTO Store VALUES (1, 'Main', 'MAIN'), (2, 'Branch', 'BRANCH');
+INSERT INTO Department VALUES (1, 'FOOD'), (2, 'DRINK');
+INSERT INTO Item VALUES (1, 'BREAD', 'Bread', 1, 1, 10, 6), (2, 'SODA', 'Soda', 2, 2, 20, 12);
+"""
+# ItemID -> (price, cost, tax rate)
+ITEMS = {1: (10, 6, 0), 2: (20, 12, 0.16)}
+
+
+class SourceCursor:
+    # What the snapshot sync asks of a pyodbc cursor: lone parameters come unwrapped,
+    # OBJECT_ID only probes for the optional tables, which this source does not have, and
+    # every sale is committed whole, so the settled-transaction lock hints have nothing to skip
+    def __init__(self, engine):
+        import snapshot
+
+        self._cursor = snapshot.SnapshotCursor(engine)
+
+    def execute(self, query, params=None):
+        if "OBJECT_ID" in query:
+            query, params = "SELECT NULL", None
+        query = query.replace("WITH (READCOMMITTEDLOCK, READPAST)", "")
+        if params is not None and not isinstance(params, (list, tuple)):
+            params = [params]
+        self._cursor.execute(query, params)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SourceConnection:
+    def __init__(self, engine):
+        self._engine = engine
+
+    def cursor(self):
+        return SourceCursor(self._engine)
+
+    def close(self):
+        pass
+
+
+class Source:
+    server = "tests"
+    database = "sales"
+
+    def __init__(self):
+        duckdb = pytest.importorskip("duckdb")
+        self.engine = duckdb.connect()
+        self.engine.execute(SCHEMA)
+        self.last_transaction = 0
+        self.last_entry = 0
+
+    def sale(self, time, lines, store_id=1):
+        # lines are (ItemID, Quantity) pairs; returns the new TransactionNumber
+        self.last_transaction += 1
+        total = tax = 0
+        for item_id, quantity in lines:
+            price, cost, rate = ITEMS[item_id]
+            line_tax = round(quantity * price * rate, 2)
+            self.last_entry += 1
+            self.engine.execute(
+                "INSERT INTO TransactionEntry VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self.last_entry, self.last_transaction, store_id, item_id, quantity, price, cost, line_tax],
+            )
+            total += quantity * price + line_tax
+            tax += line_tax
+        self.engine.execute(
+            'INSERT INTO "Transaction" VALUES (?, ?, ?, ?, ?)', [self.last_transaction, store_id, time, total, tax]
+        )
+        return self.last_transaction
+
+    @contextmanager
+    def connection(self):
+        yield SourceConnection(self.engine)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def source():
+    return Source()
+
+
+@pytest.fixture
+def client(source, tmp_path, monkeypatch):
+    # The app answering from a snapshot of `source`; add sales before the first request
+    pytest.importorskip("pyarrow")
+    from fastapi.testclient import TestClient
+
+    import closing
+    import logic
+    from main import app
+    from snapshot import SnapshotDatabase
+
+    class App:
+        def __init__(self, test_client):
+            self.test_client = test_client
+            self.db = None
+
+        def connect(self):
+            if self.db is None:
+                self.db = SnapshotDatabase(source, path=str(tmp_path / "snapshot")).connect()
+                monkeypatch.setattr(logic, "db_instance", self.db)
+            logic.report_cache.clear()
+
+        def get(self, path, **params):
+            self.connect()
+            response = self.test_client.get(path, params=params)
+            assert response.status_code == 200, response.text
+            return response.json()
+
+        def post(self, path, json):
+            self.connect()
+            return self.test_client.post(path, json=json)
+
+    app_client = None
+
+    async def closing_db(connection):
+        return app_client.db
+
+    monkeypatch.setattr(logic, "closed_periods", closing.ClosedPeriodStore(str(tmp_path / "closed.db")))
+    monkeypatch.setattr(logic, "closing_db", closing_db)
+    with TestClient(app) as test_client:
+        app_client = App(test_client)
+        yield app_client
+        if app_client.db is not None:
+            app_client.db.close()
@@ -0,0 +1,78 @@
+import asyncio
+
+from cache import ReportCache
+
+
+class Database:
+    server = "tests"
+    database = "sales"
+
+    async def run(self, fn, *args):
+        return (1, "2024-01-01T00:00:00")
+
+
+def test_callers_get_their_own_copy():
+    async def scenario():
+        cache = ReportCache()
+        db = Database()
+
+        async def compute():
+            return {"departments": [{"DepartmentName": "b"}, {"DepartmentName": "a"}]}
+
+        first = await cache.get_or_compute(db, "vat-return", {}, compute)
+        first["departments"].sort(key=lambda row: row["DepartmentName"])
+        second = await cache.get_or_compute(db, "vat-return", {}, compute)
+        assert [row["DepartmentName"] for row in second["departments"]] == ["b", "a"]
+        assert cache.hits == 1
+
+    asyncio.run(scenario())
+
+
+def test_coalesced_callers_get_their_own_copy():
+    async def scenario():
+        cache = ReportCache()
+        db = Database()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return {"rows": [1, 2]}
+
+        waiting = [asyncio.ensure_future(cache.get_or_compute(db, "series", {}, compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        first, second = await asyncio.gather(*waiting)
+        assert first == second and first is not second
+        assert cache.coalesced == 1
+
+    asyncio.run(scenario())
+
+
+def test_query_running_across_clear_is_not_stored():
+    async def scenario():
+        cache = ReportCache()
+        db = Database()
+        started, release = asyncio.Event(), asyncio.Event()
+        calls = []
+
+        async def stale():
+            calls.append("stale")
+            started.set()
+            await release.wait()
+            return "old connection"
+
+        async def fresh():
+            calls.append("fresh")
+            return "new connection"
+
+        running = asyncio.ensure_future(cache.get_or_compute(db, "vat-return", {}, stale))
+        await started.wait()
+        cache.clear()
+        # Does not join the query started before clear()
+        assert await cache.get_or_compute(db, "vat-return", {}, fresh) == "new connection"
+        release.set()
+        assert await running == "old connection"
+        assert await cache.get_or_compute(db, "vat-return", {}, fresh) == "new connection"
+        assert calls == ["stale", "fresh"]
+
+    asyncio.run(scenario())
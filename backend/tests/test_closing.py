@@ -0,0 +1,103 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import closing
+
+SCOPE = ("tests", "sales")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = closing.ClosedPeriodStore(str(tmp_path / "closed.db"))
+    store.start()
+    return store
+
+
+def close(store, start_date, end_date):
+    results = {("vat-return", None): {"departments": [], "summary": {"total_sales_exclusive": 1.0}}}
+    return store.close(SCOPE, start_date, end_date, results)
+
+
+def test_periods_sharing_a_boundary_day_overlap(store):
+    close(store, "2024-01-01", "2024-01-31")
+    assert store.overlapping(SCOPE, "2024-01-31", "2024-02-29")
+    assert store.overlapping(SCOPE, "2023-12-01", "2024-01-01")
+    with pytest.raises(closing.PeriodOverlap):
+        close(store, "2024-01-31", "2024-02-29")
+    assert not store.overlapping(SCOPE, "2024-02-01", "2024-02-29")
+    close(store, "2024-02-01", "2024-02-29")
+    assert [period["start_date"] for period in store.list(SCOPE)] == ["2024-01-01", "2024-02-01"]
+
+
+def test_covering_takes_periods_wholly_inside_the_range(store):
+    close(store, "2024-01-01", "2024-01-31")
+    close(store, "2024-02-01", "2024-02-29")
+    assert [period["start_date"] for period in store.covering(SCOPE, "2024-01-01", "2024-02-29")] == ["2024-01-01", "2024-02-01"]
+    assert [period["start_date"] for period in store.covering(SCOPE, "2024-01-02", "2024-03-31")] == ["2024-02-01"]
+    assert store.covering(("other", "sales"), "2024-01-01", "2024-12-31") == []
+
+
+def test_verify_detects_a_changed_result(store):
+    period = close(store, "2024-01-01", "2024-01-31")
+    assert store.verify(period["id"])["ok"]
+    assert store.verify(period["id"] + 1) is None
+
+    with sqlite3.connect(store.path) as conn:
+        conn.execute("DROP TRIGGER closed_result_no_update")
+        conn.execute("UPDATE closed_result SET content = ? WHERE period_id = ?", (b'{"tampered": true}', period["id"]))
+    result = store.verify(period["id"])
+    assert not result["ok"]
+    assert result["mismatched"] == [{"report": "vat-return", "store_id": None}]
+    with pytest.raises(closing.ClosedPeriodCorrupt):
+        store.load(period["id"], "vat-return")
+
+
+def test_closed_store_rejects_changes(store):
+    period = close(store, "2024-01-01", "2024-01-31")
+    with sqlite3.connect(store.path) as conn, pytest.raises(sqlite3.IntegrityError):
+        conn.execute("DELETE FROM closed_period WHERE id = ?", (period["id"],))
+
+
+def test_closed_periods_and_gaps_count_boundary_days_once(client, source):
+    # Sales on the first and last instants of each closed period and of the gaps around them
+    for day in ("2024-01-01", "2024-01-09", "2024-01-10", "2024-01-20", "2024-01-21", "2024-01-31"):
+        source.sale(datetime.fromisoformat(day), [(1, 1), (2, 1)])
+        source.sale(datetime.fromisoformat(day).replace(hour=23, minute=59, second=59), [(2, 2)], store_id=2)
+
+    open_return = client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-31")
+    open_summary = client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-31")
+
+    response = client.post("/periods/close", json={"start_date": "2024-01-10", "end_date": "2024-01-20"})
+    assert response.status_code == 201, response.text
+    clash = client.post("/periods/close", json={"start_date": "2024-01-20", "end_date": "2024-01-25"})
+    assert clash.status_code == 409
+
+    assert client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-31") == open_return
+    assert client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-31") == open_summary
+    assert open_summary["summary"]["total_transactions"] == 12
+
+
+def test_closed_and_open_days_round_once(client, source):
+    # Neither the closed day's nor either open day's sales reach a cent alone
+    for day in (1, 2, 3):
+        source.sale(datetime(2024, 1, day, 12), [(1, 0.0004)])
+    open_return = client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-03")
+    open_summary = client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-03")
+
+    response = client.post("/periods/close", json={"start_date": "2024-01-02", "end_date": "2024-01-02"})
+    assert response.status_code == 201, response.text
+
+    assert client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-03") == open_return
+    assert client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-03", partition_days=1)["summary"] == open_return["summary"]
+    assert client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-03") == open_summary
+    assert open_return["summary"]["total_sales_exclusive"] == 0.01
+
+
+def test_close_period_needs_an_ended_range(client):
+    single_day = client.post("/periods/close", json={"start_date": "2024-01-05", "end_date": "2024-01-05"})
+    assert single_day.status_code == 201, single_day.text
+    today = datetime.now().date().isoformat()
+    assert client.post("/periods/close", json={"start_date": "2024-02-01", "end_date": today}).status_code == 400
+    assert client.post("/periods/close", json={"start_date": "2024-02-02", "end_date": "2024-02-01"}).status_code == 400
@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+
+import pytest
+
+import database
+
+
+class Database(database.Database):
+    def __init__(self):
+        self.calls = 0
+
+    @contextmanager
+    def connection(self):
+        yield None
+
+
+def dies(db):
+    # The first call loses its connection
+    def fn(conn):
+        db.calls += 1
+        if db.calls == 1:
+            raise ConnectionError("Communication link failure")
+        return "answer"
+    return fn
+
+
+def test_only_reads_retry_on_a_fresh_connection(monkeypatch):
+    monkeypatch.setattr(database, "is_connection_error", lambda error: True)
+    db = Database()
+    assert db._call(database.read_only(dies(db)), ()) == "answer"
+    assert db.calls == 2
+
+    db = Database()
+    with pytest.raises(ConnectionError):
+        db._call(dies(db), ())
+    assert db.calls == 1
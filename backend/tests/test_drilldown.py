@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import drilldown
+
+
+def test_parse_after():
+    assert drilldown.parse_after(None, "sales") is None
+    assert drilldown.parse_after("1234.50,17", "sales") == ("1234.50", 17)
+    assert drilldown.parse_after("-3,2", "quantity") == ("-3", 2)
+    assert drilldown.parse_after("9001,40", "transaction") == (9001, 40)
+    # Item codes may contain commas; the row ID is after the last one
+    assert drilldown.parse_after("A,B,C,5", "code") == ("A,B,C", 5)
+    assert drilldown.parse_after(",5", "code") == ("", 5)
+
+
+@pytest.mark.parametrize("after, sort", [
+    ("17", "sales"),
+    ("abc,17", "sales"),
+    ("NaN,17", "tax"),
+    ("Infinity,17", "amount"),
+    ("12.5,17", "transaction"),
+    ("12,x", "code"),
+])
+def test_parse_after_rejects_foreign_cursors(after, sort):
+    with pytest.raises(ValueError):
+        drilldown.parse_after(after, sort)
+
+
+def test_parse_order():
+    assert drilldown.parse_order(drilldown.ITEM_SORTS, "code", None)[2] == "ASC"
+    assert drilldown.parse_order(drilldown.ITEM_SORTS, "sales", "Asc")[2] == "ASC"
+    with pytest.raises(ValueError):
+        drilldown.parse_order(drilldown.ITEM_SORTS, "amount", None)
+    with pytest.raises(ValueError):
+        drilldown.parse_order(drilldown.LINE_SORTS, "amount", "up")
+
+
+def test_seek_clause():
+    assert drilldown.seek_clause("k.SortKey", "k.ItemID", "?", "DESC", None) == ("", ())
+    clause, params = drilldown.seek_clause("k.SortKey", "k.ItemID", "CAST(? AS DECIMAL(19, 2))", "DESC", ("12.50", 7))
+    assert clause == (
+        " AND (k.SortKey < CAST(? AS DECIMAL(19, 2))"
+        " OR (k.SortKey = CAST(? AS DECIMAL(19, 2)) AND k.ItemID < ?))"
+    )
+    assert params == ("12.50", "12.50", 7)
+    clause, _ = drilldown.seek_clause("te.TransactionNumber", "te.ID", "?", "ASC", (5, 9))
+    assert clause == " AND (te.TransactionNumber > ? OR (te.TransactionNumber = ? AND te.ID > ?))"
+
+
+def test_next_after():
+    rows = [{"SortKey": 30, "LineID": 3}, {"SortKey": 20, "LineID": 2}, {"SortKey": 20, "LineID": 1}]
+    page, cursor = drilldown.next_after([dict(row) for row in rows], 2, "LineID")
+    assert page == [{"LineID": 3}, {"LineID": 2}]
+    assert cursor == "20,2"
+    page, cursor = drilldown.next_after([dict(row) for row in rows], 3, "LineID")
+    assert len(page) == 3 and cursor is None
+
+
+@pytest.mark.parametrize("sort, order", [("transaction", None), ("amount", None), ("amount", "asc")])
+def test_line_pages_neither_skip_nor_repeat(client, source, sort, order):
+    # Equal amounts on many lines, so pages break inside runs of tied keys
+    start = datetime(2024, 5, 1)
+    for index in range(23):
+        source.sale(start + timedelta(hours=index), [(1, 1 + index % 3), (2, 1)], store_id=1 + index % 2)
+
+    params = {"start_date": "2024-05-01", "end_date": "2024-05-31", "sort": sort, "limit": 4}
+    if order:
+        params["order"] = order
+    seen = []
+    after = None
+    while True:
+        page = client.get("/drilldown/lines", **params, **({"after": after} if after else {}))
+        seen.extend(row["LineID"] for row in page["rows"])
+        after = page["next_after"]
+        if after is None:
+            break
+    assert sorted(seen) == list(range(1, 47))
@@ -0,0 +1,23 @@
+import federation
+
+
+def rate(vat_rate, department):
+    return {"vat_rate": vat_rate, "department": department, "item_count": 1, "total_sales": 1.0, "total_vat": 0.0}
+
+
+def test_merges_order_rows_like_a_single_database():
+    rates = federation.merge_vat_rates([
+        {"vat_rates": [rate(16.0, "drinks"), rate(None, "FOOD")]},
+        {"vat_rates": [rate(16.0, "Bakery"), rate(0.0, None)]},
+    ])
+    assert [(row["vat_rate"], row["department"]) for row in rates["vat_rates"]] == [
+        (None, "FOOD"), (0.0, None), (16.0, "Bakery"), (16.0, "drinks"),
+    ]
+
+    returns = [
+        {"departments": [{"DepartmentName": name, **dict.fromkeys(federation.VAT_RETURN_MEASURES, 1.0)}],
+         "summary": dict.fromkeys(federation.VAT_RETURN_SUMMARY, 1.0)}
+        for name in ("drinks", "Bakery", None)
+    ]
+    merged = federation.merge_vat_return(returns)
+    assert [row["DepartmentName"] for row in merged["departments"]] == [None, "Bakery", "drinks"]
@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime
+
+import livefeed
+
+
+class Database:
+    server = "tests"
+    database = "sales"
+
+    def __init__(self, latest):
+        self.latest = latest
+
+    async def run(self, fn, *args):
+        return self.latest
+
+
+async def never_disconnected():
+    return False
+
+
+def test_stream_subscribes_only_once_iterated():
+    async def scenario():
+        feed = livefeed.LiveFeed(Database(7), dimension_cache=None, interval=60)
+        stream = feed.stream(never_disconnected)
+        # A client gone before the response started: nothing to clean up
+        assert not feed.subscribers and feed.task is None
+        await stream.aclose()
+        assert not feed.subscribers and feed.task is None
+
+        stream = feed.stream(never_disconnected)
+        assert (await stream.__anext__()).startswith(b"event: hello")
+        assert len(feed.subscribers) == 1 and feed.task is not None
+        assert (await stream.__anext__()).startswith(b"event: ready\nid: 7")
+        await stream.aclose()
+        assert not feed.subscribers and feed.task is None
+
+    asyncio.run(scenario())
+
+
+def test_read_settled_on_a_snapshot(client, source):
+    source.sale(datetime(2024, 1, 1), [(1, 1)])
+    source.sale(datetime(2024, 1, 2), [(2, 1)])
+    client.connect()
+    assert asyncio.run(client.db.run(livefeed.read_settled)) == 2
@@ -0,0 +1,76 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import partitions
+
+
+def test_split_range_partitions_share_no_day():
+    assert partitions.split_range("2024-01-01", "2024-01-10", 3) == [
+        ("2024-01-01", "2024-01-03"),
+        ("2024-01-04", "2024-01-06"),
+        ("2024-01-07", "2024-01-09"),
+        ("2024-01-10", "2024-01-10"),
+    ]
+    assert partitions.split_range("2024-01-01", "2024-01-09", 3)[-1] == ("2024-01-07", "2024-01-09")
+
+
+def test_split_range_shorter_than_a_partition():
+    assert partitions.split_range("2024-02-28", "2024-03-01", 30) == [("2024-02-28", "2024-03-01")]
+    assert partitions.split_range("2024-02-28", "2024-02-28", 1) == [("2024-02-28", "2024-02-28")]
+
+
+@pytest.mark.parametrize("days", [1, 2, 7, 31])
+def test_split_range_covers_every_day_once(days):
+    ranges = partitions.split_range("2023-12-30", "2024-03-02", days)
+    assert ranges[0][0] == "2023-12-30" and ranges[-1][1] == "2024-03-02"
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert date.fromisoformat(start) - date.fromisoformat(end) == timedelta(days=1)
+
+
+def test_partitioned_totals_match_with_sales_at_boundary_midnight(client, source):
+    # 2024-01-04 and 2024-01-07 start the second and third 3-day partitions
+    for time in ("2024-01-01 00:00", "2024-01-03 23:59:59", "2024-01-04 00:00", "2024-01-07 00:00", "2024-01-10 00:00"):
+        source.sale(datetime.fromisoformat(time), [(1, 1), (2, 2)])
+    source.sale(datetime(2024, 1, 7), [(2, 1)], store_id=2)
+
+    for path in ("/vat-return", "/vat-summary"):
+        whole = client.get(path, start_date="2024-01-01", end_date="2024-01-10")
+        split = client.get(path, start_date="2024-01-01", end_date="2024-01-10", partition_days=3)
+        assert len(split.pop("partitioning")["partitions"]) == 4
+        assert split == whole
+    summary = client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-10")["summary"]
+    assert summary["total_transactions"] == 6
+
+
+def test_ranges_are_not_split_unless_asked(client, source):
+    source.sale(datetime(2024, 1, 1), [(1, 1)])
+    assert "partitioning" not in client.get("/vat-return", start_date="2024-01-01", end_date="2024-12-31")
+    assert "partitioning" not in client.get("/vat-return", start_date="2024-01-01", end_date="2024-12-31", partition_days=0)
+
+
+def test_partitioned_totals_round_once(client, source):
+    # Each day's sales round to nothing, the period's do not
+    for day in range(1, 11):
+        source.sale(datetime(2024, 1, day, 12), [(1, 0.0004)])
+
+    for path in ("/vat-return", "/vat-summary"):
+        whole = client.get(path, start_date="2024-01-01", end_date="2024-01-10")
+        split = client.get(path, start_date="2024-01-01", end_date="2024-01-10", partition_days=1)
+        split.pop("partitioning")
+        assert split == whole
+    assert whole["summary"]["total_sales_excl_vat"] == 0.04
+    assert client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-10", partition_days=3)["summary"]["total_sales_exclusive"] == 0.04
+
+
+def test_partitioned_buckets_match_unsplit(client, source):
+    # Weeks and months straddle partitions, whose exact partials are summed before conversion
+    for day in range(1, 61):
+        source.sale(datetime(2024, 1, 1, 12) + timedelta(days=day), [(1, 0.1 * day), (2, 0.37)])
+
+    for granularity in ("week", "month"):
+        params = dict(start_date="2024-01-01", end_date="2024-03-01", granularity=granularity)
+        whole = client.get("/vat-summary", **params)
+        split = client.get("/vat-summary", partition_days=5, **params)
+        split.pop("partitioning")
+        assert split == whole
@@ -0,0 +1,68 @@
+from datetime import date, datetime
+
+import pytest
+
+import periods
+
+
+def test_parse_period_includes_both_days():
+    assert periods.parse_period("2024-03-01:2024-03-31") == (date(2024, 3, 1), date(2024, 3, 31))
+    assert periods.parse_period("2024-03-05:2024-03-05") == (date(2024, 3, 5), date(2024, 3, 5))
+    with pytest.raises(ValueError):
+        periods.parse_period("2024-03-31:2024-03-01")
+
+
+def test_day_after():
+    assert periods.day_after("2024-02-28") == "2024-02-29"
+    assert periods.day_after(date(2024, 12, 31)) == "2025-01-01"
+
+
+def test_generate_periods_clips_to_the_range():
+    assert periods.generate_periods(date(2024, 1, 15), date(2024, 7, 10), "quarter") == [
+        (date(2024, 1, 15), date(2024, 3, 31)),
+        (date(2024, 4, 1), date(2024, 6, 30)),
+        (date(2024, 7, 1), date(2024, 7, 10)),
+    ]
+
+
+def test_generate_periods_fiscal_year():
+    assert periods.generate_periods(date(2024, 1, 1), date(2024, 12, 31), "year", fiscal_year_start_month=7) == [
+        (date(2024, 1, 1), date(2024, 6, 30)),
+        (date(2024, 7, 1), date(2024, 12, 31)),
+    ]
+
+
+def test_generate_buckets_are_calendar_aligned():
+    # 2024-03-06 is a Wednesday
+    assert periods.generate_buckets(date(2024, 3, 6), date(2024, 3, 12), "week") == [
+        (date(2024, 3, 4), date(2024, 3, 11)),
+        (date(2024, 3, 11), date(2024, 3, 18)),
+    ]
+    assert periods.generate_buckets(date(2024, 11, 20), date(2025, 1, 5), "quarter") == [
+        (date(2024, 10, 1), date(2025, 1, 1)),
+        (date(2025, 1, 1), date(2025, 4, 1)),
+    ]
+
+
+def test_reports_include_the_whole_end_day(client, source):
+    source.sale(datetime(2024, 2, 29, 23, 59, 59), [(1, 1)])
+    source.sale(datetime(2024, 3, 1, 0, 0), [(1, 2), (2, 1)])
+    source.sale(datetime(2024, 3, 31, 0, 0), [(2, 2)], store_id=2)
+    source.sale(datetime(2024, 3, 31, 23, 59, 59), [(2, 3)])
+    source.sale(datetime(2024, 4, 1, 0, 0), [(1, 5)])
+
+    vat_return = client.get("/vat-return", start_date="2024-03-01", end_date="2024-03-31")
+    by_period = client.get("/vat-return/periods", periods="2024-03-01:2024-03-31")["periods"]
+    assert len(by_period) == 1
+    assert by_period[0]["departments"] == vat_return["departments"]
+    assert by_period[0]["summary"] == vat_return["summary"]
+    # 2 bread and 6 sodas, none of the sales on either side of March
+    assert vat_return["summary"]["total_sales_exclusive"] == 140.0
+
+    summary = client.get("/vat-summary", start_date="2024-03-01", end_date="2024-03-31")["summary"]
+    assert summary["total_transactions"] == 3
+    assert summary["total_sales_excl_vat"] == vat_return["summary"]["total_sales_exclusive"]
+    assert summary["total_vat_amount"] == vat_return["summary"]["total_sales_tax"]
+
+    rates = client.get("/vat-rates", start_date="2024-03-01", end_date="2024-03-31")["vat_rates"]
+    assert sum(rate["total_sales"] for rate in rates) == 140.0
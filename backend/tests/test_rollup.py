@@ -0,0 +1,39 @@
+import pytest
+
+import rollup
+
+
+class Cursor:
+    def __init__(self, row):
+        self.row = row
+
+    def execute(self, query, params=None):
+        return self
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.mark.parametrize("row, expected", [
+    # (last before the first uncommitted sale, latest sale past the mark)
+    ((None, None), 100),
+    ((None, 140), 140),
+    ((119, 140), 119),
+    # The first sale past the mark is still being written
+    ((100, 140), 100),
+])
+def test_settled_transaction_stops_below_uncommitted_sales(row, expected):
+    assert rollup.settled_transaction(Cursor(row), 100) == expected
+
+
+@pytest.mark.parametrize("source", [
+    lambda hwm: rollup.sales_source(hwm, "2024-01-01", "2024-01-31"),
+    lambda hwm: rollup.header_source(hwm, "2024-01-01", "2024-01-31"),
+    lambda hwm: rollup.daily_department_source(hwm, "2024-01-01", "2024-01-31"),
+    lambda hwm: rollup.daily_department_source(hwm, "2024-01-01", "2024-01-31", 3),
+])
+@pytest.mark.parametrize("hwm", [None, 500])
+def test_sources_bind_every_parameter(source, hwm):
+    query, params = source(hwm)
+    assert query.count("?") == len(params)
+    assert "2024-02-01" in params and "2024-01-31" not in params
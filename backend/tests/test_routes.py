@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def synced(client, monkeypatch):
+    import logic
+
+    calls = []
+    monkeypatch.setattr(logic.connections, "sync", lambda: calls.append(True))
+    return calls
+
+
+def test_service_routes_skip_the_profile_store(client, synced):
+    for path in ("/", "/metrics", "/startup", "/cache/stats", "/live/status", "/jobs"):
+        assert client.test_client.get(path).status_code == 200
+    assert synced == []
+
+
+def test_report_routes_pick_up_profile_changes(client, synced):
+    client.get("/vat-return", start_date="2024-01-01", end_date="2024-01-31")
+    assert synced == [True]
@@ -0,0 +1,78 @@
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import shaping
+
+
+def test_converters_clean_nulls_and_non_finite_values():
+    assert shaping.number(None) == 0.0
+    assert shaping.number(Decimal("1.25")) == 1.25
+    assert shaping.number(math.nan) == 0.0
+    assert shaping.money(Decimal("2.346")) == 2.35
+    assert math.copysign(1, shaping.money(-0.001)) == 1.0
+    assert shaping.integer(None) == 0
+    assert shaping.integer(math.inf) == 0
+    assert shaping.integer(Decimal("7")) == 7
+    assert shaping.nullable_number(None) is None
+    assert shaping.nullable_number(-math.inf) is None
+    assert shaping.text("x") == "x"
+
+
+def test_shape_converts_named_columns_only():
+    columns = ["DepartmentName", "SalesExclusive", "LineCount"]
+    rows = [("FOOD", Decimal("10.005"), None), (None, None, 3)]
+    records = shaping.shape(columns, rows, {"SalesExclusive": shaping.money, "LineCount": shaping.integer})
+    assert records == [
+        {"DepartmentName": "FOOD", "SalesExclusive": round(10.005, 2), "LineCount": 0},
+        {"DepartmentName": None, "SalesExclusive": 0.0, "LineCount": 3},
+    ]
+    assert shaping.shape(columns, [], {}) == []
+
+
+def test_column_total_rounds_the_exact_sum():
+    records = [{"v": 0.1}] * 10
+    assert shaping.column_total(records, "v") == 1.0
+
+
+def test_dumps_plain_and_database_types():
+    content = {"amount": Decimal("1.50"), "day": date(2024, 1, 2), "at": datetime(2024, 1, 2, 3, 4, 5)}
+    assert json.loads(shaping.dumps(content)) == {"amount": 1.5, "day": "2024-01-02", "at": "2024-01-02T03:04:05"}
+    with pytest.raises(TypeError):
+        shaping.dumps({"value": object()})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", shaping.JSON),
+    ("text/html", shaping.JSON),
+    ("application/x-msgpack", shaping.MSGPACK),
+    ("application/json;q=0.5, application/vnd.apache.arrow.stream", shaping.ARROW),
+    ("application/vnd.apache.arrow.stream;q=0, application/json", shaping.JSON),
+    ("application/x-msgpack;q=0.9, application/json;q=0.9", shaping.MSGPACK),
+])
+def test_negotiate(header, expected):
+    if expected not in shaping.ENCODERS:
+        pytest.skip(f"{expected} encoder not installed")
+    assert shaping.negotiate(header) == expected
+
+
+def test_report_formats(client, source):
+    msgpack = pytest.importorskip("msgpack")
+    source.sale(datetime(2024, 1, 1, 12), [(1, 1), (2, 2)])
+    params = {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+    as_json = client.get("/vat-return", **params)
+
+    response = client.test_client.get("/vat-return", params=params, headers={"Accept": shaping.MSGPACK})
+    assert response.headers["content-type"].startswith(shaping.MSGPACK)
+    assert "Accept" in response.headers["vary"]
+    assert msgpack.unpackb(response.content) == as_json
+
+    if shaping.ARROW in shaping.ENCODERS:
+        import pyarrow
+
+        response = client.test_client.get("/vat-return", params=params, headers={"Accept": shaping.ARROW})
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        assert table.to_pylist() == [as_json]
@@ -0,0 +1,27 @@
+import asyncio
+from datetime import datetime
+
+import livefeed
+import rollup
+
+
+def test_sync_stops_below_a_sale_still_being_written(client, source, monkeypatch):
+    for day in (1, 2, 3):
+        source.sale(datetime(2024, 1, day), [(1, 1)])
+    settled_transaction = rollup.settled_transaction
+    # Transaction 2 has its number but has not committed yet
+    monkeypatch.setattr(rollup, "settled_transaction", lambda cursor, after: 1)
+    client.connect()
+    assert asyncio.run(client.db.run(livefeed.read_settled)) == 1
+
+    monkeypatch.setattr(rollup, "settled_transaction", settled_transaction)
+    assert client.db.sync()["transactions_appended"] == 2
+    assert client.get("/vat-summary", start_date="2024-01-01", end_date="2024-01-03")["summary"]["total_transactions"] == 3
+
+
+def test_departments_without_opening_stock(client, source):
+    # The source has no IX_ITEMOPENINGSTOCK, which the snapshot then holds as empty
+    source.sale(datetime(2024, 1, 1), [(1, 1), (2, 1)])
+    departments = client.get("/departments", start_date="2024-01-01", end_date="2024-01-01")["departments"]
+    assert [row["DepartmentName"] for row in departments] == ["DRINK", "FOOD"]
+    assert all(row["StockOnHandCost"] == 0 for row in departments)
@@ -1,5 +1,6 @@
 // electron/main.js
 const { app, BrowserWindow } = require('electron');
+const fs = require('fs');
 const path = require('path');
 const { spawn } = require('child_process');
 const axios = require('axios');
@@ -24,8 +25,14 @@ function createWindow() {
 // Start backend and wait until it's ready
 function startBackendAndWait() {
   return new Promise((resolve, reject) => {
-    const backendPath = path.join(__dirname, '../backend/dist/main.exe');
-    const backend = spawn(backendPath);
+    // The onedir build (dist/main/) starts without unpacking; dist/main.exe is the onefile one
+    const onedirPath = path.join(__dirname, '../backend/dist/main/main.exe');
+    const backendPath = fs.existsSync(onedirPath) ? onedirPath : path.join(__dirname, '../backend/dist/main.exe');
+    const launchedAt = Date.now();
+    // The backend measures its startup phases from this moment (GET /startup)
+    const backend = spawn(backendPath, [], {
+      env: { ...process.env, APP_LAUNCHED_AT: String(launchedAt) },
+    });
     backend.stdout.on('data', (data) => console.log(`BACKEND: ${data}`));
     backend.stderr.on('data', (data) => console.error(`BACKEND ERROR: ${data}`));
 
@@ -33,9 +40,10 @@ function startBackendAndWait() {
     const checkBackend = async () => {
       try {
         await axios.get('http://127.0.0.1:8000'); // use your backend URL
+        console.log(`Backend answered ${Date.now() - launchedAt} ms after launch`);
         resolve();
       } catch (err) {
-        setTimeout(checkBackend, 500);
+        setTimeout(checkBackend, 100);
       }
     };
     checkBackend();
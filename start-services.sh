@@ -1,6 +1,9 @@
 #!/bin/bash
-# Start FastAPI backend in background
-uvicorn main:app --host 0.0.0.0 --port 8000 &
+# Start FastAPI backend in background, two workers unless WEB_CONCURRENCY is set. Workers
+# share connections through the profile store, so any of them can serve a request; report
+# caches, live feeds and /metrics are per worker.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-2}"
+uvicorn main:app --host 0.0.0.0 --port 8000 --workers "$WEB_CONCURRENCY" &
 
 # Start Nginx in foreground
 nginx -g "daemon off;"
\ No newline at end of file